@@ -0,0 +1,116 @@
+# automatic, workload-balanced assignment of CPAs and assistants to unassigned clients.
+import heapq
+from collections import namedtuple
+
+import database
+import entity_cache
+from connection_pool import get_connection
+
+ROLES = ("cpa", "assistant")
+
+Assignment = namedtuple("Assignment", ["client_id", "cpa_id", "assistant_id"])
+StaffLoad = namedtuple("StaffLoad", ["name", "clients", "income"])
+
+
+class AssignmentPlan(namedtuple("AssignmentPlan", ["assignments", "loads", "unassigned", "updated"])):
+    """
+    The result of `plan_assignments` / `auto_assign`.
+
+    assignments: list of `Assignment`; a None id means no staff member of that role had capacity left.
+    loads: {"cpa": {staff_id: StaffLoad}, "assistant": {...}} with the workloads after the assignment.
+    unassigned: {"cpa": n, "assistant": n} clients that still need a CPA/assistant because every cap was reached.
+    updated: number of clients written to the database, or None for a dry run.
+    """
+
+
+def _assign_role(clients, workloads, weighted, capacity):
+    """
+    Gives every client to the staff member with the lowest load, using a min-heap of
+    (load, client count, staff id). The load is the client count, or the summed income when `weighted`.
+    Staff members at `capacity` clients leave the heap.
+
+    Returns:
+        tuple: ({client_id: staff_id or None}, {staff_id: StaffLoad}).
+    """
+    heap = [(load.income if weighted else load.clients, load.clients, staff_id)
+            for staff_id, load in workloads.items() if capacity is None or load.clients < capacity]
+    heapq.heapify(heap)
+    income = {staff_id: load.income for staff_id, load in workloads.items()}
+    chosen = {}
+    for client_id, client_income in clients:
+        if not heap:
+            chosen[client_id] = None
+            continue
+        _, count, staff_id = heap[0]
+        count += 1
+        income[staff_id] += client_income
+        load = income[staff_id] if weighted else count
+        if capacity is None or count < capacity:
+            heapq.heapreplace(heap, (load, count, staff_id))
+        else:
+            heapq.heappop(heap)
+        chosen[client_id] = staff_id
+        workloads[staff_id] = workloads[staff_id]._replace(clients=count, income=income[staff_id])
+    return chosen, workloads
+
+
+def plan_assignments(workloads, unassigned_clients, weighted=False, max_clients_per_cpa=None,
+                     max_clients_per_assistant=None):
+    """
+    Computes balanced assignments without touching the database.
+
+    Args:
+        workloads (list of tuple): (role, staff_id, name, client_count, summed_income) rows,
+            see `database.get_staff_workloads`.
+        unassigned_clients (list of tuple): (client_id, income, needs_cpa, needs_assistant) rows,
+            see `database.get_unassigned_clients`.
+        weighted (bool): Balance the summed client income instead of the number of clients. Clients are then
+            handed out largest income first, which keeps the final loads close together.
+        max_clients_per_cpa (int): Optional cap on the total number of clients per CPA.
+        max_clients_per_assistant (int): Optional cap on the total number of clients per assistant.
+    Returns:
+        AssignmentPlan: The plan, with `updated` set to None.
+    """
+    loads = {role: {} for role in ROLES}
+    for role, staff_id, name, client_count, income in workloads:
+        loads[role][staff_id] = StaffLoad(name, client_count, income)
+    if weighted:
+        unassigned_clients = sorted(unassigned_clients, key=lambda row: row[1], reverse=True)
+    capacities = {"cpa": max_clients_per_cpa, "assistant": max_clients_per_assistant}
+    chosen = {}
+    for index, role in enumerate(ROLES):
+        clients = [(row[0], row[1]) for row in unassigned_clients if row[2 + index]]
+        chosen[role], loads[role] = _assign_role(clients, loads[role], weighted, capacities[role])
+    assignments = [Assignment(row[0], chosen["cpa"].get(row[0]), chosen["assistant"].get(row[0]))
+                   for row in unassigned_clients]
+    unassigned = {role: sum(1 for staff_id in chosen[role].values() if staff_id is None) for role in ROLES}
+    return AssignmentPlan(assignments, loads, unassigned, None)
+
+
+def auto_assign(weighted=False, max_clients_per_cpa=None, max_clients_per_assistant=None, dry_run=False):
+    """
+    Assigns a CPA and an assistant to every client that is missing one, balancing the workload across staff.
+    The current workloads are loaded in one query and the assignments are written back in one UPDATE.
+    Clients that were assigned by someone else in the meantime keep that assignment.
+
+    Args:
+        weighted (bool): Balance the summed client income instead of the number of clients.
+        max_clients_per_cpa (int): Optional cap on the total number of clients per CPA.
+        max_clients_per_assistant (int): Optional cap on the total number of clients per assistant.
+        dry_run (bool): Only compute and return the plan.
+    Returns:
+        AssignmentPlan: The computed plan; `updated` is the number of updated clients, or None for a dry run.
+    """
+    with get_connection() as connection:
+        workloads = database.get_staff_workloads(connection)
+        unassigned_clients = database.get_unassigned_clients(connection)
+        plan = plan_assignments(workloads, unassigned_clients, weighted, max_clients_per_cpa,
+                                max_clients_per_assistant)
+        if dry_run:
+            return plan
+        rows = [assignment for assignment in plan.assignments
+                if assignment.cpa_id is not None or assignment.assistant_id is not None]
+        updated = database.assign_staff_to_clients(connection, rows)
+    if updated:
+        entity_cache.clear()
+    return plan._replace(updated=updated)
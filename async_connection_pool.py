@@ -0,0 +1,64 @@
+# asyncio connection pool for the async data-access layer (async_database.py).
+# Uses psycopg 3 and psycopg_pool, which are only needed by async callers.
+import asyncio
+from contextlib import asynccontextmanager
+
+from connection_pool import PoolConfig
+
+_pool = None
+_pool_lock = None
+_config = None
+
+
+def configure(dsn=None, **options):
+    """
+    Sets the database URL and pool options (see `connection_pool.PoolConfig`) used when the async pool is created.
+    Settings that are not given fall back to the environment. Call `close_pool` first to replace an open pool.
+    """
+    global _config
+    _config = PoolConfig.from_env(dsn, **options)
+
+
+async def get_pool():
+    """
+    Returns the shared async pool, creating and opening it on first use.
+    """
+    global _pool, _pool_lock, _config
+    if _pool is None:
+        _pool_lock = _pool_lock or asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                from psycopg_pool import AsyncConnectionPool
+
+                _config = _config or PoolConfig.from_env()
+                pool = AsyncConnectionPool(
+                    _config.dsn,
+                    min_size=_config.min_size,
+                    max_size=_config.max_size,
+                    timeout=_config.checkout_timeout,
+                    max_lifetime=_config.max_lifetime or float("inf"),
+                    check=AsyncConnectionPool.check_connection if _config.pre_ping else None,
+                    kwargs={"connect_timeout": _config.connect_timeout},
+                    open=False,
+                )
+                await pool.open()
+                _pool = pool
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def pool_stats():
+    return (await get_pool()).get_stats()
+
+
+@asynccontextmanager
+async def get_connection():
+    pool = await get_pool()
+    async with pool.connection() as connection:
+        yield connection
@@ -0,0 +1,140 @@
+# asyncio counterparts of the functions in database.py, on psycopg 3 connections from async_connection_pool.
+# The SQL constants are shared with database.py, so both paths always run the same statements.
+import database
+import records
+
+
+async def _fetchone(connection, query, params=(), row_factory=None):
+    # mapped by `row_factory(column_names)` when given, as in database.py
+    async with connection.transaction():
+        cursor = await connection.execute(query, params)
+        row = await cursor.fetchone()
+    if row is None or row_factory is None:
+        return row
+    return row_factory(records.column_names(cursor))(row)
+
+
+async def _fetchall(connection, query, params=(), row_factory=None):
+    async with connection.transaction():
+        cursor = await connection.execute(query, params)
+        rows = await cursor.fetchall()
+    if row_factory is None:
+        return rows
+    build = row_factory(records.column_names(cursor))
+    return [build(row) for row in rows]
+
+
+async def _execute(connection, query, params=()):
+    async with connection.transaction():
+        await connection.execute(query, params)
+
+
+async def add_client(connection, client_name, address, income, materials_submitted=False, cpa_id=None):
+    """
+    Inserts a new client into the database and returns the generated client ID.
+    Returns:
+        int: The ID of the newly created client.
+    """
+    row = await _fetchone(connection, database.INSERT_CLIENT_RETURN_ID,
+                          (client_name, address, income, materials_submitted, cpa_id))
+    return row[0]
+
+
+async def add_cpa(connection, cpa_name):
+    return (await _fetchone(connection, database.INSERT_CPA_RETURN_ID, (cpa_name, )))[0]
+
+
+async def add_tax_filing_assistant(connection, assistant_name):
+    return (await _fetchone(connection, database.INSERT_ASSISTANT_RETURN_ID, (assistant_name, )))[0]
+
+
+async def add_tax_return(connection, client_id, tax_year):
+    # creates the tax year's partition in the same transaction if needed, see `database.ensure_tax_year_partition`
+    if tax_year is None:
+        raise ValueError("A tax year is required to create tax returns.")
+    async with connection.transaction():
+        cursor = await connection.execute(database.SELECT_TAX_YEAR_TABLE_STATUS, (int(tax_year), ))
+        row = await cursor.fetchone()
+        if row is None:
+            await connection.execute(database.CREATE_TAX_YEAR_PARTITION.format(year=int(tax_year)))
+        database.check_tax_year_status(tax_year, row[0] if row else "active")
+        await connection.execute(database.INSERT_TAX_RETURN, (client_id, tax_year, False, None, None))
+
+
+async def change_materials_status(connection, client_name, materials_submitted):
+    await _execute(connection, database.UPDATE_CLIENTS_MATERIALS, (materials_submitted, client_name))
+
+
+async def change_tax_return_status(connection, client_id, tax_year, filed_or_not, checked_by, tax_return_timestamp):
+    await _execute(connection, database.UPDATE_TAX_RETURN_STATUS,
+                   (filed_or_not, checked_by, tax_return_timestamp, client_id, tax_year))
+
+
+async def get_cpa_by_name(connection, cpa_name, row_factory=None):
+    return await _fetchone(connection, database.SELECT_CPA_BY_NAME, (cpa_name, ), row_factory)
+
+
+async def get_tax_filing_assistant_by_name(connection, assistant_name, row_factory=None):
+    return await _fetchone(connection, database.SELECT_ASSISTANT_BY_NAME, (assistant_name, ), row_factory)
+
+
+async def get_tax_return(connection, client_id, tax_year, row_factory=None):
+    return await _fetchone(connection, database.SELECT_TAX_RETURN, (client_id, tax_year), row_factory)
+
+
+async def get_cpa_client_relations(connection, cpa_name=None, after=None, limit=None):
+    return await _fetchall(connection, database.SELECT_CPA_CLIENT_RELATIONS,
+                           database.relation_params(cpa_name, after, limit))
+
+
+async def get_assistant_client_relations(connection, assistant_name=None, after=None, limit=None):
+    return await _fetchall(connection, database.SELECT_ASSISTANT_CLIENT_RELATIONS,
+                           database.relation_params(assistant_name, after, limit))
+
+
+async def _stream(connection, cursor_name, query, params, fetch_size):
+    async with connection.transaction():
+        async with connection.cursor(name=cursor_name) as cursor:
+            cursor.itersize = fetch_size
+            await cursor.execute(query, params)
+            async for row in cursor:
+                yield row
+
+
+async def iter_cpa_client_relations(connection, cpa_name=None, after=None, limit=None, fetch_size=2000):
+    """
+    Streams CPA-client relations through a server-side cursor, like `database.iter_cpa_client_relations`.
+    Yields:
+        tuple: (cpa_name, client_name, client_id) rows sorted by CPA name, then client name.
+    """
+    async for row in _stream(connection, "cpa_client_relations", database.SELECT_CPA_CLIENT_RELATIONS,
+                             database.relation_params(cpa_name, after, limit), fetch_size):
+        yield row
+
+
+async def iter_assistant_client_relations(connection, assistant_name=None, after=None, limit=None, fetch_size=2000):
+    async for row in _stream(connection, "assistant_client_relations", database.SELECT_ASSISTANT_CLIENT_RELATIONS,
+                             database.relation_params(assistant_name, after, limit), fetch_size):
+        yield row
+
+
+async def get_client_details(connection, client_name, row_factory=None):
+    """
+    Retrieves detailed information about a client from the database.
+    Returns:
+        tuple: A tuple containing client details (ID, name, address, income, materials_submitted, CPA name, assistant name),
+               mapped by `row_factory` when given, or None if the client does not exist.
+    """
+    return await _fetchone(connection, database.SELECT_CLIENT_DETAILS, (client_name, ), row_factory)
+
+
+async def check_tax_return_status(connection, client_id, tax_year):
+    return await _fetchone(connection, database.SELECT_TAX_RETURN_STATUS, (client_id, tax_year))
+
+
+async def assign_cpa_to_client(connection, client_id, cpa_id):
+    await _execute(connection, database.UPDATE_CLIENT_CPA, (cpa_id, client_id))
+
+
+async def assign_assistant_to_client(connection, client_id, assistant_id):
+    await _execute(connection, database.UPDATE_CLIENT_ASSISTANT, (assistant_id, client_id))
@@ -0,0 +1,336 @@
+# non-interactive runner for JSONL operation files, e.g. one line per client to add, assign or mark as filed.
+import json
+import sys
+import time
+from collections import namedtuple
+from itertools import groupby, islice
+
+import database
+import entity_cache
+import tax_years
+from classes.Client import Client
+from classes.TaxReturn import TaxReturn
+from session import Session
+
+DEFAULT_CHUNK_SIZE = 1000
+FILERS = ("CPA", "Assistant")
+
+
+class OperationError(ValueError):
+    """
+    A single operation that cannot be run, e.g. because an argument is missing or the client does not exist.
+    It is reported on the operation's line; the rest of the chunk still runs.
+    """
+
+
+class BatchResult(namedtuple("BatchResult", ["operations", "succeeded", "failed", "seconds"])):
+    @property
+    def operations_per_second(self):
+        return self.operations / self.seconds if self.seconds else 0.0
+
+
+def read_operations(path):
+    """
+    Lazily reads a JSONL operation file. Each line is an object with an `op` name and the operation's
+    arguments, e.g. `{"op": "mark_filed", "client": "Jane Doe", "by": "CPA"}`. The tax return operations take an
+    optional `year` (default: `tax_years.default_tax_year()`). Blank lines are skipped.
+
+    Yields:
+        tuple: (line number, operation dict), or (line number, OperationError) for a line that is not valid.
+    """
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                operation = json.loads(line)
+            except json.JSONDecodeError as error:
+                yield line_number, OperationError(f"Invalid JSON: {error}")
+                continue
+            if not isinstance(operation, dict) or operation.get("op") not in OPERATIONS:
+                yield line_number, OperationError(f"Unknown operation. Use one of: {', '.join(OPERATIONS)}.")
+            else:
+                yield line_number, operation
+
+
+def _argument(operation, name):
+    # a required text argument, e.g. a client name
+    value = operation.get(name)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise OperationError(f"Missing argument '{name}'.")
+    if not isinstance(value, str):
+        raise OperationError(f"'{name}' must be a string.")
+    return value.strip()
+
+
+def _optional_argument(operation, name):
+    return _argument(operation, name) if operation.get(name) not in (None, "") else None
+
+
+def _lookup(name, ids, role):
+    # `ids` maps lower-cased names to IDs, as returned by the database.get_*_ids_by_names functions
+    if name.lower() not in ids:
+        return OperationError(f"There is no {role} named '{name}'.")
+    return ids[name.lower()]
+
+
+def _run_each(operations, parse):
+    # parses the arguments of every operation, keeping argument errors as per-line results
+    parsed = []
+    for operation in operations:
+        try:
+            parsed.append(parse(operation))
+        except OperationError as error:
+            parsed.append(error)
+    return parsed
+
+
+def _client_ids(connection, operations):
+    names = _run_each(operations, lambda operation: _argument(operation, "client"))
+    ids = database.get_client_ids_by_names(connection, [name for name in names if isinstance(name, str)])
+    return [name if isinstance(name, OperationError) else _lookup(name, ids, "client") for name in names]
+
+
+def _client_years(connection, operations):
+    # (client_id, tax_year) of every operation, or the OperationError of its client or year
+    default_year = tax_years.default_tax_year()
+
+    def parse_year(operation):
+        tax_year = operation.get("year", default_year)
+        if not isinstance(tax_year, int) or isinstance(tax_year, bool):
+            raise OperationError("'year' must be a whole number, e.g. 2025.")
+        return tax_year
+
+    client_ids = _client_ids(connection, operations)
+    years = _run_each(operations, parse_year)
+    return [next((value for value in (client_id, tax_year) if isinstance(value, OperationError)), (client_id, tax_year))
+            for client_id, tax_year in zip(client_ids, years)]
+
+
+def _by_year(keys):
+    # groups the valid (client_id, tax_year) keys by year
+    years = {}
+    for key in keys:
+        if isinstance(key, tuple):
+            years.setdefault(key[1], set()).add(key[0])
+    return years.items()
+
+
+def _parse_client(operation):
+    income = operation.get("income")
+    if income is None:
+        raise OperationError("Missing argument 'income'.")
+    if not isinstance(income, (int, float)) or isinstance(income, bool) or income < 0:
+        raise OperationError("'income' must be a non-negative number.")
+    return (_argument(operation, "name"), _argument(operation, "address"), income,
+            bool(operation.get("materials_submitted", False)), _optional_argument(operation, "cpa"),
+            _optional_argument(operation, "assistant"))
+
+
+def _add_clients(connection, operations):
+    parsed = _run_each(operations, _parse_client)
+    records = [record for record in parsed if not isinstance(record, OperationError)]
+    cpa_ids = database.get_cpa_ids_by_names(connection, [record[4] for record in records if record[4]])
+    assistant_ids = database.get_tax_filing_assistant_ids_by_names(
+        connection, [record[5] for record in records if record[5]])
+    rows = []
+    for index, record in enumerate(parsed):
+        if isinstance(record, OperationError):
+            continue
+        cpa_id = _lookup(record[4], cpa_ids, "CPA") if record[4] else None
+        assistant_id = _lookup(record[5], assistant_ids, "assistant") if record[5] else None
+        for staff_id in (cpa_id, assistant_id):
+            if isinstance(staff_id, OperationError):
+                parsed[index] = staff_id
+                break
+        else:
+            rows.append((index, record[:4] + (cpa_id, assistant_id)))
+    client_ids = database.add_clients(connection, [row for _, row in rows])
+    for (index, _), client_id in zip(rows, client_ids):
+        parsed[index] = {"client_id": client_id}
+    return parsed
+
+
+def _add_staff(add_many, id_key):
+    def run(connection, operations):
+        names = _run_each(operations, lambda operation: _argument(operation, "name"))
+        new_ids = iter(add_many(connection, [name for name in names if isinstance(name, str)]))
+        return [name if isinstance(name, OperationError) else {id_key: next(new_ids)} for name in names]
+    return run
+
+
+def _assign_staff(staff_key, lookup, assign_many, role):
+    def run(connection, operations):
+        client_ids = _client_ids(connection, operations)
+        staff_names = _run_each(operations, lambda operation: _argument(operation, staff_key))
+        staff_ids = lookup(connection, [name for name in staff_names if isinstance(name, str)])
+        results, assignments = [], {}
+        for client_id, staff_name in zip(client_ids, staff_names):
+            staff_id = (staff_name if isinstance(staff_name, OperationError)
+                        else _lookup(staff_name, staff_ids, role))
+            error = next((value for value in (client_id, staff_id) if isinstance(value, OperationError)), None)
+            if error:
+                results.append(error)
+            else:
+                assignments[client_id] = staff_id  # the last line for a client wins, as if run one by one
+                results.append({"client_id": client_id, f"{staff_key}_id": staff_id})
+        assign_many(connection, list(assignments.items()))
+        return results
+    return run
+
+
+def _changed_results(keys, changed, key):
+    # keys are client IDs or (client_id, tax_year) pairs. A key listed on several lines of a group only changes
+    # on its first line, as if run one by one
+    results = []
+    for item in keys:
+        if isinstance(item, OperationError):
+            results.append(item)
+            continue
+        result = {"client_id": item[0], "tax_year": item[1]} if isinstance(item, tuple) else {"client_id": item}
+        result[key] = item in changed
+        results.append(result)
+        changed.discard(item)
+    return results
+
+
+def _submit_materials(connection, operations):
+    client_ids = _client_ids(connection, operations)
+    changed = Client.mark_materials_submitted_many(
+        list({client_id for client_id in client_ids if isinstance(client_id, int)}))
+    return _changed_results(client_ids, set(changed), "changed")
+
+
+def _create_tax_returns(connection, operations):
+    keys = _client_years(connection, operations)
+    created = set()
+    for tax_year, client_ids in _by_year(keys):
+        created.update((client_id, tax_year)
+                       for client_id in database.add_tax_returns_if_absent(connection, list(client_ids), tax_year))
+    return _changed_results(keys, created, "created")
+
+
+def _parse_filer(operation):
+    filed_by = _argument(operation, "by")
+    if filed_by not in FILERS:
+        raise OperationError(f"'by' must be one of: {', '.join(FILERS)}.")
+    return filed_by
+
+
+def _mark_filed(connection, operations):
+    keys = _client_years(connection, operations)
+    filers = _run_each(operations, _parse_filer)
+    keys = [filer if isinstance(filer, OperationError) else key for key, filer in zip(keys, filers)]
+    changed = set()
+    for filed_by in FILERS:
+        for tax_year, client_ids in _by_year(key for key, filer in zip(keys, filers) if filer == filed_by):
+            changed.update((client_id, tax_year)
+                           for client_id in TaxReturn.mark_filed_many(list(client_ids), filed_by, tax_year))
+    return _changed_results(keys, changed, "changed")
+
+
+def _check_status(connection, operations):
+    keys = _client_years(connection, operations)
+    statuses = {}
+    for tax_year, client_ids in _by_year(keys):
+        statuses.update(((client_id, tax_year), row) for client_id, row
+                        in database.check_tax_return_statuses(connection, client_ids, tax_year).items())
+    results = []
+    for key in keys:
+        if isinstance(key, OperationError):
+            results.append(key)
+        elif key not in statuses:
+            results.append(OperationError(f"The client does not have a tax return file for {key[1]}."))
+        else:
+            status = TaxReturn.status_from_row(statuses[key])
+            if status["tax_return_timestamp"] is not None:
+                status["tax_return_timestamp"] = status["tax_return_timestamp"].isoformat()
+            results.append(dict(client_id=key[0], tax_year=key[1], **status))
+    return results
+
+
+# each handler runs a group of consecutive operations of its kind with a few batched statements and returns
+# one result dict or OperationError per operation, in order. Handlers run inside the chunk's Session, so the
+# model methods they call use the chunk's connection and transaction as well.
+OPERATIONS = {
+    "add_client": _add_clients,
+    "add_cpa": _add_staff(database.add_cpas, "cpa_id"),
+    "add_assistant": _add_staff(database.add_tax_filing_assistants, "assistant_id"),
+    "assign_cpa": _assign_staff("cpa", database.get_cpa_ids_by_names, database.assign_cpas_to_clients, "CPA"),
+    "assign_assistant": _assign_staff("assistant", database.get_tax_filing_assistant_ids_by_names,
+                                      database.assign_assistants_to_clients, "assistant"),
+    "submit_materials": _submit_materials,
+    "create_tax_return": _create_tax_returns,
+    "mark_filed": _mark_filed,
+    "check_status": _check_status,
+}
+WRITE_OPERATIONS = set(OPERATIONS) - {"check_status"}
+
+
+def _result_record(line_number, operation, result):
+    op = operation.get("op") if isinstance(operation, dict) else None
+    if isinstance(result, Exception):
+        return {"line": line_number, "op": op, "ok": False, "error": str(result)}
+    return {"line": line_number, "op": op, "ok": True, "result": result}
+
+
+def _run_chunk(chunk):
+    """
+    Runs one chunk of (line number, operation) pairs in a single transaction.
+    An error other than an OperationError (e.g. from the database) rolls the whole chunk back and is reported on
+    each of its lines; the following chunks still run.
+    """
+    results = {}
+    try:
+        with Session() as session:
+            valid = [(line_number, operation) for line_number, operation in chunk if isinstance(operation, dict)]
+            for op, group in groupby(valid, key=lambda item: item[1]["op"]):
+                group = list(group)
+                outcomes = OPERATIONS[op](session.connection, [operation for _, operation in group])
+                results.update(zip((line_number for line_number, _ in group), outcomes))
+    except Exception as error:
+        message = f"Rolled back with its chunk: {str(error).strip()}"
+        results = {line_number: OperationError(message) for line_number, operation in chunk
+                   if isinstance(operation, dict)}
+    if any(isinstance(operation, dict) and operation["op"] in WRITE_OPERATIONS for _, operation in chunk):
+        entity_cache.clear()
+    for line_number, operation in chunk:
+        yield _result_record(line_number, operation, results.get(line_number, operation))
+
+
+def iter_run_operations(operations, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Runs (line number, operation) pairs, e.g. from `read_operations`. Consecutive operations of the same kind
+    are grouped into batched statements, and every `chunk_size` lines are committed as one transaction.
+    Only one chunk is held in memory at a time.
+
+    Yields:
+        dict: One result per line, in line order: `{"line", "op", "ok": True, "result"}` or
+        `{"line", "op", "ok": False, "error"}`.
+    """
+    iterator = iter(operations)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield from _run_chunk(chunk)
+
+
+def run_batch(path, results_path=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Runs a JSONL operation file and writes one JSON result per line to `results_path` (stdout when None).
+
+    Returns:
+        BatchResult: The number of operations, how many succeeded and failed, and the elapsed seconds.
+    """
+    succeeded = failed = 0
+    started = time.perf_counter()
+    results_file = open(results_path, "w", encoding="utf-8") if results_path else sys.stdout
+    try:
+        for record in iter_run_operations(read_operations(path), chunk_size):
+            results_file.write(json.dumps(record) + "\n")
+            if record["ok"]:
+                succeeded += 1
+            else:
+                failed += 1
+    finally:
+        if results_path:
+            results_file.close()
+    return BatchResult(succeeded + failed, succeeded, failed, time.perf_counter() - started)
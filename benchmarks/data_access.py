@@ -0,0 +1,277 @@
+# times the public data-access functions against a scratch database seeded with synthetic data.
+# usage: python -m benchmarks.data_access --scale 100k [--iterations 1000] [--output results.json]
+#        [--baseline previous.json]  (run from the project root; the scratch database is created on the
+#        PostgreSQL server of DATABASE_URL and dropped afterwards unless --keep is given)
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.extensions import make_dsn, parse_dsn
+
+import connection_pool
+import database
+import migrations
+import tax_years
+from classes.Client import Client
+from classes.CPA import CPA
+from classes.TaxReturn import TaxReturn
+from prepared_statements import PreparingConnection
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+BATCH_SIZE = 100
+
+# a fresh database numbers the staff from 1, so clients can pick their CPA/assistant by id.
+# About 10% of the clients have no CPA and 20% have no tax return yet; filings are spread over the last 90 days.
+SEED_CPAS = "INSERT INTO cpas (name) SELECT 'CPA ' || g FROM generate_series(1, %(cpas)s) AS g;"
+
+SEED_ASSISTANTS = """INSERT INTO tax_filing_assistants (name)
+SELECT 'Assistant ' || g FROM generate_series(1, %(assistants)s) AS g;"""
+
+SEED_CLIENTS = """INSERT INTO clients (name, address, income, materials_submitted, cpa_id, assistant_id)
+SELECT 'Client ' || lpad(g::text, 7, '0'), g || ' Main St', (random() * 250000)::integer, random() < 0.5,
+       CASE WHEN random() < 0.9 THEN 1 + floor(random() * %(cpas)s)::integer END,
+       CASE WHEN random() < 0.9 THEN 1 + floor(random() * %(assistants)s)::integer END
+FROM generate_series(1, %(clients)s) AS g;"""
+
+SEED_TAX_RETURNS = """INSERT INTO tax_returns (client_id, filed_or_not, checked_by, tax_return_timestamp)
+SELECT id, filed, CASE WHEN filed THEN (CASE WHEN random() < 0.5 THEN 'yes' ELSE 'no' END) END,
+       CASE WHEN filed THEN extract(epoch FROM now())::integer - (random() * 90 * 86400)::integer END
+FROM (SELECT id, random() < 0.5 AS filed FROM clients WHERE random() < 0.8) AS seeded;"""
+
+
+def parse_scale(value):
+    return SCALES.get(value.lower()) or int(value)
+
+
+def scratch_dsn(dsn, database_name):
+    return make_dsn(dsn, dbname=database_name)
+
+
+def create_database(dsn, database_name):
+    admin = psycopg2.connect(scratch_dsn(dsn, "postgres"))
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{database_name}";')
+        cursor.execute(f'CREATE DATABASE "{database_name}";')
+    admin.close()
+
+
+def drop_database(dsn, database_name):
+    admin = psycopg2.connect(scratch_dsn(dsn, "postgres"))
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{database_name}";')
+    admin.close()
+
+
+def seed(connection, clients, seed_value):
+    """
+    Creates the schema and fills it with `clients` synthetic clients and proportional numbers of CPAs,
+    assistants and tax returns. The data is generated in the database, so even 1M clients only take seconds.
+    The migrations run after seeding, so their indexes are built once over the full tables.
+    """
+    sizes = {"clients": clients, "cpas": max(5, clients // 500), "assistants": max(5, clients // 250)}
+    database.create_tables(connection)
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT setseed(%s);", (seed_value, ))
+            for statement in (SEED_CPAS, SEED_ASSISTANTS, SEED_CLIENTS, SEED_TAX_RETURNS):
+                cursor.execute(statement, sizes)
+    migrations.migrate(connection)
+    with migrations.autocommit(connection):
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM ANALYZE;")
+    return sizes
+
+
+def summarize(timings):
+    quantiles = statistics.quantiles(timings, n=100)
+    return {
+        "iterations": len(timings),
+        "p50_ms": quantiles[49] * 1e3,
+        "p95_ms": quantiles[94] * 1e3,
+        "p99_ms": quantiles[98] * 1e3,
+        "mean_ms": statistics.fmean(timings) * 1e3,
+        "ops_per_second": len(timings) / sum(timings),
+    }
+
+
+def time_calls(function, iterations):
+    function()  # warm up, and prepare the statement on the connection
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def build_benchmarks(connection, sizes, rng):
+    """
+    Returns:
+        dict: Benchmark name -> function that makes one call with randomly chosen, existing arguments.
+        Batch benchmarks handle `BATCH_SIZE` rows per call.
+    """
+    def client_id():
+        return rng.randint(1, sizes["clients"])
+
+    def client_name():
+        return f"Client {rng.randint(1, sizes['clients']):07d}"
+
+    def cpa_name():
+        return f"CPA {rng.randint(1, sizes['cpas'])}"
+
+    def assistant_name():
+        return f"Assistant {rng.randint(1, sizes['assistants'])}"
+
+    def new_name():
+        return f"Bench client {rng.getrandbits(48)}"
+
+    def ids(count=BATCH_SIZE):
+        return rng.sample(range(1, sizes["clients"] + 1), count)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    year = tax_years.default_tax_year()  # migration 12 puts the seeded returns in the current season
+    return {
+        # lookups
+        "database.get_client_details": lambda: database.get_client_details(connection, client_name()),
+        "database.get_client_with_tax_return":
+            lambda: database.get_client_with_tax_return(connection, client_name(), year),
+        "database.check_tax_return_status": lambda: database.check_tax_return_status(connection, client_id(), year),
+        "database.get_tax_return": lambda: database.get_tax_return(connection, client_id(), year),
+        "database.get_cpa_by_name": lambda: database.get_cpa_by_name(connection, cpa_name()),
+        "database.get_tax_filing_assistant_by_name":
+            lambda: database.get_tax_filing_assistant_by_name(connection, assistant_name()),
+        "database.get_client_ids_by_names":
+            lambda: database.get_client_ids_by_names(connection, [client_name() for _ in range(BATCH_SIZE)]),
+        # relation listings: one page, and one CPA's full list streamed
+        "database.get_cpa_client_relations (page of 50)":
+            lambda: database.get_cpa_client_relations(connection, limit=50),
+        "database.get_assistant_client_relations (one assistant, page of 50)":
+            lambda: database.get_assistant_client_relations(connection, assistant_name(), limit=50),
+        "database.iter_cpa_client_relations (one CPA)":
+            lambda: sum(1 for _ in database.iter_cpa_client_relations(connection, cpa_name())),
+        # inserts
+        "database.add_client": lambda: database.add_client(connection, new_name(), "1 Bench St", 50000),
+        "database.add_clients (batch)": lambda: database.add_clients(
+            connection, [(new_name(), "1 Bench St", 50000, False, None, None) for _ in range(BATCH_SIZE)], True,
+            year),
+        "database.onboard_client": lambda: database.onboard_client(
+            connection, new_name(), "1 Bench St", 50000, year, cpa_name(), assistant_name()),
+        "database.add_tax_return_if_absent":
+            lambda: database.add_tax_return_if_absent(connection, client_name(), year),
+        # updates
+        "database.change_materials_status":
+            lambda: database.change_materials_status(connection, client_name(), rng.random() < 0.5),
+        "database.change_tax_return_status":
+            lambda: database.change_tax_return_status(connection, client_id(), year, True, "yes", now),
+        "database.change_tax_return_status_by_client_name":
+            lambda: database.change_tax_return_status_by_client_name(connection, client_name(), year, True, "no",
+                                                                     now),
+        "database.change_materials_status_many (batch)": lambda: database.change_materials_status_many(
+            connection, [(client, rng.random() < 0.5) for client in ids()]),
+        "database.change_tax_return_status_many (batch)": lambda: database.change_tax_return_status_many(
+            connection, [(client, rng.random() < 0.5, "yes", now) for client in ids()], year),
+        # reports over the seeded filing times
+        "database.get_returns_filed_between (one hour, 100 rows)":
+            lambda: database.get_returns_filed_between(connection, now - datetime.timedelta(hours=1), now, 100),
+        "database.count_filings_per_period (per hour)":
+            lambda: database.count_filings_per_period(connection, now - datetime.timedelta(days=1), now, "hour"),
+        "database.assign_cpa_to_client":
+            lambda: database.assign_cpa_to_client(connection, client_id(), rng.randint(1, sizes["cpas"])),
+        # model layer, through the connection pool and without the entity cache
+        "Client.get": lambda: Client.get(client_name(), use_cache=False),
+        "CPA.get": lambda: CPA.get(cpa_name(), use_cache=False),
+        "TaxReturn.is_filed": lambda: TaxReturn.is_filed(client_id()),
+        "TaxReturn.mark_filed_by_client_name": lambda: TaxReturn.mark_filed_by_client_name(client_name(), "CPA"),
+    }
+
+
+def compare(results, baseline_path, max_regression):
+    """
+    Prints the benchmarks whose p95 got slower than the baseline run by more than `max_regression`
+    (e.g. 0.2 for 20%) and returns how many there were.
+    """
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)["results"]
+    regressions = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        change = result["p95_ms"] / baseline[name]["p95_ms"] - 1
+        if change > max_regression:
+            regressions += 1
+            print(f"REGRESSION {name}: p95 {baseline[name]['p95_ms']:.3f} ms -> {result['p95_ms']:.3f} ms "
+                  f"({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of the data-access functions on a seeded scratch database.")
+    parser.add_argument("--scale", type=parse_scale, default="10k",
+                        help="number of clients to seed: 1k, 10k, 100k, 1m or any number")
+    parser.add_argument("--iterations", type=int, default=1000, help="timed calls per function")
+    parser.add_argument("--database", default=f"tax_filing_bench_{os.getpid()}", help="scratch database name")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database afterwards")
+    parser.add_argument("--seed", type=float, default=0.42, help="random seed in [-1, 1] for reproducible data")
+    parser.add_argument("--only", help="only run the benchmarks whose name contains this text")
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON file to write the results to")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed p95 slowdown against the baseline before the run fails")
+    args = parser.parse_args()
+    load_dotenv()
+    dsn = os.environ["DATABASE_URL"]
+    bench_dsn = scratch_dsn(dsn, args.database)
+
+    create_database(dsn, args.database)
+    try:
+        connection = psycopg2.connect(bench_dsn, connection_factory=PreparingConnection)
+        started = time.perf_counter()
+        sizes = seed(connection, args.scale, args.seed)
+        print(f"Seeded {sizes['clients']:,} clients, {sizes['cpas']:,} CPAs and {sizes['assistants']:,} assistants "
+              f"in {time.perf_counter() - started:.1f}s.")
+        connection_pool.configure(dsn=bench_dsn)
+
+        rng = random.Random(args.seed)
+        results = {}
+        for name, function in build_benchmarks(connection, sizes, rng).items():
+            if args.only and args.only not in name:
+                continue
+            results[name] = summary = summarize(time_calls(function, args.iterations))
+            print(f"{name:<70} p50 {summary['p50_ms']:8.3f} ms   p95 {summary['p95_ms']:8.3f} ms   "
+                  f"p99 {summary['p99_ms']:8.3f} ms   {summary['ops_per_second']:10,.0f} ops/s")
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW server_version;")
+            server_version = cursor.fetchone()[0]
+        connection.close()
+        connection_pool.configure()  # closes the benchmark pool before the database is dropped
+    finally:
+        if not args.keep:
+            drop_database(dsn, args.database)
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump({
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "scale": sizes,
+            "iterations": args.iterations,
+            "batch_size": BATCH_SIZE,
+            "server_version": server_version,
+            "python_version": sys.version.split()[0],
+            "dsn": {key: value for key, value in parse_dsn(bench_dsn).items() if key != "password"},
+            "results": results,
+        }, file, indent=2)
+    print(f"Results written to {args.output}.")
+    if args.baseline and compare(results, args.baseline, args.max_regression):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
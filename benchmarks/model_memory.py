@@ -0,0 +1,92 @@
+# compares the memory and load time of clients and tax returns loaded as `__slots__` models (records.py) with the
+# previous `__dict__` objects hydrated by hand from positional tuples.
+# usage: python -m benchmarks.model_memory [--limit 100000]  (run from the project root, uses DATABASE_URL)
+import argparse
+import gc
+import time
+import tracemalloc
+from itertools import islice
+
+import database
+import tax_years
+from classes.Client import Client
+from classes.TaxReturn import TaxReturn
+from connection_pool import get_connection
+
+
+class DictClient:
+    # a client as the model was before `__slots__`: a plain object with an attribute dict
+    def __init__(self, name, address, income, materials_submitted=False, cpa=None, assistant=None, _id=None):
+        self._id = _id
+        self.name = name
+        self.address = address
+        self.income = income
+        self.materials_submitted = materials_submitted
+        self.cpa = cpa
+        self.assistant = assistant
+
+
+class DictTaxReturn:
+    def __init__(self, client_id, filed_or_not=False, checked_by=None, tax_return_timestamp=None, _id=None,
+                 tax_year=None):
+        self._id = _id
+        self.client_id = client_id
+        self.tax_year = tax_year
+        self.filed_or_not = filed_or_not
+        self.checked_by = checked_by
+        self.tax_return_timestamp = tax_return_timestamp
+
+
+def dict_client(row):
+    return DictClient(name=row[1], address=row[2], income=row[3], materials_submitted=row[4], cpa=row[5],
+                      assistant=row[6], _id=row[0])
+
+
+def dict_tax_return(row):
+    return DictTaxReturn(client_id=row[1], filed_or_not=row[2], checked_by=row[3], tax_return_timestamp=row[4],
+                         _id=row[0], tax_year=row[5])
+
+
+def measure(load, limit):
+    """
+    Returns:
+        tuple: (objects loaded, bytes allocated for them and still held, seconds).
+    """
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    objects = list(islice(load(), limit))
+    seconds = time.perf_counter() - started
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(objects), held, seconds
+
+
+def report(label, count, held, seconds):
+    per_object = held / count if count else 0
+    print(f"{label:<30} {count:>9,} objects  {held / 1024 / 1024:8.1f} MB  {per_object:7.0f} B/object  "
+          f"{seconds:6.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per loaded client / tax return, dict vs slots models.")
+    parser.add_argument("--limit", type=int, help="load at most this many rows of each kind")
+    args = parser.parse_args()
+    year = tax_years.default_tax_year()
+
+    def dict_clients():
+        with get_connection() as connection:
+            yield from map(dict_client, database.iter_client_details(connection))
+
+    def dict_tax_returns():
+        with get_connection() as connection:
+            yield from map(dict_tax_return, database.iter_tax_returns(connection, year))
+
+    for label, load in (("clients (__dict__)", dict_clients), ("clients (__slots__)", Client.iter_all),
+                        ("tax returns (__dict__)", dict_tax_returns),
+                        ("tax returns (__slots__)", lambda: TaxReturn.iter_all(year))):
+        report(label, *measure(load, args.limit))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# compares the latency of the lookup path with and without server-side prepared statements.
+# usage: python -m benchmarks.prepared_statements [--iterations 5000]  (run from the project root, uses DATABASE_URL)
+import argparse
+import os
+import statistics
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+import database
+import prepared_statements
+from prepared_statements import PreparingConnection
+
+SELECT_SAMPLE_CLIENT = """SELECT clients.id, clients.name, tax_returns.tax_year FROM clients
+JOIN tax_returns ON tax_returns.client_id = clients.id LIMIT 1;"""
+
+
+def time_calls(function, iterations):
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(label, timings):
+    quantiles = statistics.quantiles(timings, n=100)
+    print(f"{label:<45} p50 {quantiles[49] * 1e6:8.1f} us   p95 {quantiles[94] * 1e6:8.1f} us   "
+          f"mean {statistics.fmean(timings) * 1e6:8.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lookup latency with and without prepared statements.")
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    load_dotenv()
+    connection = psycopg2.connect(os.environ["DATABASE_URL"], connection_factory=PreparingConnection)
+    with connection.cursor() as cursor:
+        cursor.execute(SELECT_SAMPLE_CLIENT)
+        sample = cursor.fetchone()
+    connection.rollback()
+    if sample is None:
+        raise SystemExit("The database needs at least one client with a tax return to benchmark.")
+    client_id, client_name, tax_year = sample
+
+    lookups = {
+        "get_client_details": lambda: database.get_client_details(connection, client_name),
+        "check_tax_return_status": lambda: database.check_tax_return_status(connection, client_id, tax_year),
+        "get_tax_return": lambda: database.get_tax_return(connection, client_id, tax_year),
+    }
+    for label, lookup in lookups.items():
+        for enabled in (False, True):
+            prepared_statements.enabled = enabled
+            lookup()  # warm up, and prepare the statement when enabled
+            report(f"{label} ({'prepared' if enabled else 'plain'})", time_calls(lookup, args.iterations))
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# streaming bulk import of clients from firm CSV / JSONL exports.
+import csv
+import json
+import os
+import time
+from collections import namedtuple
+from itertools import islice
+
+import database
+import tax_years
+from connection_pool import get_connection
+
+DEFAULT_BATCH_SIZE = 1000
+TRUE_VALUES = {"1", "true", "t", "yes", "y"}
+
+
+class ImportResult(namedtuple("ImportResult", ["rows", "seconds", "client_ids"])):
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def read_client_rows(path):
+    """
+    Lazily reads client records from a CSV (with a header row) or JSONL file.
+    Each record needs `name`, `address` and `income`; `materials_submitted`, `cpa` and `assistant`
+    (the CPA's / assistant's name) are optional.
+
+    Args:
+        path (str): Path to a `.csv` or `.jsonl` file.
+    Yields:
+        dict: One record per row of the file.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8") as file:
+        if extension == ".csv":
+            yield from csv.DictReader(file)
+        elif extension in (".jsonl", ".ndjson"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise ValueError(f"Unsupported import file type '{extension}'. Use .csv or .jsonl.")
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in TRUE_VALUES
+
+
+def _parse_income(value):
+    income = float(value)
+    if income < 0:
+        raise ValueError(f"Income cannot be negative: {value}")
+    return int(income) if income.is_integer() else income
+
+
+def _resolve_ids(connection, names, known_ids, lookup, role):
+    # staff lists are small, so resolved ids are kept for the whole import and only new names hit the database
+    missing = {name.lower() for name in names if name and name.lower() not in known_ids}
+    if missing:
+        known_ids.update(lookup(connection, missing))
+        unknown = missing - known_ids.keys()
+        if unknown:
+            raise ValueError(f"Unknown {role}(s): {', '.join(sorted(unknown))}")
+
+
+def iter_import_clients(records, batch_size=DEFAULT_BATCH_SIZE, create_tax_returns=False, tax_year=None):
+    """
+    Inserts client records in batches, one multi-row INSERT and one transaction per batch.
+    CPA and assistant names are resolved to IDs so assignments are made in the same INSERT.
+    Only one batch is held in memory at a time.
+
+    Args:
+        records (iterable of dict): Client records, e.g. from `read_client_rows`.
+        batch_size (int): Number of clients written per statement.
+        create_tax_returns (bool): Whether to also create an empty tax return for every new client.
+        tax_year (int): The tax year of those tax returns. Defaults to `tax_years.default_tax_year()`.
+    Yields:
+        list of int: The generated client IDs of each committed batch.
+    """
+    cpa_ids = {}
+    assistant_ids = {}
+    tax_year = tax_years.default_tax_year() if tax_year is None else tax_year
+    for batch in _batched(records, batch_size):
+        with get_connection() as connection:
+            _resolve_ids(connection, [record.get("cpa") for record in batch], cpa_ids,
+                         database.get_cpa_ids_by_names, "CPA")
+            _resolve_ids(connection, [record.get("assistant") for record in batch], assistant_ids,
+                         database.get_tax_filing_assistant_ids_by_names, "assistant")
+            rows = [
+                (
+                    record["name"].strip(),
+                    record["address"].strip(),
+                    _parse_income(record["income"]),
+                    _parse_bool(record.get("materials_submitted")),
+                    cpa_ids[record["cpa"].lower()] if record.get("cpa") else None,
+                    assistant_ids[record["assistant"].lower()] if record.get("assistant") else None,
+                )
+                for record in batch
+            ]
+            client_ids = database.add_clients(connection, rows, create_tax_returns, tax_year)
+        yield client_ids
+
+
+def import_clients(path, batch_size=DEFAULT_BATCH_SIZE, create_tax_returns=False, collect_ids=True, tax_year=None):
+    """
+    Streams a CSV/JSONL client export into the database.
+    Batches that were committed before an error stay in the database.
+
+    Args:
+        path (str): Path to a `.csv` or `.jsonl` file.
+        batch_size (int): Number of clients written per statement.
+        create_tax_returns (bool): Whether to also create an empty tax return for every new client.
+        collect_ids (bool): Whether to keep the generated IDs. Turn off for very large files to keep memory flat.
+        tax_year (int): The tax year of the tax returns. Defaults to `tax_years.default_tax_year()`.
+    Returns:
+        ImportResult: The number of imported rows, the elapsed seconds and the generated IDs (or None).
+    """
+    client_ids = [] if collect_ids else None
+    rows = 0
+    started = time.perf_counter()
+    for batch_ids in iter_import_clients(read_client_rows(path), batch_size, create_tax_returns, tax_year):
+        rows += len(batch_ids)
+        if collect_ids:
+            client_ids.extend(batch_ids)
+    return ImportResult(rows=rows, seconds=time.perf_counter() - started, client_ids=client_ids)
@@ -0,0 +1,94 @@
+# real-time feed of status changes. Triggers (migration 13) send a NOTIFY on the `status_changes` channel whenever
+# a client's materials_submitted or a tax return's filed_or_not / checked_by changes; the subscribers below LISTEN on
+# a dedicated connection, so consumers such as the wallboard react to changes without running any polling queries.
+import json
+import select
+import time
+from collections import namedtuple
+
+import psycopg2
+
+from connection_pool import get_config
+
+CHANNEL = "status_changes"
+FIELDS = ("materials_submitted", "filed_or_not", "checked_by")
+
+StatusChange = namedtuple("StatusChange", ["client_id", "field", "value", "tax_year"])
+StatusChange.__doc__ = """
+A changed status: the client, the changed field (one of FIELDS), its new value and, for the tax return fields,
+the tax year of the return (None for materials_submitted).
+"""
+
+
+def parse_payload(payload):
+    """
+    Args:
+        payload (str): The JSON payload of a notification sent by the status triggers.
+    Returns:
+        StatusChange: The change it describes.
+    """
+    data = json.loads(payload)
+    return StatusChange(data["client_id"], data["field"], data["value"], data.get("tax_year"))
+
+
+def _dsn(dsn):
+    # notifications are not replicated, so the feed always listens on the primary
+    return dsn or get_config().dsn
+
+
+def iter_changes(dsn=None, timeout=None):
+    """
+    Yields status changes as they are committed, from a dedicated connection outside the pool.
+    Changes are only delivered while the iterator is running; ones committed before it started or while it was
+    not connected are not replayed, so a consumer loads the current statuses once and then applies the changes.
+
+    Args:
+        dsn (str): Database URL. Defaults to the primary of the connection pool's configuration.
+        timeout (float): Stop after this many seconds without a change. None waits forever.
+    Yields:
+        StatusChange: One per changed field, in commit order.
+    Raises:
+        psycopg2.OperationalError: If the connection cannot be made or is lost.
+    """
+    connection = psycopg2.connect(_dsn(dsn), connect_timeout=get_config().connect_timeout)
+    try:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL};")
+        while True:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not connection.notifies:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return
+                select.select([connection], [], [], remaining)
+                connection.poll()
+            while connection.notifies:
+                notification = connection.notifies.pop(0)
+                if notification.channel == CHANNEL:
+                    yield parse_payload(notification.payload)
+    finally:
+        connection.close()
+
+
+async def aiter_changes(dsn=None):
+    """
+    Asyncio counterpart of `iter_changes`, on a dedicated psycopg 3 connection. Runs until the consumer stops
+    iterating (or the task is cancelled), which closes the connection.
+
+    Args:
+        dsn (str): Database URL. Defaults to the primary of the connection pool's configuration.
+    Yields:
+        StatusChange: One per changed field, in commit order.
+    """
+    import psycopg
+
+    connection = await psycopg.AsyncConnection.connect(_dsn(dsn), autocommit=True,
+                                                       connect_timeout=get_config().connect_timeout)
+    try:
+        await connection.execute(f"LISTEN {CHANNEL};")
+        async for notification in connection.notifies():
+            if notification.channel == CHANNEL:
+                yield parse_payload(notification.payload)
+    finally:
+        await connection.close()
@@ -1,46 +1,119 @@
+import async_connection_pool
+import async_database
 import database
-from connection_pool import get_connection
+import entity_cache
+import pagination
+import records
+from session import current_session, invalidate_cached, use_connection
+
+
+def _relation_dict(relation):
+    return {"cpa_name": relation[0], "client_name": relation[1]}
 
 
 class CPA:
     """
     Represents a Certified Public Accountant
     """
+    __slots__ = ("_id", "name")
+    COLUMNS = {"name": "name", "_id": "id"}  # `__init__` argument -> result column, see records.py
+
     def __init__(self, name, _id=None):
         self._id = _id
         self.name = name
 
-    def save(self):
+    def save(self, session=None):
         """
         Saves the CPA to the database. Inserts the CPA's details into the database and updates the `_id`
         attribute with the generated ID.
         """
-        with get_connection() as connection:
+        with use_connection(session) as connection:
             cpa_id = database.add_cpa(connection, self.name)
             self._id = cpa_id
+        invalidate_cached(("cpa_name", self.name.lower()), session=session)
+
+    async def asave(self):
+        # async counterpart of `save`
+        async with async_connection_pool.get_connection() as connection:
+            self._id = await async_database.add_cpa(connection, self.name)
+        entity_cache.invalidate(("cpa_name", self.name.lower()))
 
     @classmethod
-    def get(cls, name):
+    def get(cls, name, use_cache=True, session=None):
         """
         Retrieves a CPA from the database by name.
         Returns:
             CPA or None: An instance of the `CPA` class if a matching CPA is found,
             otherwise `None`.
         """
-        with get_connection() as connection:
-            cpa_row = database.get_cpa_by_name(connection, name)
-            if cpa_row:
-                return cls(name=cpa_row[1], _id=cpa_row[0])
-            return None
+        use_cache = use_cache and current_session(session) is None  # a session may hold uncommitted writes
+        cpa, generation = entity_cache.lookup(("cpa_name", name.lower()), use_cache)
+        if cpa is not entity_cache.MISSING:
+            return cpa
+        with use_connection(session, read_only=True) as connection:
+            cpa = database.get_cpa_by_name(connection, name, records.factory(cls))
+            use_cache = use_cache and not getattr(connection, "is_replica", False)  # the replica may lag behind
+        return cls._cache(name, cpa, use_cache, generation)
+
+    @classmethod
+    async def aget(cls, name, use_cache=True):
+        # async counterpart of `get`
+        cpa, generation = entity_cache.lookup(("cpa_name", name.lower()), use_cache)
+        if cpa is not entity_cache.MISSING:
+            return cpa
+        async with async_connection_pool.get_connection() as connection:
+            cpa = await async_database.get_cpa_by_name(connection, name, records.factory(cls))
+        return cls._cache(name, cpa, use_cache, generation)
 
     @classmethod
-    def get_client_relations(cls):
+    def _cache(cls, name, cpa, use_cache, generation):
+        if cpa is not None and use_cache:
+            entity_cache.store(cpa, ("cpa_name", name.lower()), generation=generation)
+        return cpa
+
+    @classmethod
+    def from_row(cls, cpa_row, columns):
+        return records.row_mapper(cls, columns)(cpa_row)
+
+    @classmethod
+    def get_client_relations(cls, cpa_name=None, session=None):
         """
             Retrieves all relationships between CPAs and clients from the database.
             Returns:
                 list of dict: A list of dictionaries where each dictionary contains
                 'cpa_name' and 'client_name' representing a CPA-client relationship.
         """
-        with get_connection() as connection:
-            relations = database.get_cpa_client_relations(connection)
-            return [{"cpa_name": relation[0], "client_name": relation[1]} for relation in relations]
\ No newline at end of file
+        return list(cls.iter_client_relations(cpa_name, session))
+
+    @classmethod
+    def iter_client_relations(cls, cpa_name=None, session=None):
+        """
+            Streams the CPA-client relationships sorted by CPA name, then client name, optionally only
+            those of one CPA. Rows are fetched from a server-side cursor in chunks, so the first relation is
+            available right away and memory use does not grow with the number of clients.
+            Yields:
+                dict: 'cpa_name' and 'client_name' of one relationship.
+        """
+        with use_connection(session, read_only=True) as connection:
+            for relation in database.iter_cpa_client_relations(connection, cpa_name):
+                yield _relation_dict(relation)
+
+    @classmethod
+    async def aiter_client_relations(cls, cpa_name=None):
+        # async counterpart of `iter_client_relations`
+        async with async_connection_pool.get_connection() as connection:
+            async for relation in async_database.iter_cpa_client_relations(connection, cpa_name):
+                yield _relation_dict(relation)
+
+    @classmethod
+    def get_client_relations_page(cls, page_size=50, page_token=None, cpa_name=None, session=None):
+        """
+            Retrieves one page of the CPA-client relationships, in the same order as `iter_client_relations`.
+            Returns:
+                tuple: (list of dict, token to pass as `page_token` for the next page or None on the last page).
+        """
+        after = pagination.decode_page_token(page_token) if page_token else None
+        with use_connection(session, read_only=True) as connection:
+            relations = database.get_cpa_client_relations(connection, cpa_name, after, page_size + 1)
+        relations, next_token = pagination.paginate(relations, page_size, database.relation_page_key)
+        return [_relation_dict(relation) for relation in relations], next_token
@@ -1,11 +1,57 @@
+import async_connection_pool
+import async_database
 import database
-from connection_pool import get_connection
+import entity_cache
+import records
+import tax_years
+import write_behind
+from classes.TaxReturn import TaxReturn
+from session import current_session, invalidate_cached, use_connection
+
+
+def _invalidate(client_id=None, name=None, session=None):
+    # clients are cached under both their id and their name, so drop both entries of the cached client
+    cached = entity_cache.entities.peek(("client_id", client_id)) or entity_cache.entities.peek(
+        ("client_name", name.lower() if name else None))
+    if cached:
+        client_id = cached._id if client_id is None else client_id
+        name = name or cached.name
+    invalidate_cached(("client_id", client_id), ("client_name", name.lower() if name else None), session=session)
+
+
+def _with_pending_status(client):
+    # a materials status buffered in write-behind mode (see write_behind.py) is not in the database or cache yet
+    materials_submitted = write_behind.pending_materials_status(client.name) if client else None
+    if materials_submitted is None:
+        return client
+    return Client(client.name, client.address, client.income, materials_submitted, client.cpa, client.assistant,
+                  client._id)
+
+
+def _with_tax_return(columns):
+    # row factory of database.get_client_with_tax_return: (Client, TaxReturn) per row
+    client = records.row_mapper(Client, columns)
+    tax_return = records.row_mapper(TaxReturn, columns, "tax_return_")
+    return lambda row: (client(row), tax_return(row))
+
+
+def _with_score(columns):
+    # row factory of database.search_clients: (Client, score) per row
+    client = records.row_mapper(Client, columns)
+    score = columns.index("score")
+    return lambda row: (client(row), row[score])
 
 
 class Client:
     """
     Represents a client in the tax filing system.
     """
+    __slots__ = ("_id", "name", "address", "income", "materials_submitted", "cpa", "assistant")
+    # `__init__` argument -> result column, see records.py
+    COLUMNS = {"name": "name", "address": "address", "income": "income",
+               "materials_submitted": "materials_submitted", "cpa": "cpa_name", "assistant": "assistant_name",
+               "_id": "id"}
+
     def __init__(self, name, address, income, materials_submitted=False, cpa=None, assistant=None, _id=None):
         self._id = _id
         self.name = name
@@ -28,58 +74,203 @@ class Client:
             f"{assistant_association}"
         )
 
-    def save(self):
+    def save(self, session=None):
         """
         Represents a client in the tax filing system.
         Inserts the client's details into the database and updates the `_id`
         attribute with the generated ID.
         """
-        with get_connection() as connection:
+        with use_connection(session) as connection:
             new_client_id = database.add_client(connection, self.name, self.address, self.income)
             self._id = new_client_id
+        _invalidate(name=self.name, session=session)
+
+    async def asave(self):
+        # async counterpart of `save`
+        async with async_connection_pool.get_connection() as connection:
+            self._id = await async_database.add_client(connection, self.name, self.address, self.income)
+        _invalidate(name=self.name)
+
+    @classmethod
+    def onboard(cls, name, address, income, cpa_name=None, assistant_name=None, year=None, session=None):
+        """
+        Adds a new client assigned to a CPA and an assistant (both by name, both optional) and creates its empty
+        tax return for `year` (default: `tax_years.default_tax_year()`), all in one statement and one transaction.
+        Raises:
+            ValueError: If the CPA or assistant does not exist. Nothing is saved in that case.
+        Returns:
+            Client: The new client.
+        """
+        with use_connection(session) as connection:
+            client_id, _, _, _ = database.onboard_client(
+                connection, name, address, income, tax_years.default_tax_year() if year is None else year, cpa_name,
+                assistant_name)
+        _invalidate(name=name, session=session)
+        return cls(name=name, address=address, income=income, cpa=cpa_name, assistant=assistant_name, _id=client_id)
 
-    def mark_materials_submitted(self):
+    def mark_materials_submitted(self, session=None):
         """
         Marks the client's materials as submitted.
         Updates the `materials_submitted` attribute to `True` and reflects the change
         in the database.
+        Outside a session in write-behind mode (WRITE_BEHIND), the change is buffered and written shortly after.
         """
         self.materials_submitted = True
-        with get_connection() as connection:
-            database.change_materials_status(connection, self.name, self.materials_submitted)
+        try:
+            if write_behind.enabled and current_session(session) is None:
+                write_behind.get_buffer().change_materials_status(self.name, self.materials_submitted)
+            else:
+                with use_connection(session) as connection:
+                    database.change_materials_status(connection, self.name, self.materials_submitted)
+        finally:
+            # this may be the cached instance, which is changed even if the write fails
+            _invalidate(self._id, self.name, session)
+
+    async def amark_materials_submitted(self):
+        # async counterpart of `mark_materials_submitted`
+        self.materials_submitted = True
+        try:
+            async with async_connection_pool.get_connection() as connection:
+                await async_database.change_materials_status(connection, self.name, self.materials_submitted)
+        finally:
+            _invalidate(self._id, self.name)
+
+    @classmethod
+    def mark_materials_submitted_many(cls, names_or_ids, session=None):
+        """
+        Marks the materials of many clients as submitted.
+        Clients can be given by ID (int) or by name (str); each kind is updated with a single statement.
+        Returns:
+            list of int: The IDs of the clients whose status changed. Clients that were not found or had
+            already submitted their materials are not included.
+        """
+        client_ids = [(key, True) for key in names_or_ids if isinstance(key, int)]
+        client_names = [(key, True) for key in names_or_ids if not isinstance(key, int)]
+        with use_connection(session) as connection:
+            changed = database.change_materials_status_many(connection, client_ids)
+            changed += [row[0] for row in database.change_materials_status_many_by_name(connection, client_names)]
+        for key in names_or_ids:
+            if isinstance(key, int):
+                _invalidate(client_id=key, session=session)
+            else:
+                _invalidate(name=key, session=session)
+        return changed
 
-    def assign_cpa(self, cpa_id):
+    def assign_cpa(self, cpa_id, session=None):
         """Assigns a CPA to the client.
         Updates the `cpa_id` for the client in the database to associate the client
         with the given CPA.
         """
-        with get_connection() as connection:
+        with use_connection(session) as connection:
             database.assign_cpa_to_client(connection, self._id, cpa_id)
+        _invalidate(self._id, self.name, session)
 
-    def assign_assistant(self, assistant_id):
-        with get_connection() as connection:
+    def assign_assistant(self, assistant_id, session=None):
+        with use_connection(session) as connection:
             database.assign_assistant_to_client(connection, self._id, assistant_id)
+        _invalidate(self._id, self.name, session)
 
     def materials_status(self):
         # check if client has submitted their materials
         return self.materials_submitted
 
     @classmethod
-    def get(cls, name):
+    def get(cls, name, use_cache=True, session=None):
         """
         Retrieves a client from the database by name.
+        Served from the entity cache when possible; pass `use_cache=False` to always read the database.
         Args:
             name (str): The name of the client to retrieve.
         Returns:
             Client or None: An instance of the `Client` class if a matching client is found,
             otherwise `None`.
         """
-        with get_connection() as connection:
-            client_row = database.get_client_details(connection, name)
-            if client_row:
-                return cls(
-                    name=client_row[1], address=client_row[2], income=client_row[3], materials_submitted=client_row[4],
-                    cpa=client_row[5], assistant=client_row[6], _id=client_row[0]
-                )
+        use_cache = use_cache and current_session(session) is None  # a session may hold uncommitted writes
+        client, generation = entity_cache.lookup(("client_name", name.lower()), use_cache)
+        if client is not entity_cache.MISSING:
+            return _with_pending_status(client)
+        with use_connection(session, read_only=True) as connection:
+            client = database.get_client_details(connection, name, records.factory(cls))
+            use_cache = use_cache and not getattr(connection, "is_replica", False)  # the replica may lag behind
+        return _with_pending_status(cls._cache_client(name, client, use_cache, generation))
+
+    @classmethod
+    async def aget(cls, name, use_cache=True):
+        # async counterpart of `get`
+        client, generation = entity_cache.lookup(("client_name", name.lower()), use_cache)
+        if client is not entity_cache.MISSING:
+            return _with_pending_status(client)
+        async with async_connection_pool.get_connection() as connection:
+            client = await async_database.get_client_details(connection, name, records.factory(cls))
+        return _with_pending_status(cls._cache_client(name, client, use_cache, generation))
+
+    @classmethod
+    def get_with_tax_return(cls, name, year=None, use_cache=True, session=None):
+        """
+        Retrieves a client together with its tax return for a tax year (default: `tax_years.default_tax_year()`)
+        and its CPA and assistant names in one round trip.
+        Returns:
+            tuple or None: (Client, TaxReturn or None if the client has no tax return for the year),
+            or None if there is no client with that name.
+        """
+        year = tax_years.default_tax_year() if year is None else year
+        use_cache = use_cache and current_session(session) is None
+        client, generation = entity_cache.lookup(("client_name", name.lower()), use_cache)
+        if client is not entity_cache.MISSING:
+            tax_return, _ = entity_cache.lookup(("tax_return", client._id, year), use_cache)
+            if tax_return is not entity_cache.MISSING:
+                return _with_pending_status(client), TaxReturn.with_pending_status(tax_return)
+        with use_connection(session, read_only=True) as connection:
+            result = database.get_client_with_tax_return(connection, name, year, _with_tax_return)
+            use_cache = use_cache and not getattr(connection, "is_replica", False)  # the replica may lag behind
+        if not result:
             return None
+        client, tax_return = result
+        client = cls._cache_client(name, client, use_cache, generation)
+        if tax_return._id is None:
+            return _with_pending_status(client), None
+        if use_cache:
+            entity_cache.store(tax_return, ("tax_return", client._id, year), generation=generation)
+        return _with_pending_status(client), TaxReturn.with_pending_status(tax_return)
+
+    @classmethod
+    def search(cls, text, limit=20, offset=0, session=None):
+        """
+        Finds clients by partial or misspelled name or address, best match first.
+        Uses trigram similarity when the pg_trgm extension is installed and a prefix match otherwise.
+        Args:
+            text (str): The text to look for.
+            limit (int): The maximum number of results.
+            offset (int): The number of results to skip, e.g. `limit * page` for later pages.
+        Returns:
+            list of tuple: (Client, score between 0 and 1).
+        """
+        if not text.strip():
+            return []
+        with use_connection(session, read_only=True) as connection:
+            return database.search_clients(connection, text, limit, offset, _with_score)
+
+    @classmethod
+    def _cache_client(cls, name, client, use_cache, generation):
+        if client is not None and use_cache:
+            entity_cache.store(client, ("client_name", name.lower()), ("client_id", client._id),
+                               generation=generation)
+        return client
 
+    @classmethod
+    def from_row(cls, client_row, columns):
+        """
+        Builds a client from a row with the given column names, e.g. `records.column_names(cursor)`.
+        """
+        return records.row_mapper(cls, columns)(client_row)
+
+    @classmethod
+    def iter_all(cls, fetch_size=2000, session=None):
+        """
+        Streams every client, in id order, `fetch_size` rows per round trip, so memory use does not grow with the
+        number of clients. The clients do not go through the entity cache.
+        Yields:
+            Client: One per client, with its CPA and assistant names.
+        """
+        with use_connection(session, read_only=True) as connection:
+            yield from database.iter_client_details(connection, records.factory(cls), fetch_size)
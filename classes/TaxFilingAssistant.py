@@ -1,33 +1,106 @@
+import async_connection_pool
+import async_database
 import database
-from connection_pool import get_connection
+import entity_cache
+import pagination
+import records
+from session import current_session, invalidate_cached, use_connection
+
+
+def _relation_dict(relation):
+    return {"assistant_name": relation[0], "client_name": relation[1]}
 
 
 class TaxFilingAssistant:
+    __slots__ = ("_id", "name")
+    COLUMNS = {"name": "name", "_id": "id"}  # `__init__` argument -> result column, see records.py
+
     def __init__(self, name, _id=None):
         self._id = _id
         self.name = name
 
-    def save(self):
-        with get_connection() as connection:
+    def save(self, session=None):
+        with use_connection(session) as connection:
             assistant_id = database.add_tax_filing_assistant(connection, self.name)
             self._id = assistant_id
+        invalidate_cached(("assistant_name", self.name.lower()), session=session)
+
+    async def asave(self):
+        # async counterpart of `save`
+        async with async_connection_pool.get_connection() as connection:
+            self._id = await async_database.add_tax_filing_assistant(connection, self.name)
+        entity_cache.invalidate(("assistant_name", self.name.lower()))
+
+    @classmethod
+    def get(cls, name, use_cache=True, session=None):
+        use_cache = use_cache and current_session(session) is None  # a session may hold uncommitted writes
+        assistant, generation = entity_cache.lookup(("assistant_name", name.lower()), use_cache)
+        if assistant is not entity_cache.MISSING:
+            return assistant
+        with use_connection(session, read_only=True) as connection:
+            assistant = database.get_tax_filing_assistant_by_name(connection, name, records.factory(cls))
+            use_cache = use_cache and not getattr(connection, "is_replica", False)  # the replica may lag behind
+        return cls._cache(name, assistant, use_cache, generation)
 
     @classmethod
-    def get(cls, name):
-        with get_connection() as connection:
-            assistant_row = database.get_tax_filing_assistant_by_name(connection, name)
-            if assistant_row:
-                return cls(name=assistant_row[1], _id=assistant_row[0])
-            return None
+    async def aget(cls, name, use_cache=True):
+        # async counterpart of `get`
+        assistant, generation = entity_cache.lookup(("assistant_name", name.lower()), use_cache)
+        if assistant is not entity_cache.MISSING:
+            return assistant
+        async with async_connection_pool.get_connection() as connection:
+            assistant = await async_database.get_tax_filing_assistant_by_name(connection, name, records.factory(cls))
+        return cls._cache(name, assistant, use_cache, generation)
 
     @classmethod
-    def get_client_relations(cls):
+    def _cache(cls, name, assistant, use_cache, generation):
+        if assistant is not None and use_cache:
+            entity_cache.store(assistant, ("assistant_name", name.lower()), generation=generation)
+        return assistant
+
+    @classmethod
+    def from_row(cls, assistant_row, columns):
+        return records.row_mapper(cls, columns)(assistant_row)
+
+    @classmethod
+    def get_client_relations(cls, assistant_name=None, session=None):
         """
             Retrieves all relationships between Tax Filing Assistants and clients from the database.
             Returns:
                 list of dict: A list of dictionaries where each dictionary contains
                 'assistant_name' and 'client_name' representing an assistant-client relationship.
         """
-        with get_connection() as connection:
-            relations = database.get_assistant_client_relations(connection)
-            return [{"assistant_name": relation[0], "client_name": relation[1]} for relation in relations]
+        return list(cls.iter_client_relations(assistant_name, session))
+
+    @classmethod
+    def iter_client_relations(cls, assistant_name=None, session=None):
+        """
+            Streams the assistant-client relationships sorted by assistant name, then client name, optionally only
+            those of one assistant. Rows are fetched from a server-side cursor in chunks, so the first relation is
+            available right away and memory use does not grow with the number of clients.
+            Yields:
+                dict: 'assistant_name' and 'client_name' of one relationship.
+        """
+        with use_connection(session, read_only=True) as connection:
+            for relation in database.iter_assistant_client_relations(connection, assistant_name):
+                yield _relation_dict(relation)
+
+    @classmethod
+    async def aiter_client_relations(cls, assistant_name=None):
+        # async counterpart of `iter_client_relations`
+        async with async_connection_pool.get_connection() as connection:
+            async for relation in async_database.iter_assistant_client_relations(connection, assistant_name):
+                yield _relation_dict(relation)
+
+    @classmethod
+    def get_client_relations_page(cls, page_size=50, page_token=None, assistant_name=None, session=None):
+        """
+            Retrieves one page of the assistant-client relationships, in the same order as `iter_client_relations`.
+            Returns:
+                tuple: (list of dict, token to pass as `page_token` for the next page or None on the last page).
+        """
+        after = pagination.decode_page_token(page_token) if page_token else None
+        with use_connection(session, read_only=True) as connection:
+            relations = database.get_assistant_client_relations(connection, assistant_name, after, page_size + 1)
+        relations, next_token = pagination.paginate(relations, page_size, database.relation_page_key)
+        return [_relation_dict(relation) for relation in relations], next_token
@@ -1,75 +1,305 @@
 import datetime
 import pytz as pytz
+import async_connection_pool
+import async_database
 import database
-from connection_pool import get_connection
+import entity_cache
+import records
+import tax_years
+import write_behind
+from session import current_session, invalidate_cached, use_connection
+
+
+def _checked_by(filed_by):
+    # the database records "yes" when a CPA filed the return and "no" when an assistant did
+    return "yes" if filed_by == "CPA" else "no"
+
+
+def _current_timestamp():
+    return datetime.datetime.now(tz=pytz.utc)
+
+
+def _tax_year(year):
+    return tax_years.default_tax_year() if year is None else year
 
 
 class TaxReturn:
     """
-    Represents a tax return for a client.
+    Represents a client's tax return for one tax year. Every method that takes a `year` defaults to
+    `tax_years.default_tax_year()`.
     """
-    def __init__(self, client_id, filed_or_not=False, checked_by=None, tax_return_timestamp=None, _id=None):
+    __slots__ = ("_id", "client_id", "tax_year", "filed_or_not", "checked_by", "tax_return_timestamp")
+    # `__init__` argument -> result column, see records.py
+    COLUMNS = {"client_id": "client_id", "filed_or_not": "filed_or_not", "checked_by": "checked_by",
+               "tax_return_timestamp": "tax_return_timestamp", "_id": "id", "tax_year": "tax_year"}
+
+    def __init__(self, client_id, filed_or_not=False, checked_by=None, tax_return_timestamp=None, _id=None,
+                 tax_year=None):
         self._id = _id
         self.client_id = client_id
+        self.tax_year = _tax_year(tax_year)
         self.filed_or_not = filed_or_not
         self.checked_by = checked_by
         self.tax_return_timestamp = tax_return_timestamp
 
-    def mark_filed(self, filed_by):
+    def mark_filed(self, filed_by, session=None):
         """
             Marks the tax return as filed and records who filed it.
             Updates the `filed_or_not` attribute to `True`, sets the `checked_by`
             attribute to indicate whether the return was filed by a CPA or an assistant,
             and records the timestamp of the filing.
+            Outside a session in write-behind mode (WRITE_BEHIND), the change is buffered and written shortly after.
         """
         self.filed_or_not = True
-        if filed_by == "CPA":
-            self.checked_by = "yes"
-        else:
-            self.checked_by = "no"
-        with get_connection() as connection:
-            current_datetime_utc = datetime.datetime.now(tz=pytz.utc)
-            current_timestamp = current_datetime_utc.timestamp()
-            database.change_tax_return_status(connection, self.client_id, self.filed_or_not, self.checked_by, current_timestamp)
+        self.checked_by = _checked_by(filed_by)
+        try:
+            if write_behind.enabled and current_session(session) is None:
+                write_behind.get_buffer().change_tax_return_status(self.client_id, self.tax_year, self.filed_or_not,
+                                                                   self.checked_by, _current_timestamp())
+            else:
+                with use_connection(session) as connection:
+                    database.change_tax_return_status(connection, self.client_id, self.tax_year, self.filed_or_not,
+                                                      self.checked_by, _current_timestamp())
+        finally:
+            # this may be the cached instance, which is changed even if the write fails
+            invalidate_cached(("tax_return", self.client_id, self.tax_year), session=session)
+
+    async def amark_filed(self, filed_by):
+        # async counterpart of `mark_filed`
+        self.filed_or_not = True
+        self.checked_by = _checked_by(filed_by)
+        try:
+            async with async_connection_pool.get_connection() as connection:
+                await async_database.change_tax_return_status(connection, self.client_id, self.tax_year,
+                                                              self.filed_or_not, self.checked_by,
+                                                              _current_timestamp())
+        finally:
+            entity_cache.invalidate(("tax_return", self.client_id, self.tax_year))
 
     @classmethod
-    def get(cls, client_id):
+    def mark_filed_by_client_name(cls, client_name, filed_by, year=None, session=None):
         """
-            Retrieves a tax return from the database based on the client's ID.
+            Marks the tax return of the client with the given name as filed, in a single statement.
+            Returns:
+                tuple or None: (client_id, has_tax_return) where `has_tax_return` is False if the client has
+                no tax return for the year to mark, or None if there is no client with that name.
+        """
+        year = _tax_year(year)
+        with use_connection(session) as connection:
+            result = database.change_tax_return_status_by_client_name(
+                connection, client_name, year, True, _checked_by(filed_by), _current_timestamp())
+        if not result:
+            return None
+        client_id, tax_return_id = result
+        invalidate_cached(("tax_return", client_id, year), session=session)
+        return client_id, tax_return_id is not None
+
+    @classmethod
+    def mark_filed_many(cls, client_ids, filed_by, year=None, session=None):
+        """
+            Marks the tax returns of many clients as filed in one statement and one transaction.
+            Returns that were already filed are left untouched.
+            Returns:
+                list of int: The IDs of the clients whose tax return was marked as filed.
+        """
+        checked_by = _checked_by(filed_by)
+        current_timestamp = _current_timestamp()
+        year = _tax_year(year)
+        rows = [(client_id, True, checked_by, current_timestamp) for client_id in client_ids]
+        with use_connection(session) as connection:
+            changed = database.change_tax_return_status_many(connection, rows, year)
+        invalidate_cached(*[("tax_return", client_id, year) for client_id in changed], session=session)
+        return changed
+
+    @classmethod
+    def mark_filed_many_by_name(cls, client_names, filed_by, year=None, session=None):
+        """
+            Same as `mark_filed_many`, but takes client names instead of IDs.
+            Returns:
+                list of tuple: (client_id, client_name) of the clients whose tax return was marked as filed.
+        """
+        checked_by = _checked_by(filed_by)
+        current_timestamp = _current_timestamp()
+        year = _tax_year(year)
+        rows = [(client_name, True, checked_by, current_timestamp) for client_name in client_names]
+        with use_connection(session) as connection:
+            changed = database.change_tax_return_status_many_by_name(connection, rows, year)
+        invalidate_cached(*[("tax_return", client_id, year) for client_id, _ in changed], session=session)
+        return changed
+
+    @classmethod
+    def get(cls, client_id, year=None, use_cache=True, session=None):
+        """
+            Retrieves a client's tax return for a tax year from the database.
+            Served from the entity cache when possible; pass `use_cache=False` to always read the database.
             Returns:
                 TaxReturn or None: An instance of the `TaxReturn` class if a matching
                 tax return is found, otherwise `None`.
         """
-        with get_connection() as connection:
-            tax_return_info = database.get_tax_return(connection, client_id)
-            if tax_return_info:
-                return cls(
-                    client_id=tax_return_info[1],
-                    filed_or_not=tax_return_info[2],
-                    checked_by=tax_return_info[3],
-                    tax_return_timestamp=tax_return_info[4],
-                    _id=tax_return_info[0],
-                )
+        year = _tax_year(year)
+        use_cache = use_cache and current_session(session) is None  # a session may hold uncommitted writes
+        tax_return, generation = entity_cache.lookup(("tax_return", client_id, year), use_cache)
+        if tax_return is not entity_cache.MISSING:
+            return cls.with_pending_status(tax_return)
+        with use_connection(session, read_only=True) as connection:
+            tax_return = database.get_tax_return(connection, client_id, year, records.factory(cls))
+            use_cache = use_cache and not getattr(connection, "is_replica", False)  # the replica may lag behind
+        return cls.with_pending_status(cls._cache(tax_return, use_cache, generation))
+
+    @classmethod
+    async def aget(cls, client_id, year=None, use_cache=True):
+        # async counterpart of `get`
+        year = _tax_year(year)
+        tax_return, generation = entity_cache.lookup(("tax_return", client_id, year), use_cache)
+        if tax_return is not entity_cache.MISSING:
+            return cls.with_pending_status(tax_return)
+        async with async_connection_pool.get_connection() as connection:
+            tax_return = await async_database.get_tax_return(connection, client_id, year, records.factory(cls))
+        return cls.with_pending_status(cls._cache(tax_return, use_cache, generation))
+
+    @classmethod
+    def history(cls, client_id, session=None):
+        """
+            Retrieves the client's tax returns of every tax year that is not archived.
+            Returns:
+                list of TaxReturn: Oldest tax year first.
+        """
+        with use_connection(session, read_only=True) as connection:
+            return database.get_tax_returns_of_client(connection, client_id, records.factory(cls))
+
+    @classmethod
+    def with_pending_status(cls, tax_return):
+        """
+            Returns the tax return with the status buffered for it in write-behind mode (see write_behind.py),
+            which is not in the database or the entity cache yet; the tax return itself if there is none.
+        """
+        if tax_return is None:
             return None
+        status = write_behind.pending_tax_return_status(tax_return.client_id, tax_return.tax_year)
+        if status is None:
+            return tax_return
+        return cls(tax_return.client_id, *status, _id=tax_return._id, tax_year=tax_return.tax_year)
+
+    @classmethod
+    def _cache(cls, tax_return, use_cache, generation):
+        if tax_return is not None and use_cache:
+            entity_cache.store(tax_return, ("tax_return", tax_return.client_id, tax_return.tax_year),
+                               generation=generation)
+        return tax_return
+
+    @classmethod
+    def from_row(cls, tax_return_info, columns):
+        """
+            Builds a tax return from a row with the given column names, e.g. `records.column_names(cursor)`.
+        """
+        return records.row_mapper(cls, columns)(tax_return_info)
+
+    @classmethod
+    def iter_all(cls, year=None, fetch_size=2000, session=None):
+        """
+            Streams the tax returns of a tax year, in client id order, `fetch_size` rows per round trip, so memory
+            use does not grow with the number of returns. The returns do not go through the entity cache.
+            Yields:
+                TaxReturn: One per tax return.
+        """
+        with use_connection(session, read_only=True) as connection:
+            yield from database.iter_tax_returns(connection, _tax_year(year), records.factory(cls), fetch_size)
 
     @classmethod
-    def create(cls, client):
-        with get_connection() as connection:
-            database.add_tax_return(connection, client._id)
-        return cls(client_id=client._id)
+    def create(cls, client, year=None, session=None):
+        year = _tax_year(year)
+        with use_connection(session) as connection:
+            database.add_tax_return(connection, client._id, year)
+        invalidate_cached(("tax_return", client._id, year), session=session)
+        return cls(client_id=client._id, tax_year=year)
 
     @classmethod
-    def is_filed(cls, client_id):
+    def create_if_absent(cls, client_name, year=None, session=None):
         """
-            Checks whether a tax return has been filed for a specific client.
+            Creates an empty tax return for the client with the given name unless it already has one for the
+            tax year, in a single atomic statement.
+            Returns:
+                tuple or None: (client_id, created) where `created` is False if the client already had a
+                tax return, or None if there is no client with that name.
+        """
+        year = _tax_year(year)
+        with use_connection(session) as connection:
+            result = database.add_tax_return_if_absent(connection, client_name, year)
+        if not result:
+            return None
+        client_id, tax_return_id = result
+        invalidate_cached(("tax_return", client_id, year), session=session)
+        return client_id, tax_return_id is not None
+
+    @classmethod
+    async def acreate(cls, client, year=None):
+        # async counterpart of `create`
+        year = _tax_year(year)
+        async with async_connection_pool.get_connection() as connection:
+            await async_database.add_tax_return(connection, client._id, year)
+        entity_cache.invalidate(("tax_return", client._id, year))
+        return cls(client_id=client._id, tax_year=year)
+
+    @classmethod
+    def is_filed(cls, client_id, year=None, session=None):
+        """
+            Checks whether a client's tax return for a tax year has been filed.
             Returns:
                 dict or None: A dictionary containing the filing status (`filed`),
                 who checked it (`checked_by`), and the filing timestamp
                 (`tax_return_timestamp`), or `None` if no tax return is found.
         """
-        with get_connection() as connection:
-            status = database.check_tax_return_status(connection, client_id)
-            if status:
-                return {"filed": status[0], "checked_by": status[1], "tax_return_timestamp": status[2]}
-            return None
+        year = _tax_year(year)
+        with use_connection(session, read_only=True) as connection:
+            status = database.check_tax_return_status(connection, client_id, year)
+        return cls.status_from_row(status and (write_behind.pending_tax_return_status(client_id, year) or status))
+
+    @classmethod
+    async def ais_filed(cls, client_id, year=None):
+        # async counterpart of `is_filed`
+        year = _tax_year(year)
+        async with async_connection_pool.get_connection() as connection:
+            status = await async_database.check_tax_return_status(connection, client_id, year)
+        return cls.status_from_row(status and (write_behind.pending_tax_return_status(client_id, year) or status))
+
+    @classmethod
+    def filed_between(cls, start, end, limit=None, session=None):
+        """
+            Lists the tax returns filed in a time window.
+            Args:
+                start (datetime.datetime): Start of the window (inclusive, timezone-aware).
+                end (datetime.datetime): End of the window (exclusive, timezone-aware).
+                limit (int): Optional maximum number of returns.
+            Returns:
+                list of dict: `client_id`, `client_name`, `checked_by` and `tax_return_timestamp`, in filing order.
+        """
+        with use_connection(session, read_only=True) as connection:
+            rows = database.get_returns_filed_between(connection, start, end, limit)
+        return [{"client_id": row[0], "client_name": row[1], "checked_by": row[2], "tax_return_timestamp": row[3]}
+                for row in rows]
+
+    @classmethod
+    def filing_report(cls, start, end, period="day", time_zone="UTC", session=None):
+        """
+            Counts the filings in a time window per hour, day, week or month, in total and by CPA vs assistant,
+            e.g. `TaxReturn.filing_report(season_start, season_end, "week", "US/Eastern")`.
+            Raises:
+                ValueError: If `period` is not one of `database.REPORT_PERIODS`.
+            Returns:
+                list of dict: `period_start`, `filed`, `filed_by_cpa` and `filed_by_assistant` for every period
+                with filings, oldest first.
+        """
+        with use_connection(session, read_only=True) as connection:
+            rows = database.count_filings_per_period(connection, start, end, period, time_zone)
+        return [{"period_start": row[0], "filed": row[1], "filed_by_cpa": row[2], "filed_by_assistant": row[3]}
+                for row in rows]
+
+    @staticmethod
+    def status_from_row(status):
+        """
+            Maps a `database.SELECT_TAX_RETURN_STATUS` row to the dictionary returned by `is_filed`.
+        """
+        if status:
+            return {"filed": status[0], "checked_by": status[1], "tax_return_timestamp": status[2]}
+        return None
 
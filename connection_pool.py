@@ -1,22 +1,363 @@
 import os
-from psycopg2.pool import SimpleConnectionPool
-from dotenv import load_dotenv
+import threading
+import time
+from collections import deque
 from contextlib import contextmanager
+from contextvars import ContextVar
 
-DATABASE_PROMPT = "Enter db url or leave empty to use .env:"
-db_url = input(DATABASE_PROMPT)
-if not db_url:
-    load_dotenv()
-    db_url = os.environ['DATABASE_URL']
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import PoolError
+from dotenv import load_dotenv
 
-pool = SimpleConnectionPool(minconn=1, maxconn=5, dsn=db_url)
+import metrics
+from prepared_statements import PreparingConnection
 
+TRUE_VALUES = {"1", "true", "yes", "on"}
 
-@contextmanager
-def get_connection():
+
+class PoolTimeout(PoolError):
+    """
+    Raised when no connection became available within the pool's checkout timeout.
+    """
+
+
+class PoolConfig:
+    """
+    Settings of the connection pool. Every setting can also be provided through the environment
+    (or a .env file): DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_CONNECT_TIMEOUT,
+    DB_MAX_LIFETIME and DB_PRE_PING, and for an optional read replica DATABASE_REPLICA_URL,
+    DB_REPLICA_STICKY_SECONDS and DB_REPLICA_RETRY_SECONDS.
+    The replica gets its own pool with the same size settings (see `get_connection`).
+    """
+    def __init__(self, dsn, min_size=1, max_size=5, checkout_timeout=30.0, connect_timeout=10,
+                 max_lifetime=3600.0, pre_ping=True, read_only=False, replica_dsn=None, replica_sticky_seconds=5.0,
+                 replica_retry_seconds=30.0):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout  # seconds to wait for a connection when the pool is exhausted
+        self.connect_timeout = connect_timeout
+        self.max_lifetime = max_lifetime  # seconds before a connection is replaced, 0 to keep it forever
+        self.pre_ping = pre_ping  # check connections with a `SELECT 1` on checkout
+        self.read_only = read_only  # run every transaction READ ONLY, e.g. for the replica pool
+        self.replica_dsn = replica_dsn
+        self.replica_sticky_seconds = replica_sticky_seconds  # reads stay on the primary this long after a write
+        self.replica_retry_seconds = replica_retry_seconds  # how long an unreachable replica is skipped
+
+    def replica_config(self):
+        # the replica pool's settings: the same pool settings on the replica DSN, read-only
+        return PoolConfig(self.replica_dsn, self.min_size, self.max_size, self.checkout_timeout,
+                          self.connect_timeout, self.max_lifetime, self.pre_ping, read_only=True)
+
+    @classmethod
+    def from_env(cls, dsn=None, **overrides):
+        load_dotenv()
+        settings = {
+            "min_size": int(os.environ.get("DB_POOL_MIN", 1)),
+            "max_size": int(os.environ.get("DB_POOL_MAX", 5)),
+            "checkout_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+            "connect_timeout": int(os.environ.get("DB_CONNECT_TIMEOUT", 10)),
+            "max_lifetime": float(os.environ.get("DB_MAX_LIFETIME", 3600)),
+            "pre_ping": os.environ.get("DB_PRE_PING", "true").lower() in TRUE_VALUES,
+            "replica_dsn": os.environ.get("DATABASE_REPLICA_URL") or None,
+            "replica_sticky_seconds": float(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5)),
+            "replica_retry_seconds": float(os.environ.get("DB_REPLICA_RETRY_SECONDS", 30)),
+        }
+        settings.update(overrides)
+        return cls(dsn or os.environ["DATABASE_URL"], **settings)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+    Unlike `psycopg2.pool.ThreadedConnectionPool`, an exhausted pool makes callers wait (up to
+    `checkout_timeout`) instead of raising, and it keeps statistics about its usage.
+    """
+    def __init__(self, config):
+        self.config = config
+        self._condition = threading.Condition()
+        self._idle = deque()
+        self._created_at = {}
+        self._size = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0, "waits": 0, "wait_time_total": 0.0, "wait_time_max": 0.0,
+            "connections_created": 0, "connections_recycled": 0, "connection_errors": 0,
+        }
+        for _ in range(config.min_size):
+            self._size += 1
+            self._idle.append(self._connect())
+
+    def _connect(self):
+        try:
+            connection = psycopg2.connect(self.config.dsn, connect_timeout=self.config.connect_timeout,
+                                          connection_factory=PreparingConnection)
+        except psycopg2.Error:
+            with self._condition:
+                self._stats["connection_errors"] += 1
+            raise
+        if self.config.read_only:
+            connection.set_session(readonly=True)
+        with self._condition:
+            self._created_at[connection] = time.monotonic()
+            self._stats["connections_created"] += 1
+        return connection
+
+    def _discard(self, connection):
+        with self._condition:
+            self._created_at.pop(connection, None)
+        if not connection.closed:
+            connection.close()
+
+    def _is_usable(self, connection):
+        if connection.closed:
+            return False
+        lifetime = self.config.max_lifetime
+        if lifetime and time.monotonic() - self._created_at.get(connection, 0) > lifetime:
+            with self._condition:
+                self._stats["connections_recycled"] += 1
+            return False
+        if self.config.pre_ping:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1;")
+                connection.rollback()
+            except psycopg2.Error:
+                with self._condition:
+                    self._stats["connection_errors"] += 1
+                return False
+        return True
+
+    def _record_wait(self, waited_since):
+        waited = time.monotonic() - waited_since
+        self._stats["wait_time_total"] += waited
+        self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+
+    def getconn(self):
+        """
+        Checks out a connection, waiting while all `max_size` connections are in use.
+        Connections past their `max_lifetime` or failing the pre-ping are replaced transparently.
+        Raises:
+            PoolTimeout: If no connection became available within `checkout_timeout` seconds.
+        """
+        waited_since = None
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+                if self._idle:
+                    connection = self._idle.pop()
+                    break
+                if self._size < self.config.max_size:
+                    self._size += 1
+                    connection = None
+                    break
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self._stats["waits"] += 1
+                remaining = self.config.checkout_timeout - (time.monotonic() - waited_since)
+                if remaining <= 0:
+                    self._record_wait(waited_since)
+                    raise PoolTimeout(f"no connection available after {self.config.checkout_timeout}s")
+                self._condition.wait(remaining)
+            if waited_since is not None:
+                self._record_wait(waited_since)
+            self._stats["checkouts"] += 1
+        try:
+            if connection is not None and not self._is_usable(connection):
+                self._discard(connection)
+                connection = None
+            if connection is None:
+                connection = self._connect()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        return connection
+
+    def putconn(self, connection, discard=False):
+        """
+        Returns a connection to the pool. Broken connections, or ones passed with `discard=True`, are closed.
+        """
+        if not discard and not connection.closed and connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                discard = True
+        if discard or connection.closed or self._closed:
+            self._discard(connection)
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            return
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def closeall(self):
+        with self._condition:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            self._discard(connection)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Counters (`checkouts`, `waits`, `wait_time_total`, `wait_time_max`, `connections_created`,
+            `connections_recycled`, `connection_errors`) and the current `size`, `active` and `idle` counts.
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats.update(size=self._size, idle=len(self._idle), active=self._size - len(self._idle))
+        return stats
+
+
+_pool = None
+_replica_pool = None
+_pool_lock = threading.Lock()
+_config = None
+_replica_down_until = 0.0
+_routing_stats = {"replica_reads": 0, "sticky_reads": 0, "failovers": 0}
+_last_write = ContextVar("last_write", default=None)  # monotonic time of this context's last primary checkout
+
+
+def configure(dsn=None, **options):
+    """
+    Sets the database URL and pool options (see `PoolConfig`) used when the pool is created.
+    Settings that are not given fall back to the environment. Closes the current pools, if any.
+    """
+    global _pool, _replica_pool, _config, _replica_down_until
+    with _pool_lock:
+        _config = PoolConfig.from_env(dsn, **options)
+        for pool in (_pool, _replica_pool):
+            if pool is not None:
+                pool.closeall()
+        _pool = _replica_pool = None
+        _replica_down_until = 0.0
+
+
+def get_config():
+    """
+    Returns the current `PoolConfig`: the one given to `configure`, or else the environment's.
+    """
+    global _config
+    if _config is None:
+        with _pool_lock:
+            _config = _config or PoolConfig.from_env()
+    return _config
+
+
+def get_pool():
+    """
+    Returns the shared pool, creating it on first use.
+    """
+    global _pool
+    if _pool is None:
+        config = get_config()
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(config)
+    return _pool
+
+
+def get_replica_pool():
+    """
+    Returns the read replica's pool, creating it on first use, or None when no replica is configured.
+    Raises:
+        psycopg2.OperationalError: If the pool's first connections cannot be made.
+    """
+    global _replica_pool
+    config = get_config()
+    if _replica_pool is None and config.replica_dsn:
+        with _pool_lock:
+            if _replica_pool is None:
+                _replica_pool = ConnectionPool(config.replica_config())
+    return _replica_pool
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def replica_stats():
+    """
+    Returns:
+        dict or None: The replica pool's `pool_stats` plus the routing counters `replica_reads`, `sticky_reads`
+        (read-only checkouts kept on the primary after a write) and `failovers` (replica unreachable),
+        or None when no replica is configured.
+    """
+    if not get_config().replica_dsn:
+        return None
+    stats = dict(_replica_pool.stats()) if _replica_pool is not None else {}
+    with _pool_lock:
+        stats.update(_routing_stats)
+    return stats
+
+
+def _count(counter):
+    with _pool_lock:
+        _routing_stats[counter] += 1
+
+
+def _checkout(pool):
+    if not metrics.enabled:
+        return pool.getconn()
+    started = time.perf_counter()
     connection = pool.getconn()
+    metrics.record_pool_checkout(time.perf_counter() - started)
+    return connection
 
+
+def _replica_checkout(config):
+    """
+    Checks out a replica connection for a read-only block, or returns (None, None) when the block should run on
+    the primary: no replica configured, a write in this context less than `replica_sticky_seconds` ago
+    (read-your-writes), or the replica was found unreachable less than `replica_retry_seconds` ago.
+    """
+    global _replica_down_until
+    if not config.replica_dsn:
+        return None, None
+    now = time.monotonic()
+    last_write = _last_write.get()
+    if last_write is not None and now - last_write < config.replica_sticky_seconds:
+        _count("sticky_reads")
+        return None, None
+    if now < _replica_down_until:
+        _count("failovers")
+        return None, None
+    try:
+        pool = get_replica_pool()
+        connection = _checkout(pool)
+    except psycopg2.OperationalError:
+        _replica_down_until = time.monotonic() + config.replica_retry_seconds
+        _count("failovers")
+        return None, None
+    _count("replica_reads")
+    connection.is_replica = True  # rows read from it are not cached, see the model `get` methods
+    return pool, connection
+
+
+@contextmanager
+def get_connection(read_only=False):
+    """
+    Checks out a pooled connection for the block and returns it to the pool afterwards.
+    With `read_only=True` the block runs on the read replica when one is configured (DATABASE_REPLICA_URL),
+    falling back to the primary as described in `_replica_checkout`. Every other checkout is treated as a write
+    and starts the read-your-writes window of the current context (thread or asyncio task).
+    """
+    pool, connection = _replica_checkout(get_config()) if read_only else (None, None)
+    if connection is None:
+        pool = get_pool()
+        connection = _checkout(pool)
     try:
         yield connection
     finally:
-        pool.putconn(connection)
\ No newline at end of file
+        pool.putconn(connection)
+        if not read_only:
+            _last_write.set(time.monotonic())
@@ -0,0 +1,63 @@
+# workload and filing progress per CPA and assistant, read from summary tables that triggers keep current
+# (migration 15). A dashboard read costs one row per staff member, however many clients there are.
+from collections import namedtuple
+
+import database
+import tax_years
+from connection_pool import get_connection
+
+
+class StaffProgress(namedtuple("StaffProgress", ["role", "staff_id", "name", "clients", "materials_submitted",
+                                                 "returns", "filed", "filed_by_cpa", "filed_by_assistant"])):
+    """
+    The clients of one CPA / assistant (staff_id 0 and no name: the clients without one) and their tax returns
+    of the dashboard's tax year.
+    """
+    @property
+    def unfiled(self):
+        # clients without a return for the year count as unfiled as well
+        return self.clients - self.filed
+
+    @property
+    def materials_percent(self):
+        return 100.0 * self.materials_submitted / self.clients if self.clients else 0.0
+
+
+COUNTS = StaffProgress._fields[3:]
+
+
+class Dashboard(namedtuple("Dashboard", ["tax_year", "cpas", "assistants", "totals"])):
+    """
+    cpas / assistants: list of StaffProgress, by name, followed by the unassigned clients if there are any.
+    totals: StaffProgress over all clients (role and name None).
+    """
+
+
+def get_dashboard(tax_year=None):
+    """
+    Returns the workload and progress of every CPA and assistant for a tax year (default: the current season).
+    Runs on the read replica when one is configured.
+
+    Returns:
+        Dashboard: The progress per staff member and in total.
+    """
+    tax_year = tax_years.default_tax_year() if tax_year is None else tax_year
+    with get_connection(read_only=True) as connection:
+        rows = [StaffProgress(*row) for row in database.get_staff_dashboard(connection, tax_year)]
+    rows = [row for row in rows if row.staff_id or row.clients]
+    cpas = [row for row in rows if row.role == "cpa"]
+    # every client is counted once among the CPAs, the unassigned included
+    totals = StaffProgress(None, None, None, *(sum(getattr(row, count) for row in cpas) for count in COUNTS))
+    return Dashboard(tax_year, cpas, [row for row in rows if row.role == "assistant"], totals)
+
+
+def rebuild(tax_year=None):
+    """
+    Recounts the summaries behind the dashboard from the clients and tax returns, to repair them.
+    Writes to clients and tax returns wait until the rebuild is done.
+
+    Args:
+        tax_year (int): Only recount the tax returns of this year. None recounts everything.
+    """
+    with get_connection() as connection:
+        database.rebuild_staff_summaries(connection, tax_year)
@@ -1,4 +1,13 @@
 # database file that creates tables and interacts with the class files when need be for queries etc.
+import time
+from contextlib import contextmanager
+
+from psycopg2.extras import execute_values
+
+import metrics
+import prepared_statements
+import records
+
 CREATE_CPAS = """CREATE TABLE IF NOT EXISTS cpas
 (id SERIAL PRIMARY KEY, name TEXT);"""
 
@@ -17,40 +26,233 @@ CREATE_ASSISTANTS = """CREATE TABLE IF NOT EXISTS tax_filing_assistants
 INSERT_CLIENT_RETURN_ID = """INSERT INTO clients (name, address, income, materials_submitted, cpa_id)
 VALUES (%s, %s, %s, %s, %s) RETURNING id;"""
 
+INSERT_CLIENTS_RETURN_IDS = """INSERT INTO clients (name, address, income, materials_submitted, cpa_id, assistant_id)
+VALUES %s RETURNING id;"""
+
 INSERT_CPA_RETURN_ID = "INSERT INTO cpas (name) VALUES (%s) RETURNING id;"
 
+INSERT_CPAS_RETURN_IDS = "INSERT INTO cpas (name) VALUES %s RETURNING id;"
+
 INSERT_ASSISTANT_RETURN_ID = "INSERT INTO tax_filing_assistants (name) VALUES (%s) RETURNING id;"
 
-INSERT_TAX_RETURN = """INSERT INTO tax_returns (client_id, filed_or_not, checked_by, tax_return_timestamp) 
-VALUES (%s, %s, %s, %s);"""
+INSERT_ASSISTANTS_RETURN_IDS = "INSERT INTO tax_filing_assistants (name) VALUES %s RETURNING id;"
+
+INSERT_TAX_RETURN = """INSERT INTO tax_returns (client_id, tax_year, filed_or_not, checked_by, tax_return_timestamp)
+VALUES (%s, %s, %s, %s, %s);"""
+
+INSERT_TAX_RETURNS = """INSERT INTO tax_returns (client_id, tax_year, filed_or_not, checked_by, tax_return_timestamp)
+VALUES %s;"""
 
 UPDATE_CLIENTS_MATERIALS = "UPDATE clients SET materials_submitted = %s WHERE name = %s;"
 
 UPDATE_TAX_RETURN_STATUS = """UPDATE tax_returns SET filed_or_not = %s, checked_by = %s, tax_return_timestamp = %s 
-WHERE client_id = %s"""
+WHERE client_id = %s AND tax_year = %s"""
+
+UPDATE_CLIENTS_MATERIALS_MANY = """UPDATE clients SET materials_submitted = data.materials_submitted
+FROM (VALUES %s) AS data (client_id, materials_submitted)
+WHERE clients.id = data.client_id AND clients.materials_submitted IS DISTINCT FROM data.materials_submitted
+RETURNING clients.id;"""
+
+UPDATE_CLIENTS_MATERIALS_MANY_BY_NAME = """UPDATE clients SET materials_submitted = data.materials_submitted
+FROM (VALUES %s) AS data (client_name, materials_submitted)
+WHERE LOWER(clients.name) = LOWER(data.client_name)
+AND clients.materials_submitted IS DISTINCT FROM data.materials_submitted
+RETURNING clients.id, clients.name;"""
+
+UPDATE_TAX_RETURN_STATUS_MANY = """UPDATE tax_returns SET filed_or_not = data.filed_or_not, checked_by = data.checked_by,
+tax_return_timestamp = data.tax_return_timestamp
+FROM (VALUES %s) AS data (client_id, tax_year, filed_or_not, checked_by, tax_return_timestamp)
+WHERE tax_returns.client_id = data.client_id AND tax_returns.tax_year = data.tax_year
+AND tax_returns.filed_or_not IS DISTINCT FROM data.filed_or_not
+RETURNING tax_returns.client_id;"""
+
+UPDATE_TAX_RETURN_STATUS_MANY_BY_NAME = """UPDATE tax_returns SET filed_or_not = data.filed_or_not,
+checked_by = data.checked_by, tax_return_timestamp = data.tax_return_timestamp
+FROM clients, (VALUES %s) AS data (client_name, tax_year, filed_or_not, checked_by, tax_return_timestamp)
+WHERE tax_returns.client_id = clients.id AND LOWER(clients.name) = LOWER(data.client_name)
+AND tax_returns.tax_year = data.tax_year
+AND tax_returns.filed_or_not IS DISTINCT FROM data.filed_or_not
+RETURNING tax_returns.client_id, clients.name;"""
+
+# flushes of the write-behind buffer (write_behind.py): like the single-row UPDATE_CLIENTS_MATERIALS and
+# UPDATE_TAX_RETURN_STATUS, every row is written and clients are matched by their exact name
+UPDATE_CLIENTS_MATERIALS_MANY_BY_EXACT_NAME = """UPDATE clients SET materials_submitted = data.materials_submitted
+FROM (VALUES %s) AS data (client_name, materials_submitted)
+WHERE clients.name = data.client_name
+RETURNING clients.id, clients.name;"""
+
+UPDATE_TAX_RETURN_STATUS_MANY_ANY_YEAR = """UPDATE tax_returns SET filed_or_not = data.filed_or_not,
+checked_by = data.checked_by, tax_return_timestamp = data.tax_return_timestamp
+FROM (VALUES %s) AS data (client_id, tax_year, filed_or_not, checked_by, tax_return_timestamp)
+WHERE tax_returns.client_id = data.client_id AND tax_returns.tax_year = data.tax_year
+RETURNING tax_returns.client_id, tax_returns.tax_year;"""
 
 UPDATE_CLIENT_CPA = "UPDATE clients SET cpa_id = %s WHERE id = %s;"
 
 UPDATE_CLIENT_ASSISTANT = "UPDATE clients SET assistant_id = %s WHERE id = %s;"
 
+UPDATE_CLIENT_CPA_MANY = """UPDATE clients SET cpa_id = data.cpa_id
+FROM (VALUES %s) AS data (client_id, cpa_id)
+WHERE clients.id = data.client_id;"""
+
+UPDATE_CLIENT_ASSISTANT_MANY = """UPDATE clients SET assistant_id = data.assistant_id
+FROM (VALUES %s) AS data (client_id, assistant_id)
+WHERE clients.id = data.client_id;"""
+
 SELECT_CLIENT_BY_NAME = "SELECT * FROM clients WHERE LOWER(name) = LOWER(%s);"
 
-SELECT_TAX_RETURN = "SELECT * FROM tax_returns WHERE client_id = %s;"
+SELECT_TAX_RETURN = """SELECT id, client_id, filed_or_not, checked_by, tax_return_timestamp, tax_year FROM tax_returns
+WHERE client_id = %s AND tax_year = %s;"""
+
+# bulk loaders (Client.iter_all / TaxReturn.iter_all), streamed through server-side cursors in id order
+SELECT_ALL_TAX_RETURNS = """SELECT id, client_id, filed_or_not, checked_by, tax_return_timestamp, tax_year
+FROM tax_returns
+WHERE tax_year = %s
+ORDER BY client_id;"""
+
+SELECT_TAX_RETURNS_OF_CLIENT = """SELECT id, client_id, filed_or_not, checked_by, tax_return_timestamp, tax_year
+FROM tax_returns
+WHERE client_id = %s
+ORDER BY tax_year;"""
+
+SELECT_CPA_BY_NAME = "SELECT id, name FROM cpas WHERE LOWER(name) = LOWER(%s);"
 
-SELECT_CPA_BY_NAME = "SELECT * FROM cpas WHERE LOWER(name) = LOWER(%s);"
+SELECT_ASSISTANT_BY_NAME = "SELECT id, name FROM tax_filing_assistants WHERE LOWER(name) = LOWER(%s);"
 
-SELECT_ASSISTANT_BY_NAME = "SELECT * FROM tax_filing_assistants WHERE LOWER(name) = LOWER(%s);"
+# inserts a client with its CPA/assistant (looked up by name) and an empty tax return in one round trip
+ONBOARD_CLIENT = """WITH new_client AS (
+    INSERT INTO clients (name, address, income, materials_submitted, cpa_id, assistant_id)
+    VALUES (%(name)s, %(address)s, %(income)s, FALSE,
+            (SELECT MIN(id) FROM cpas WHERE LOWER(name) = LOWER(%(cpa_name)s)),
+            (SELECT MIN(id) FROM tax_filing_assistants WHERE LOWER(name) = LOWER(%(assistant_name)s)))
+    RETURNING id, cpa_id, assistant_id
+), new_tax_return AS (
+    INSERT INTO tax_returns (client_id, tax_year, filed_or_not)
+    SELECT id, %(tax_year)s::smallint, FALSE FROM new_client RETURNING id
+)
+SELECT new_client.id, new_client.cpa_id, new_client.assistant_id, new_tax_return.id
+FROM new_client, new_tax_return;"""
 
-SELECT_CPA_CLIENT_RELATIONS = """SELECT cpas.name AS cpa_name, clients.name AS client_name
+# the menu flows below need a single round trip each: they look the client up by name in the same statement
+# the tax return columns are prefixed with "tax_return_", see records.row_mapper
+SELECT_CLIENT_WITH_TAX_RETURN = """SELECT clients.id, clients.name, clients.address, clients.income,
+       clients.materials_submitted, cpas.name AS cpa_name,
+       tax_filing_assistants.name AS assistant_name,
+       tax_returns.id AS tax_return_id, tax_returns.client_id AS tax_return_client_id,
+       tax_returns.filed_or_not AS tax_return_filed_or_not, tax_returns.checked_by AS tax_return_checked_by,
+       tax_returns.tax_return_timestamp AS tax_return_tax_return_timestamp,
+       tax_returns.tax_year AS tax_return_tax_year
 FROM clients
-JOIN cpas ON clients.cpa_id = cpas.id;"""
+LEFT JOIN cpas ON clients.cpa_id = cpas.id
+LEFT JOIN tax_filing_assistants ON clients.assistant_id = tax_filing_assistants.id
+LEFT JOIN tax_returns ON tax_returns.client_id = clients.id AND tax_returns.tax_year = %(tax_year)s
+WHERE LOWER(clients.name) = LOWER(%(client_name)s)
+ORDER BY clients.id
+LIMIT 1;"""
+
+INSERT_TAX_RETURN_IF_ABSENT = """WITH client AS (
+    SELECT id FROM clients WHERE LOWER(name) = LOWER(%(client_name)s) ORDER BY id LIMIT 1
+), new_tax_return AS (
+    INSERT INTO tax_returns (client_id, tax_year, filed_or_not)
+    SELECT id, %(tax_year)s::smallint, FALSE FROM client
+    ON CONFLICT (client_id, tax_year) DO NOTHING
+    RETURNING id
+)
+SELECT client.id, new_tax_return.id FROM client LEFT JOIN new_tax_return ON TRUE;"""
+
+UPDATE_TAX_RETURN_STATUS_BY_CLIENT_NAME = """WITH client AS (
+    SELECT id FROM clients WHERE LOWER(name) = LOWER(%(client_name)s) ORDER BY id LIMIT 1
+), updated AS (
+    UPDATE tax_returns SET filed_or_not = %(filed_or_not)s, checked_by = %(checked_by)s,
+    tax_return_timestamp = %(tax_return_timestamp)s
+    FROM client WHERE tax_returns.client_id = client.id AND tax_returns.tax_year = %(tax_year)s
+    RETURNING tax_returns.id
+)
+SELECT client.id, updated.id FROM client LEFT JOIN updated ON TRUE;"""
+
+SELECT_CPA_IDS_BY_NAMES = """SELECT LOWER(name), MIN(id) FROM cpas WHERE LOWER(name) = ANY(%s)
+GROUP BY LOWER(name);"""
+
+SELECT_ASSISTANT_IDS_BY_NAMES = """SELECT LOWER(name), MIN(id) FROM tax_filing_assistants WHERE LOWER(name) = ANY(%s)
+GROUP BY LOWER(name);"""
+
+SELECT_CLIENT_IDS_BY_NAMES = """SELECT LOWER(name), MIN(id) FROM clients WHERE LOWER(name) = ANY(%s)
+GROUP BY LOWER(name);"""
+
+INSERT_TAX_RETURNS_IF_ABSENT = """INSERT INTO tax_returns (client_id, tax_year, filed_or_not)
+SELECT client_id, %s::smallint, FALSE FROM unnest(%s::integer[]) AS client_id
+ON CONFLICT (client_id, tax_year) DO NOTHING
+RETURNING client_id;"""
+
+SELECT_TAX_RETURN_STATUSES = """SELECT client_id, filed_or_not, checked_by, tax_return_timestamp FROM tax_returns
+WHERE client_id = ANY(%s) AND tax_year = %s;"""
+
+# current number of clients and summed income per CPA and per assistant, for the auto-assignment engine
+SELECT_STAFF_WORKLOADS = """SELECT 'cpa' AS role, cpas.id, cpas.name, COUNT(clients.id), COALESCE(SUM(clients.income), 0)
+FROM cpas
+LEFT JOIN clients ON clients.cpa_id = cpas.id
+GROUP BY cpas.id
+UNION ALL
+SELECT 'assistant' AS role, tax_filing_assistants.id, tax_filing_assistants.name,
+COUNT(clients.id), COALESCE(SUM(clients.income), 0)
+FROM tax_filing_assistants
+LEFT JOIN clients ON clients.assistant_id = tax_filing_assistants.id
+GROUP BY tax_filing_assistants.id;"""
 
-SELECT_ASSISTANT_CLIENT_RELATIONS = """SELECT tax_filing_assistants.name AS assistant_name, clients.name AS client_name
+SELECT_UNASSIGNED_CLIENTS = """SELECT id, COALESCE(income, 0), cpa_id IS NULL, assistant_id IS NULL FROM clients
+WHERE cpa_id IS NULL OR assistant_id IS NULL;"""
+
+# only fills empty assignments, so assignments made while a plan was computed are kept
+UPDATE_CLIENT_ASSIGNMENTS = """UPDATE clients
+SET cpa_id = COALESCE(clients.cpa_id, data.cpa_id), assistant_id = COALESCE(clients.assistant_id, data.assistant_id)
+FROM unnest(%s::integer[], %s::integer[], %s::integer[]) AS data (client_id, cpa_id, assistant_id)
+WHERE clients.id = data.client_id
+AND ((clients.cpa_id IS NULL AND data.cpa_id IS NOT NULL)
+     OR (clients.assistant_id IS NULL AND data.assistant_id IS NOT NULL));"""
+
+# the relation listings are sorted in SQL and support keyset pagination: pass the sort key of the last row
+# seen as `after_*` to continue after it. Every filter is optional (NULL means no filter / no limit).
+# Parameters are cast explicitly so the statements also work with server-side parameter binding.
+SELECT_CPA_CLIENT_RELATIONS = """SELECT cpas.name AS cpa_name, clients.name AS client_name, clients.id AS client_id
+FROM clients
+JOIN cpas ON clients.cpa_id = cpas.id
+WHERE (%(staff_name)s::text IS NULL OR LOWER(cpas.name) = LOWER(%(staff_name)s))
+AND (%(after_id)s::integer IS NULL OR (LOWER(cpas.name), LOWER(clients.name), clients.id)
+     > (%(after_staff)s::text, %(after_client)s::text, %(after_id)s::integer))
+ORDER BY LOWER(cpas.name), LOWER(clients.name), clients.id
+LIMIT %(limit)s::integer;"""
+
+SELECT_ASSISTANT_CLIENT_RELATIONS = """SELECT tax_filing_assistants.name AS assistant_name, clients.name AS client_name,
+       clients.id AS client_id
 FROM clients
-JOIN tax_filing_assistants ON clients.assistant_id = tax_filing_assistants.id;"""
+JOIN tax_filing_assistants ON clients.assistant_id = tax_filing_assistants.id
+WHERE (%(staff_name)s::text IS NULL OR LOWER(tax_filing_assistants.name) = LOWER(%(staff_name)s))
+AND (%(after_id)s::integer IS NULL OR (LOWER(tax_filing_assistants.name), LOWER(clients.name), clients.id)
+     > (%(after_staff)s::text, %(after_client)s::text, %(after_id)s::integer))
+ORDER BY LOWER(tax_filing_assistants.name), LOWER(clients.name), clients.id
+LIMIT %(limit)s::integer;"""
 
 SELECT_TAX_RETURN_STATUS = """SELECT filed_or_not, checked_by, tax_return_timestamp FROM tax_returns 
-WHERE client_id = %s;"""
+WHERE client_id = %s AND tax_year = %s;"""
+
+# filing reports over a time window [start, end); they use the index on tax_return_timestamp (migration 11).
+# Periods are cut in the given time zone, e.g. 'US/Eastern', so a "day" is a local calendar day.
+SELECT_RETURNS_FILED_BETWEEN = """SELECT tax_returns.client_id, clients.name, tax_returns.checked_by,
+       tax_returns.tax_return_timestamp
+FROM tax_returns
+JOIN clients ON clients.id = tax_returns.client_id
+WHERE tax_returns.tax_return_timestamp >= %(start)s AND tax_returns.tax_return_timestamp < %(end)s
+ORDER BY tax_returns.tax_return_timestamp, tax_returns.client_id
+LIMIT %(limit)s::integer;"""
+
+SELECT_FILINGS_PER_PERIOD = """SELECT date_trunc(%(period)s, tax_return_timestamp, %(time_zone)s) AS period_start,
+       COUNT(*) AS filed,
+       COUNT(*) FILTER (WHERE checked_by = 'yes') AS filed_by_cpa,
+       COUNT(*) FILTER (WHERE checked_by = 'no') AS filed_by_assistant
+FROM tax_returns
+WHERE tax_return_timestamp >= %(start)s AND tax_return_timestamp < %(end)s
+GROUP BY period_start
+ORDER BY period_start;"""
 
 SELECT_CLIENT_DETAILS = """SELECT clients.id, clients.name, clients.address, clients.income, 
        clients.materials_submitted, cpas.name AS cpa_name, 
@@ -61,6 +263,271 @@ LEFT JOIN tax_filing_assistants ON clients.assistant_id = tax_filing_assistants.
 WHERE LOWER(clients.name) = LOWER(%s);"""
 
 
+SELECT_ALL_CLIENT_DETAILS = """SELECT clients.id, clients.name, clients.address, clients.income,
+       clients.materials_submitted, cpas.name AS cpa_name, tax_filing_assistants.name AS assistant_name
+FROM clients
+LEFT JOIN cpas ON clients.cpa_id = cpas.id
+LEFT JOIN tax_filing_assistants ON clients.assistant_id = tax_filing_assistants.id
+ORDER BY clients.id;"""
+
+# ranked client search. The trigram variant (pg_trgm, GIN indexes from migration 7) matches misspelled names and
+# addresses (`%%`, similarity) and partial words (`<%%`, word similarity); without the extension the prefix
+# variant matches names and addresses starting with the text (prefix indexes from migrations 8 and 9).
+# Both return the SELECT_CLIENT_DETAILS columns plus a score between 0 and 1.
+SEARCH_CLIENTS_TRIGRAM = """SELECT clients.id, clients.name, clients.address, clients.income,
+       clients.materials_submitted, cpas.name AS cpa_name, tax_filing_assistants.name AS assistant_name,
+       GREATEST(similarity(LOWER(clients.name), %(text)s), word_similarity(%(text)s, LOWER(clients.name)),
+                similarity(LOWER(clients.address), %(text)s),
+                word_similarity(%(text)s, LOWER(clients.address))) AS score
+FROM clients
+LEFT JOIN cpas ON clients.cpa_id = cpas.id
+LEFT JOIN tax_filing_assistants ON clients.assistant_id = tax_filing_assistants.id
+WHERE LOWER(clients.name) %% %(text)s OR %(text)s <%% LOWER(clients.name)
+   OR LOWER(clients.address) %% %(text)s OR %(text)s <%% LOWER(clients.address)
+ORDER BY score DESC, clients.id
+LIMIT %(limit)s OFFSET %(offset)s;"""
+
+SEARCH_CLIENTS_PREFIX = """SELECT clients.id, clients.name, clients.address, clients.income,
+       clients.materials_submitted, cpas.name AS cpa_name, tax_filing_assistants.name AS assistant_name,
+       CASE WHEN LOWER(clients.name) = %(text)s THEN 1.0
+            WHEN LOWER(clients.name) LIKE %(prefix)s THEN 0.75
+            ELSE 0.5 END::double precision AS score
+FROM clients
+LEFT JOIN cpas ON clients.cpa_id = cpas.id
+LEFT JOIN tax_filing_assistants ON clients.assistant_id = tax_filing_assistants.id
+WHERE LOWER(clients.name) LIKE %(prefix)s OR LOWER(clients.address) LIKE %(prefix)s
+ORDER BY score DESC, LOWER(clients.name), clients.id
+LIMIT %(limit)s OFFSET %(offset)s;"""
+
+SELECT_TRIGRAM_SEARCH_AVAILABLE = """SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')
+AND to_regclass('clients_name_trgm_idx') IS NOT NULL;"""
+
+# tax_returns is list-partitioned by tax year (migration 12), one `tax_returns_<year>` table per year.
+# The partition DDL is formatted with the year as an integer, since identifiers cannot be parameters.
+# Detached years are moved to the `tax_returns_archive` schema; they keep their table and indexes.
+CREATE_TAX_YEAR_PARTITION = """CREATE TABLE IF NOT EXISTS tax_returns_{year} PARTITION OF tax_returns
+FOR VALUES IN ({year});"""
+
+DETACH_TAX_YEAR_PARTITION = "ALTER TABLE tax_returns DETACH PARTITION tax_returns_{year} CONCURRENTLY;"
+
+FINALIZE_TAX_YEAR_DETACH = "ALTER TABLE tax_returns DETACH PARTITION tax_returns_{year} FINALIZE;"
+
+ARCHIVE_TAX_YEAR_TABLE = """CREATE SCHEMA IF NOT EXISTS tax_returns_archive;
+ALTER TABLE tax_returns_{year} SET SCHEMA tax_returns_archive;"""
+
+UNARCHIVE_TAX_YEAR_TABLE = "ALTER TABLE tax_returns_archive.tax_returns_{year} SET SCHEMA public;"
+
+# a detach CONCURRENTLY leaves a CHECK constraint matching the partition bound, so the attach skips the scan
+ATTACH_TAX_YEAR_TABLE = "ALTER TABLE tax_returns ATTACH PARTITION tax_returns_{year} FOR VALUES IN ({year});"
+
+SELECT_TAX_YEAR_TABLES = """SELECT substring(class.relname FROM '[0-9]+$')::integer AS tax_year,
+       CASE WHEN pg_inherits.inhdetachpending THEN 'detaching'
+            WHEN class.relispartition THEN 'active'
+            WHEN namespace.nspname = 'tax_returns_archive' THEN 'archived'
+            ELSE 'detached' END AS status,
+       GREATEST(class.reltuples, 0)::bigint AS estimated_rows, pg_total_relation_size(class.oid) AS bytes
+FROM pg_class class
+JOIN pg_namespace namespace ON namespace.oid = class.relnamespace
+LEFT JOIN pg_inherits ON pg_inherits.inhrelid = class.oid
+WHERE class.relkind = 'r' AND class.relname ~ '^tax_returns_[0-9]+$'
+AND namespace.nspname IN ('public', 'tax_returns_archive')
+ORDER BY tax_year;"""
+
+# the status of one tax year's table, as in SELECT_TAX_YEAR_TABLES; no row when the year has no table
+SELECT_TAX_YEAR_TABLE_STATUS = """SELECT CASE WHEN pg_inherits.inhdetachpending THEN 'detaching'
+            WHEN class.relispartition THEN 'active'
+            WHEN namespace.nspname = 'tax_returns_archive' THEN 'archived'
+            ELSE 'detached' END AS status
+FROM pg_class class
+JOIN pg_namespace namespace ON namespace.oid = class.relnamespace
+LEFT JOIN pg_inherits ON pg_inherits.inhrelid = class.oid
+WHERE class.relkind = 'r' AND class.relname = 'tax_returns_' || %s::integer
+AND namespace.nspname IN ('public', 'tax_returns_archive')
+ORDER BY class.relispartition DESC
+LIMIT 1;"""
+
+# bulk export of the client roster (exporter.py): the SELECT_CLIENT_DETAILS join plus the filing status of one
+# tax year, streamed with COPY ... TO STDOUT. COPY takes no parameters, so the filters are bound client-side
+# with mogrify first; a filter that is NULL matches every client. The JSONL variant turns off CSV quoting (the
+# quote and delimiter are control characters, which JSON escapes) so every row is written as its JSON text.
+EXPORT_CLIENT_ROWS = """SELECT clients.id, clients.name, clients.address, clients.income,
+       clients.materials_submitted, cpas.name AS cpa_name, tax_filing_assistants.name AS assistant_name,
+       %(tax_year)s::smallint AS tax_year, COALESCE(tax_returns.filed_or_not, FALSE) AS filed,
+       tax_returns.checked_by, tax_returns.tax_return_timestamp AS filed_at
+FROM clients
+LEFT JOIN cpas ON clients.cpa_id = cpas.id
+LEFT JOIN tax_filing_assistants ON clients.assistant_id = tax_filing_assistants.id
+LEFT JOIN tax_returns ON tax_returns.client_id = clients.id AND tax_returns.tax_year = %(tax_year)s::smallint
+WHERE (%(filed)s::boolean IS NULL OR COALESCE(tax_returns.filed_or_not, FALSE) = %(filed)s::boolean)
+AND (%(cpa_name)s::text IS NULL OR LOWER(cpas.name) = LOWER(%(cpa_name)s::text))
+ORDER BY clients.id"""
+
+COPY_EXPORT_CSV = "COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER);"
+
+COPY_EXPORT_JSONL = """COPY (SELECT row_to_json(export) FROM ({query}) export)
+TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02');"""
+
+EXPORT_FORMATS = {"csv": COPY_EXPORT_CSV, "jsonl": COPY_EXPORT_JSONL}
+
+# tax estimates (tax_engine.py): all incomes in one query, and all estimates written back in one statement that
+# unnests parallel arrays, which replaces the earlier estimates of the same clients and tax year
+SELECT_CLIENT_INCOMES = "SELECT id, income FROM clients WHERE income IS NOT NULL ORDER BY id;"
+
+UPSERT_TAX_ESTIMATES = """INSERT INTO tax_estimates
+(client_id, tax_year, filing_status, liability, marginal_rate, effective_rate)
+SELECT estimate.client_id, %(tax_year)s, %(filing_status)s, ROUND(estimate.liability::numeric, 2),
+       ROUND(estimate.marginal_rate::numeric, 4), ROUND(estimate.effective_rate::numeric, 4)
+FROM unnest(%(client_ids)s::integer[], %(liabilities)s::double precision[], %(marginal_rates)s::double precision[],
+            %(effective_rates)s::double precision[]) AS estimate(client_id, liability, marginal_rate, effective_rate)
+ON CONFLICT (client_id, tax_year) DO UPDATE
+SET filing_status = EXCLUDED.filing_status, liability = EXCLUDED.liability, marginal_rate = EXCLUDED.marginal_rate,
+    effective_rate = EXCLUDED.effective_rate, estimated_at = NOW();"""
+
+# dashboard (dashboard.py): reads the summaries kept by the triggers of migration 15, one row per CPA / assistant
+# plus one per role for the unassigned clients (staff_id 0), so the cost depends on the staff, not the clients
+SELECT_STAFF_DASHBOARD = """WITH staff AS (
+    SELECT 'cpa' AS role, id AS staff_id, name FROM cpas
+    UNION ALL SELECT 'assistant', id, name FROM tax_filing_assistants
+    UNION ALL SELECT role, 0, NULL FROM (VALUES ('cpa'), ('assistant')) AS roles(role))
+SELECT staff.role, staff.staff_id, staff.name, COALESCE(clients.clients, 0), COALESCE(clients.materials_submitted, 0),
+       COALESCE(returns.returns, 0), COALESCE(returns.filed, 0), COALESCE(returns.filed_by_cpa, 0),
+       COALESCE(returns.filed_by_assistant, 0)
+FROM staff
+LEFT JOIN staff_client_summary clients ON clients.role = staff.role AND clients.staff_id = staff.staff_id
+LEFT JOIN staff_return_summary returns
+    ON returns.role = staff.role AND returns.staff_id = staff.staff_id AND returns.tax_year = %s
+ORDER BY staff.role, staff.staff_id = 0, LOWER(staff.name), staff.staff_id;"""
+
+REBUILD_STAFF_SUMMARIES = "SELECT rebuild_staff_summaries(%s::smallint);"
+
+# work queue (work_queue.py): unfiled returns of clients whose materials are in, oldest first. A claim locks the
+# next unleased rows with SKIP LOCKED, so concurrent claims pass over each other's rows instead of waiting for them,
+# and leases them for a while; an expired lease makes the return claimable again.
+CLAIM_TAX_RETURNS = """WITH claimable AS (
+    SELECT tax_returns.id FROM tax_returns
+    JOIN clients ON clients.id = tax_returns.client_id
+    WHERE tax_returns.tax_year = %(tax_year)s AND tax_returns.filed_or_not IS NOT TRUE AND clients.materials_submitted
+    AND (tax_returns.lease_expires_at IS NULL OR tax_returns.lease_expires_at < NOW())
+    ORDER BY tax_returns.id
+    LIMIT %(limit)s
+    FOR UPDATE OF tax_returns SKIP LOCKED)
+UPDATE tax_returns
+SET leased_by = %(assistant_id)s, lease_expires_at = NOW() + %(lease_seconds)s * INTERVAL '1 second'
+FROM claimable, clients
+WHERE tax_returns.tax_year = %(tax_year)s AND tax_returns.id = claimable.id AND clients.id = tax_returns.client_id
+RETURNING tax_returns.id, tax_returns.client_id, clients.name, tax_returns.tax_year, tax_returns.lease_expires_at;"""
+
+# completing or releasing only touches returns the assistant still holds, also after the lease expired, unless
+# another assistant has claimed them since
+COMPLETE_TAX_RETURN_LEASES = """UPDATE tax_returns
+SET filed_or_not = TRUE, checked_by = %(checked_by)s, tax_return_timestamp = %(filed_at)s, leased_by = NULL,
+    lease_expires_at = NULL
+WHERE tax_year = %(tax_year)s AND leased_by = %(assistant_id)s AND client_id = ANY(%(client_ids)s)
+RETURNING client_id;"""
+
+RELEASE_TAX_RETURN_LEASES = """UPDATE tax_returns SET leased_by = NULL, lease_expires_at = NULL
+WHERE tax_year = %(tax_year)s AND leased_by = %(assistant_id)s
+AND (%(client_ids)s::integer[] IS NULL OR client_id = ANY(%(client_ids)s::integer[]))
+RETURNING client_id;"""
+
+SELECT_WORK_QUEUE_COUNTS = """SELECT
+    COUNT(*) FILTER (WHERE tax_returns.lease_expires_at IS NULL OR tax_returns.lease_expires_at < NOW()),
+    COUNT(*) FILTER (WHERE tax_returns.lease_expires_at >= NOW())
+FROM tax_returns
+JOIN clients ON clients.id = tax_returns.client_id
+WHERE tax_returns.tax_year = %s AND tax_returns.filed_or_not IS NOT TRUE AND clients.materials_submitted;"""
+
+# fixed single-row statements that are prepared once per pooled connection and then run with EXECUTE.
+# The relation listings are left out: their optional filters only plan well with the actual values.
+PREPARED_STATEMENT_NAMES = {globals()[name]: name.lower() for name in (
+    "INSERT_CLIENT_RETURN_ID", "INSERT_CPA_RETURN_ID", "INSERT_ASSISTANT_RETURN_ID", "INSERT_TAX_RETURN",
+    "UPDATE_CLIENTS_MATERIALS", "UPDATE_TAX_RETURN_STATUS", "UPDATE_CLIENT_CPA", "UPDATE_CLIENT_ASSISTANT",
+    "SELECT_CLIENT_BY_NAME", "SELECT_TAX_RETURN", "SELECT_TAX_RETURNS_OF_CLIENT", "SELECT_CPA_BY_NAME",
+    "SELECT_ASSISTANT_BY_NAME", "SELECT_CPA_IDS_BY_NAMES", "SELECT_ASSISTANT_IDS_BY_NAMES", "SELECT_CLIENT_IDS_BY_NAMES",
+    "SELECT_TAX_RETURN_STATUS", "SELECT_TAX_RETURN_STATUSES", "SELECT_CLIENT_DETAILS",
+    "ONBOARD_CLIENT", "SELECT_CLIENT_WITH_TAX_RETURN", "INSERT_TAX_RETURN_IF_ABSENT",
+    "UPDATE_TAX_RETURN_STATUS_BY_CLIENT_NAME",
+)}
+
+# the constant name of every statement above, used to label the query metrics (see metrics.py)
+STATEMENT_NAMES = {query: name for name, query in list(globals().items())
+                   if name.isupper() and isinstance(query, str)}
+
+
+@contextmanager
+def transaction(connection):
+    """
+    Commits the block on success and rolls it back on error, like `with connection:`.
+    When the connection belongs to a unit of work (see session.py), the session owns the transaction
+    and commits once at its end, so the block just runs inside it.
+    """
+    if getattr(connection, "in_unit_of_work", False):
+        yield connection
+    else:
+        with connection:
+            yield connection
+
+
+def _execute(cursor, query, params=None):
+    """
+    Executes one of the statements above. Statements in `PREPARED_STATEMENT_NAMES` run as server-side
+    prepared statements on connections that support it (see prepared_statements.py).
+    While query metrics are enabled, the execution is timed and recorded under the statement's constant name.
+    """
+    if not metrics.enabled:
+        return _run(cursor, query, params)
+    started = time.perf_counter()
+    failed = True
+    try:
+        _run(cursor, query, params)
+        failed = False
+    finally:
+        metrics.record_query(STATEMENT_NAMES.get(query, "OTHER"), time.perf_counter() - started, cursor.rowcount,
+                             failed)
+
+
+def _run(cursor, query, params):
+    statement_name = PREPARED_STATEMENT_NAMES.get(query)
+    if (statement_name and prepared_statements.enabled and cursor.name is None
+            and hasattr(cursor.connection, "prepared_statements")):
+        prepared_statements.execute(cursor, statement_name, query, params)
+    else:
+        cursor.execute(query, params)
+
+
+def _execute_values(cursor, query, rows, **kwargs):
+    """
+    `execute_values` for the multi-row statements above, recorded in the query metrics like `_execute`.
+    """
+    if not metrics.enabled:
+        return execute_values(cursor, query, rows, **kwargs)
+    started = time.perf_counter()
+    failed = True
+    try:
+        result = execute_values(cursor, query, rows, **kwargs)
+        failed = False
+        return result
+    finally:
+        metrics.record_query(STATEMENT_NAMES.get(query, "OTHER"), time.perf_counter() - started, cursor.rowcount,
+                             failed)
+
+
+def _copy_expert(cursor, statement, query, file, size):
+    """
+    `copy_expert` for the COPY templates above, recorded in the query metrics under the template's name.
+    """
+    if not metrics.enabled:
+        return cursor.copy_expert(statement.format(query=query), file, size)
+    started = time.perf_counter()
+    failed = True
+    try:
+        cursor.copy_expert(statement.format(query=query), file, size)
+        failed = False
+    finally:
+        metrics.record_query(STATEMENT_NAMES.get(statement, "OTHER"), time.perf_counter() - started,
+                             cursor.rowcount, failed)
+
+
 def create_tables(connection):
     """
     Creates the necessary database tables if they do not already exist.
@@ -70,7 +537,7 @@ def create_tables(connection):
     Args:
         connection (psycopg2.connection): The database connection object.
     """
-    with connection:
+    with transaction(connection):
         with connection.cursor() as cursor:
             cursor.execute(CREATE_CPAS)
             cursor.execute(CREATE_ASSISTANTS)
@@ -84,120 +551,948 @@ def add_client(connection, client_name, address, income, materials_submitted=Fal
     Returns:
         int: The ID of the newly created client.
     """
-    with connection:
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(INSERT_CLIENT_RETURN_ID, (client_name, address, income, materials_submitted, cpa_id))
+            _execute(cursor, INSERT_CLIENT_RETURN_ID, (client_name, address, income, materials_submitted, cpa_id))
             client_id = cursor.fetchone()[0]
             return client_id
 
 
+def add_clients(connection, clients, create_tax_returns=False, tax_year=None):
+    """
+    Inserts a batch of clients with a single multi-row INSERT and returns the generated IDs.
+    The clients (and, optionally, an unfiled tax return for each of them) are written in one transaction.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        clients (list of tuple): Rows of (name, address, income, materials_submitted, cpa_id, assistant_id).
+        create_tax_returns (bool): Whether to also create an empty tax return for every new client.
+        tax_year (int): The tax year of those tax returns; required with `create_tax_returns`.
+    Returns:
+        list of int: The IDs of the new clients, in the same order as `clients`.
+    """
+    if not clients:
+        return []
+    if create_tax_returns:
+        ensure_tax_year_partition(connection, tax_year)
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            rows = _execute_values(cursor, INSERT_CLIENTS_RETURN_IDS, clients, page_size=len(clients), fetch=True)
+            client_ids = [row[0] for row in rows]
+            if create_tax_returns:
+                _execute_values(
+                    cursor, INSERT_TAX_RETURNS, [(client_id, tax_year, False, None, None) for client_id in client_ids],
+                    page_size=len(client_ids)
+                )
+            return client_ids
+
+
+def onboard_client(connection, client_name, address, income, tax_year, cpa_name=None, assistant_name=None):
+    """
+    Inserts a client assigned to the given CPA and assistant, together with an empty tax return for `tax_year`,
+    in a single statement.
+
+    Raises:
+        ValueError: If a CPA or assistant name was given but no such CPA/assistant exists. Nothing is inserted.
+    Returns:
+        tuple: (client_id, cpa_id, assistant_id, tax_return_id).
+    """
+    ensure_tax_year_partition(connection, tax_year)
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, ONBOARD_CLIENT, {"name": client_name, "address": address, "income": income,
+                                              "tax_year": tax_year, "cpa_name": cpa_name,
+                                              "assistant_name": assistant_name})
+            onboarded = cursor.fetchone()
+            if cpa_name and onboarded[1] is None:
+                raise ValueError(f"There is no CPA named '{cpa_name}'.")
+            if assistant_name and onboarded[2] is None:
+                raise ValueError(f"There is no assistant named '{assistant_name}'.")
+            return onboarded
+
+
 def add_cpa(connection, cpa_name):
-    with connection:
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(INSERT_CPA_RETURN_ID, (cpa_name, ))
+            _execute(cursor, INSERT_CPA_RETURN_ID, (cpa_name, ))
             cpa_id = cursor.fetchone()[0]
             return cpa_id
 
 
+def add_cpas(connection, cpa_names):
+    """
+    Inserts several CPAs with a single multi-row INSERT.
+    Returns:
+        list of int: The IDs of the new CPAs, in the same order as `cpa_names`.
+    """
+    if not cpa_names:
+        return []
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            rows = _execute_values(cursor, INSERT_CPAS_RETURN_IDS, [(name, ) for name in cpa_names],
+                                   page_size=len(cpa_names), fetch=True)
+            return [row[0] for row in rows]
+
+
 def add_tax_filing_assistant(connection, assistant_name):
-    with connection:
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(INSERT_ASSISTANT_RETURN_ID, (assistant_name, ))
+            _execute(cursor, INSERT_ASSISTANT_RETURN_ID, (assistant_name, ))
             assistant_id = cursor.fetchone()[0]
             return assistant_id
 
 
-def add_tax_return(connection, client_id):
-    with connection:
+def add_tax_filing_assistants(connection, assistant_names):
+    """
+    Inserts several tax filing assistants with a single multi-row INSERT.
+    Returns:
+        list of int: The IDs of the new assistants, in the same order as `assistant_names`.
+    """
+    if not assistant_names:
+        return []
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            rows = _execute_values(cursor, INSERT_ASSISTANTS_RETURN_IDS, [(name, ) for name in assistant_names],
+                                   page_size=len(assistant_names), fetch=True)
+            return [row[0] for row in rows]
+
+
+def add_tax_return(connection, client_id, tax_year):
+    ensure_tax_year_partition(connection, tax_year)
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, INSERT_TAX_RETURN, (client_id, tax_year, False, None, None))
+
+
+def add_tax_return_if_absent(connection, client_name, tax_year):
+    """
+    Creates an empty tax return for the client with the given name unless it already has one for `tax_year`.
+    The check and the insert are a single atomic statement, so concurrent calls cannot create duplicates.
+    Returns:
+        tuple or None: (client_id, tax_return_id), where tax_return_id is None if the client already had a
+        tax return; None if there is no such client.
+    """
+    ensure_tax_year_partition(connection, tax_year)
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, INSERT_TAX_RETURN_IF_ABSENT, {"client_name": client_name, "tax_year": tax_year})
+            return cursor.fetchone()
+
+
+def add_tax_returns_if_absent(connection, client_ids, tax_year):
+    """
+    Creates an empty tax return for `tax_year` for each of the given clients that does not have one yet,
+    in one statement.
+    Returns:
+        set of int: The IDs of the clients that got a new tax return.
+    """
+    if not client_ids:
+        return set()
+    ensure_tax_year_partition(connection, tax_year)
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(INSERT_TAX_RETURN, (client_id, False, None, None))
+            _execute(cursor, INSERT_TAX_RETURNS_IF_ABSENT, (tax_year, list(client_ids)))
+            return {row[0] for row in cursor.fetchall()}
 
 
 def change_materials_status(connection, client_name, materials_submitted):
-    with connection:
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(UPDATE_CLIENTS_MATERIALS, (materials_submitted, client_name))
+            _execute(cursor, UPDATE_CLIENTS_MATERIALS, (materials_submitted, client_name))
 
 
-def change_tax_return_status(connection, client_id, filed_or_not, checked_by, tax_return_timestamp):
+def change_tax_return_status(connection, client_id, tax_year, filed_or_not, checked_by, tax_return_timestamp):
     """
     Updates the status of a client's tax return in the database.
 
     Args:
         connection (psycopg2.connection): The database connection object.
         client_id (int): The ID of the client whose tax return is being updated.
+        tax_year (int): The tax year of the return.
         filed_or_not (bool): Whether the tax return has been filed.
         checked_by (str): Indicates whether the return was checked by a "CPA" or "Assistant".
-        tax_return_timestamp (float): The timestamp of when the tax return was filed.
+        tax_return_timestamp (datetime.datetime): When the tax return was filed (timezone-aware).
     """
-    with connection:
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(UPDATE_TAX_RETURN_STATUS, (filed_or_not, checked_by, tax_return_timestamp, client_id))
+            _execute(cursor, UPDATE_TAX_RETURN_STATUS,
+                     (filed_or_not, checked_by, tax_return_timestamp, client_id, tax_year))
 
 
-def get_cpa_by_name(connection, cpa_name):
-    with connection:
+def change_tax_return_status_by_client_name(connection, client_name, tax_year, filed_or_not, checked_by,
+                                            tax_return_timestamp):
+    """
+    Updates the status of a client's tax return, looking the client up by name in the same statement.
+    Returns:
+        tuple or None: (client_id, tax_return_id), where tax_return_id is None if the client has no tax return
+        for `tax_year`; None if there is no such client.
+    """
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(SELECT_CPA_BY_NAME, (cpa_name, ))
+            _execute(cursor, UPDATE_TAX_RETURN_STATUS_BY_CLIENT_NAME, {
+                "client_name": client_name, "tax_year": tax_year, "filed_or_not": filed_or_not,
+                "checked_by": checked_by, "tax_return_timestamp": tax_return_timestamp,
+            })
             return cursor.fetchone()
 
 
-def get_tax_filing_assistant_by_name(connection, assistant_name):
-    with connection:
+def change_materials_status_many(connection, rows):
+    """
+    Updates the materials status of many clients with a single statement.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        rows (list of tuple): Rows of (client_id, materials_submitted).
+    Returns:
+        list of int: The IDs of the clients whose status actually changed.
+    """
+    if not rows:
+        return []
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(SELECT_ASSISTANT_BY_NAME, (assistant_name, ))
-            return cursor.fetchone()
+            changed = _execute_values(cursor, UPDATE_CLIENTS_MATERIALS_MANY, rows,
+                                      template="(%s::integer, %s::boolean)", page_size=len(rows), fetch=True)
+            return [row[0] for row in changed]
 
 
-def get_tax_return(connection, client_id):
-    with connection:
+def change_materials_status_many_by_name(connection, rows):
+    """
+    Same as `change_materials_status_many`, but matches clients by case-insensitive name.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        rows (list of tuple): Rows of (client_name, materials_submitted).
+    Returns:
+        list of tuple: (client_id, client_name) of the clients whose status actually changed.
+    """
+    if not rows:
+        return []
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(SELECT_TAX_RETURN, (client_id, ))
-            return cursor.fetchone()
+            return _execute_values(cursor, UPDATE_CLIENTS_MATERIALS_MANY_BY_NAME, rows,
+                                   template="(%s::text, %s::boolean)", page_size=len(rows), fetch=True)
 
 
-def get_cpa_client_relations(connection):
-    with connection:
+def change_tax_return_status_many(connection, rows, tax_year):
+    """
+    Updates the status of many tax returns of one tax year with a single statement.
+    Returns that already have the requested `filed_or_not` value are left untouched.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        rows (list of tuple): Rows of (client_id, filed_or_not, checked_by, tax_return_timestamp).
+        tax_year (int): The tax year of the returns.
+    Returns:
+        list of int: The IDs of the clients whose tax return actually changed.
+    """
+    if not rows:
+        return []
+    rows = [(row[0], tax_year) + tuple(row[1:]) for row in rows]
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(SELECT_CPA_CLIENT_RELATIONS)
+            changed = _execute_values(cursor, UPDATE_TAX_RETURN_STATUS_MANY, rows,
+                                      template="(%s::integer, %s::smallint, %s::boolean, %s::text, %s::timestamptz)",
+                                      page_size=len(rows), fetch=True)
+            return [row[0] for row in changed]
+
+
+def change_tax_return_status_many_by_name(connection, rows, tax_year):
+    """
+    Same as `change_tax_return_status_many`, but matches clients by case-insensitive name.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        rows (list of tuple): Rows of (client_name, filed_or_not, checked_by, tax_return_timestamp).
+        tax_year (int): The tax year of the returns.
+    Returns:
+        list of tuple: (client_id, client_name) of the clients whose tax return actually changed.
+    """
+    if not rows:
+        return []
+    rows = [(row[0], tax_year) + tuple(row[1:]) for row in rows]
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            return _execute_values(cursor, UPDATE_TAX_RETURN_STATUS_MANY_BY_NAME, rows,
+                                   template="(%s::text, %s::smallint, %s::boolean, %s::text, %s::timestamptz)",
+                                   page_size=len(rows), fetch=True)
+
+
+def set_materials_status_many(connection, rows):
+    """
+    Writes the materials status of many clients with a single statement, as `change_materials_status` does for one:
+    clients are matched by exact name and written even if their status does not change.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        rows (list of tuple): Rows of (client_name, materials_submitted).
+    Returns:
+        list of tuple: (client_id, client_name) of the clients that were written.
+    """
+    if not rows:
+        return []
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            return _execute_values(cursor, UPDATE_CLIENTS_MATERIALS_MANY_BY_EXACT_NAME, rows,
+                                   template="(%s::text, %s::boolean)", page_size=len(rows), fetch=True)
+
+
+def set_tax_return_status_many(connection, rows):
+    """
+    Writes the status of many tax returns of any tax years with a single statement, as `change_tax_return_status`
+    does for one: returns are written even if they already have the requested `filed_or_not` value.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        rows (list of tuple): Rows of (client_id, tax_year, filed_or_not, checked_by, tax_return_timestamp).
+    Returns:
+        list of tuple: (client_id, tax_year) of the tax returns that were written.
+    """
+    if not rows:
+        return []
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            return _execute_values(cursor, UPDATE_TAX_RETURN_STATUS_MANY_ANY_YEAR, rows,
+                                   template="(%s::integer, %s::smallint, %s::boolean, %s::text, %s::timestamptz)",
+                                   page_size=len(rows), fetch=True)
+
+
+def get_cpa_by_name(connection, cpa_name, row_factory=None):
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_CPA_BY_NAME, (cpa_name, ))
+            return _fetchone(cursor, row_factory)
+
+
+def get_tax_filing_assistant_by_name(connection, assistant_name, row_factory=None):
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_ASSISTANT_BY_NAME, (assistant_name, ))
+            return _fetchone(cursor, row_factory)
+
+
+def get_cpa_ids_by_names(connection, cpa_names):
+    """
+    Looks up the IDs of several CPAs at once.
+    Returns:
+        dict: Maps each lower-cased CPA name that exists to its ID.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_CPA_IDS_BY_NAMES, ([name.lower() for name in cpa_names], ))
+            return dict(cursor.fetchall())
+
+
+def get_tax_filing_assistant_ids_by_names(connection, assistant_names):
+    """
+    Looks up the IDs of several tax filing assistants at once.
+    Returns:
+        dict: Maps each lower-cased assistant name that exists to its ID.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_ASSISTANT_IDS_BY_NAMES, ([name.lower() for name in assistant_names], ))
+            return dict(cursor.fetchall())
+
+
+def get_client_ids_by_names(connection, client_names):
+    """
+    Looks up the IDs of several clients at once. Like the single-client lookups, a name that several clients
+    share resolves to the oldest of them.
+    Returns:
+        dict: Maps each lower-cased client name that exists to its ID.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_CLIENT_IDS_BY_NAMES, ([name.lower() for name in client_names], ))
+            return dict(cursor.fetchall())
+
+
+def get_tax_return(connection, client_id, tax_year, row_factory=None):
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_TAX_RETURN, (client_id, tax_year))
+            return _fetchone(cursor, row_factory)
+
+
+def get_tax_returns_of_client(connection, client_id, row_factory=None):
+    """
+    Returns:
+        list of tuple: The SELECT_TAX_RETURN rows of every tax year of the client (archived years excluded),
+        oldest first, mapped by `row_factory` when given.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_TAX_RETURNS_OF_CLIENT, (client_id, ))
+            return _fetchall(cursor, row_factory)
+
+
+def _tax_year_statement(query, tax_year):
+    return query.format(year=int(tax_year))
+
+
+def ensure_tax_year_partition(connection, tax_year):
+    """
+    Creates the partition of tax_returns for `tax_year` unless the year already has a table. Every function that
+    inserts tax returns calls this first, so a new season needs no setup. The status of the year is looked up on
+    every call rather than remembered per process, since another process may archive the year at any time.
+
+    Raises:
+        ValueError: If `tax_year` is None, or if the year's table is detached or archived (e.g. after an
+            interrupted `tax-years archive`), since its tax returns would have no partition to go to.
+    """
+    if tax_year is None:
+        raise ValueError("A tax year is required to create tax returns.")
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_TAX_YEAR_TABLE_STATUS, (int(tax_year), ))
+            row = cursor.fetchone()
+            if row is None:
+                _execute(cursor, _tax_year_statement(CREATE_TAX_YEAR_PARTITION, tax_year))
+    check_tax_year_status(tax_year, row[0] if row else "active")
+
+
+def check_tax_year_status(tax_year, status):
+    """
+    Raises:
+        ValueError: Unless `status` (see `get_tax_year_tables`) lets tax returns of `tax_year` be inserted.
+    """
+    if status == "detaching":
+        raise ValueError(f"The {tax_year} tax returns are being detached; finish archiving them with "
+                         f"`python main.py tax-years archive {tax_year}` before adding any.")
+    if status != "active":
+        raise ValueError(f"The {tax_year} tax returns are {status}; restore them with "
+                         f"`python main.py tax-years restore {tax_year}` before adding any.")
+
+
+def get_tax_year_tables(connection):
+    """
+    Returns:
+        list of tuple: (tax_year, status, estimated_rows, bytes) of every tax year table, where status is
+        "active", "detaching", "detached" or "archived".
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_TAX_YEAR_TABLES)
             return cursor.fetchall()
 
 
-def get_assistant_client_relations(connection):
-    with connection:
+def detach_tax_year_partition(connection, tax_year, finalize=False):
+    """
+    Detaches a tax year from tax_returns without blocking queries on the other partitions.
+    DETACH ... CONCURRENTLY cannot run inside a transaction block, so it runs in autocommit mode;
+    `finalize` completes a concurrent detach that was interrupted.
+    """
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            query = FINALIZE_TAX_YEAR_DETACH if finalize else DETACH_TAX_YEAR_PARTITION
+            _execute(cursor, _tax_year_statement(query, tax_year))
+    finally:
+        connection.autocommit = False
+
+
+def archive_tax_year_table(connection, tax_year):
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, _tax_year_statement(ARCHIVE_TAX_YEAR_TABLE, tax_year))
+
+
+def attach_tax_year_table(connection, tax_year, from_archive=True):
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(SELECT_ASSISTANT_CLIENT_RELATIONS)
+            if from_archive:
+                _execute(cursor, _tax_year_statement(UNARCHIVE_TAX_YEAR_TABLE, tax_year))
+            _execute(cursor, _tax_year_statement(ATTACH_TAX_YEAR_TABLE, tax_year))
+
+
+def relation_page_key(relation):
+    """
+    Returns the keyset pagination key of a relation row, to be passed as `after` to continue after that row.
+    """
+    return relation[0].lower(), relation[1].lower(), relation[2]
+
+
+def relation_params(staff_name, after, limit):
+    after_staff, after_client, after_id = after or (None, None, None)
+    return {"staff_name": staff_name, "after_staff": after_staff, "after_client": after_client,
+            "after_id": after_id, "limit": limit}
+
+
+def _fetchone(cursor, row_factory=None):
+    # the cursor's next row, mapped by `row_factory(column_names)` when given (see records.py)
+    row = cursor.fetchone()
+    if row is None or row_factory is None:
+        return row
+    return row_factory(records.column_names(cursor))(row)
+
+
+def _fetchall(cursor, row_factory=None):
+    # the cursor's rows, mapped by `row_factory(column_names)` when given; the factory is called once per query
+    rows = cursor.fetchall()
+    if row_factory is None:
+        return rows
+    build = row_factory(records.column_names(cursor))
+    return [build(row) for row in rows]
+
+
+def _fetch_batches(cursor, query, params, fetch_size):
+    """
+    Executes a statement on a named (server-side) cursor and yields its rows, `fetch_size` at a time.
+    While query metrics are enabled, the statement is recorded once the stream ends (or is closed early), with the
+    time spent declaring the cursor and fetching, but not in the caller between batches, and the rows fetched.
+    """
+    if not metrics.enabled:
+        _run(cursor, query, params)
+        while rows := cursor.fetchmany(fetch_size):
+            yield rows
+        return
+    seconds, fetched, failed = 0.0, 0, True
+    try:
+        started = time.perf_counter()
+        _run(cursor, query, params)
+        rows = cursor.fetchmany(fetch_size)
+        seconds += time.perf_counter() - started
+        while rows:
+            fetched += len(rows)
+            yield rows
+            started = time.perf_counter()
+            rows = cursor.fetchmany(fetch_size)
+            seconds += time.perf_counter() - started
+        failed = False
+    except GeneratorExit:
+        failed = False  # the caller stopped early
+        raise
+    finally:
+        metrics.record_query(STATEMENT_NAMES.get(query, "OTHER"), seconds, fetched, failed)
+
+
+def _stream(connection, cursor_name, query, params, fetch_size):
+    with transaction(connection):
+        with connection.cursor(name=cursor_name) as cursor:
+            for rows in _fetch_batches(cursor, query, params, fetch_size):
+                yield from rows
+
+
+def _stream_records(connection, cursor_name, query, params, fetch_size, row_factory):
+    """
+    Like `_stream`, but maps the rows with `row_factory(column_names)`, which is called once per query
+    (see records.py). Without a row factory, plain tuples are yielded.
+    """
+    with transaction(connection):
+        with connection.cursor(name=cursor_name) as cursor:
+            build = None
+            for rows in _fetch_batches(cursor, query, params, fetch_size):
+                if build is None and row_factory:
+                    build = row_factory(records.column_names(cursor))
+                yield from map(build, rows) if build else rows
+
+
+def iter_client_details(connection, row_factory=None, fetch_size=2000):
+    """
+    Streams every client with its CPA and assistant names, in id order, `fetch_size` rows per round trip.
+    Yields:
+        The `SELECT_CLIENT_DETAILS` columns of one client, mapped by `row_factory` when given.
+    """
+    yield from _stream_records(connection, "all_client_details", SELECT_ALL_CLIENT_DETAILS, None, fetch_size,
+                               row_factory)
+
+
+def iter_tax_returns(connection, tax_year, row_factory=None, fetch_size=2000):
+    """
+    Streams the tax returns of a tax year, in client id order, `fetch_size` rows per round trip.
+    Yields:
+        The `SELECT_TAX_RETURN` columns of one tax return, mapped by `row_factory` when given.
+    """
+    yield from _stream_records(connection, "all_tax_returns", SELECT_ALL_TAX_RETURNS, (tax_year, ), fetch_size,
+                               row_factory)
+
+
+def get_cpa_client_relations(connection, cpa_name=None, after=None, limit=None):
+    """
+    Retrieves CPA-client relations sorted by CPA name, then client name.
+    Returns:
+        list of tuple: (cpa_name, client_name, client_id) rows.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_CPA_CLIENT_RELATIONS, relation_params(cpa_name, after, limit))
+            return cursor.fetchall()
+
+
+def iter_cpa_client_relations(connection, cpa_name=None, after=None, limit=None, fetch_size=2000):
+    """
+    Streams CPA-client relations through a server-side cursor, `fetch_size` rows per round trip,
+    so only one chunk is held in memory. The connection is busy until the generator is exhausted or closed.
+    Yields:
+        tuple: (cpa_name, client_name, client_id) rows sorted by CPA name, then client name.
+    """
+    yield from _stream(connection, "cpa_client_relations", SELECT_CPA_CLIENT_RELATIONS,
+                       relation_params(cpa_name, after, limit), fetch_size)
+
+
+def get_assistant_client_relations(connection, assistant_name=None, after=None, limit=None):
+    """
+    Retrieves assistant-client relations sorted by assistant name, then client name.
+    Returns:
+        list of tuple: (assistant_name, client_name, client_id) rows.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_ASSISTANT_CLIENT_RELATIONS, relation_params(assistant_name, after, limit))
+            return cursor.fetchall()
+
+
+def iter_assistant_client_relations(connection, assistant_name=None, after=None, limit=None, fetch_size=2000):
+    """
+    Same as `iter_cpa_client_relations`, for tax filing assistants.
+    Yields:
+        tuple: (assistant_name, client_name, client_id) rows sorted by assistant name, then client name.
+    """
+    yield from _stream(connection, "assistant_client_relations", SELECT_ASSISTANT_CLIENT_RELATIONS,
+                       relation_params(assistant_name, after, limit), fetch_size)
+
+
+def get_staff_workloads(connection):
+    """
+    Returns:
+        list of tuple: (role, staff_id, name, client_count, summed_income) for every CPA ('cpa')
+        and assistant ('assistant').
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_STAFF_WORKLOADS)
+            return cursor.fetchall()
+
+
+def get_unassigned_clients(connection):
+    """
+    Returns:
+        list of tuple: (client_id, income, needs_cpa, needs_assistant) for every client without a CPA or an assistant.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_UNASSIGNED_CLIENTS)
             return cursor.fetchall()
 
 
-def get_client_details(connection, client_name):
+def assign_staff_to_clients(connection, assignments):
+    """
+    Writes many CPA/assistant assignments with a single statement. Clients that were assigned in the
+    meantime keep their existing CPA/assistant.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        assignments (list of tuple): Rows of (client_id, cpa_id, assistant_id); None leaves that role unassigned.
+    Returns:
+        int: The number of clients that were updated.
+    """
+    if not assignments:
+        return 0
+    client_ids, cpa_ids, assistant_ids = (list(column) for column in zip(*assignments))
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, UPDATE_CLIENT_ASSIGNMENTS, (client_ids, cpa_ids, assistant_ids))
+            return cursor.rowcount
+
+
+def get_client_details(connection, client_name, row_factory=None):
     """
     Retrieves detailed information about a client from the database.
     Returns:
         tuple: A tuple containing client details (ID, name, address, income, materials_submitted, CPA name, assistant name),
-               or None if the client does not exist.
+               mapped by `row_factory` when given, or None if the client does not exist.
     """
-    with connection:
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(SELECT_CLIENT_DETAILS, (client_name, ))
-            return cursor.fetchone()
+            _execute(cursor, SELECT_CLIENT_DETAILS, (client_name, ))
+            return _fetchone(cursor, row_factory)
+
+
+def export_client_rows(connection, file, file_format, tax_year, filed=None, cpa_name=None, chunk_size=65536):
+    """
+    Streams the client roster with the filing status of `tax_year` into `file` with COPY ... TO STDOUT.
+    The rows are written as they arrive, `chunk_size` bytes at a time, so memory use does not grow with the roster.
+
+    Args:
+        file: A binary file object to write to (e.g. from `open(path, "wb")` or `gzip.open`).
+        file_format (str): One of `EXPORT_FORMATS`: "csv" (with a header row) or "jsonl" (one object per line).
+        tax_year (int): The tax year of the exported filing status.
+        filed (bool): Only export clients whose return is filed (True) or not filed (False). None exports all.
+        cpa_name (str): Only export the clients of this CPA.
+    Returns:
+        int: The number of exported clients.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            query = cursor.mogrify(EXPORT_CLIENT_ROWS, {"tax_year": tax_year, "filed": filed,
+                                                        "cpa_name": cpa_name}).decode()
+            _copy_expert(cursor, EXPORT_FORMATS[file_format], query, file, chunk_size)
+            return cursor.rowcount
+
+
+def get_client_with_tax_return(connection, client_name, tax_year, row_factory=None):
+    """
+    Retrieves a client's details together with its tax return for `tax_year` in one query.
+    Returns:
+        tuple: The `get_client_details` columns followed by the SELECT_TAX_RETURN columns prefixed with "tax_return_"
+               (all None if the client has no tax return), mapped by `row_factory` when given, or None if the client
+               does not exist.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_CLIENT_WITH_TAX_RETURN, {"client_name": client_name, "tax_year": tax_year})
+            return _fetchone(cursor, row_factory)
 
 
-def check_tax_return_status(connection, client_id):
-    with connection:
+_trigram_search_available = {}
+
+
+def trigram_search_available(connection):
+    """
+    Returns:
+        bool: Whether pg_trgm and the trigram indexes of migration 7 are installed. The answer is kept per
+        database, so only the first search of a process asks the server.
+    """
+    available = _trigram_search_available.get(connection.dsn)
+    if available is None:
+        with transaction(connection):
+            with connection.cursor() as cursor:
+                _execute(cursor, SELECT_TRIGRAM_SEARCH_AVAILABLE)
+                available = _trigram_search_available[connection.dsn] = cursor.fetchone()[0]
+    return available
+
+
+def _like_prefix(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def search_clients(connection, text, limit=20, offset=0, row_factory=None):
+    """
+    Finds clients whose name or address resembles `text`: fuzzy (typos, partial words) when pg_trgm is available,
+    otherwise by case-insensitive prefix.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        text (str): The (partial or misspelled) name or address to look for.
+        limit (int): The maximum number of results.
+        offset (int): The number of best results to skip, for the following pages.
+    Returns:
+        list of tuple: SELECT_CLIENT_DETAILS rows followed by a `score` between 0 and 1, best match first, mapped by
+        `row_factory` when given.
+    """
+    text = text.strip().lower()
+    query = SEARCH_CLIENTS_TRIGRAM if trigram_search_available(connection) else SEARCH_CLIENTS_PREFIX
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, query, {"text": text, "prefix": _like_prefix(text), "limit": limit, "offset": offset})
+            return _fetchall(cursor, row_factory)
+
+
+REPORT_PERIODS = ("hour", "day", "week", "month")
+
+
+def get_returns_filed_between(connection, start, end, limit=None):
+    """
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        start (datetime.datetime): Start of the window (inclusive, timezone-aware).
+        end (datetime.datetime): End of the window (exclusive, timezone-aware).
+        limit (int): Optional maximum number of returns.
+    Returns:
+        list of tuple: (client_id, client_name, checked_by, tax_return_timestamp), in filing order.
+    """
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(SELECT_TAX_RETURN_STATUS, (client_id, ))
+            _execute(cursor, SELECT_RETURNS_FILED_BETWEEN, {"start": start, "end": end, "limit": limit})
+            return cursor.fetchall()
+
+
+def count_filings_per_period(connection, start, end, period="day", time_zone="UTC"):
+    """
+    Counts the returns filed in [start, end) per hour, day, week or month of the given time zone.
+    Periods without filings are left out.
+
+    Raises:
+        ValueError: If `period` is not one of `REPORT_PERIODS`.
+    Returns:
+        list of tuple: (period_start, filed, filed_by_cpa, filed_by_assistant), oldest period first.
+    """
+    if period not in REPORT_PERIODS:
+        raise ValueError(f"Unknown report period '{period}'. Use one of: {', '.join(REPORT_PERIODS)}.")
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_FILINGS_PER_PERIOD,
+                     {"start": start, "end": end, "period": period, "time_zone": time_zone})
+            return cursor.fetchall()
+
+
+def check_tax_return_status(connection, client_id, tax_year):
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_TAX_RETURN_STATUS, (client_id, tax_year))
             return cursor.fetchone()
 
 
+def check_tax_return_statuses(connection, client_ids, tax_year):
+    """
+    Returns:
+        dict: Maps the ID of each given client that has a tax return for `tax_year` to its
+        (filed_or_not, checked_by, tax_return_timestamp) row.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_TAX_RETURN_STATUSES, (list(client_ids), tax_year))
+            return {row[0]: row[1:] for row in cursor.fetchall()}
+
+
 def assign_cpa_to_client(connection, client_id, cpa_id):
-    with connection:
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(UPDATE_CLIENT_CPA, (cpa_id, client_id))
+            _execute(cursor, UPDATE_CLIENT_CPA, (cpa_id, client_id))
 
 
 def assign_assistant_to_client(connection, client_id, assistant_id):
-    with connection:
+    with transaction(connection):
         with connection.cursor() as cursor:
-            cursor.execute(UPDATE_CLIENT_ASSISTANT, (assistant_id, client_id))
+            _execute(cursor, UPDATE_CLIENT_ASSISTANT, (assistant_id, client_id))
+
+
+def assign_cpas_to_clients(connection, rows):
+    """
+    Assigns CPAs to many clients with a single statement.
 
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        rows (list of tuple): Rows of (client_id, cpa_id), at most one per client.
+    """
+    if not rows:
+        return
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute_values(cursor, UPDATE_CLIENT_CPA_MANY, rows, template="(%s::integer, %s::integer)",
+                            page_size=len(rows))
+
+
+def assign_assistants_to_clients(connection, rows):
+    """
+    Assigns assistants to many clients with a single statement.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        rows (list of tuple): Rows of (client_id, assistant_id), at most one per client.
+    """
+    if not rows:
+        return
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute_values(cursor, UPDATE_CLIENT_ASSISTANT_MANY, rows, template="(%s::integer, %s::integer)",
+                            page_size=len(rows))
+
+
+def get_client_incomes(connection):
+    """
+    Returns:
+        tuple: (list of client ids, list of their incomes), in id order, for every client with an income.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_CLIENT_INCOMES)
+            rows = cursor.fetchall()
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+
+def save_tax_estimates(connection, tax_year, filing_status, client_ids, liabilities, marginal_rates,
+                       effective_rates):
+    """
+    Stores the estimated liabilities of many clients for a tax year in one statement and one transaction.
+    The estimate lists run parallel to `client_ids`.
+    Returns:
+        int: The number of stored estimates.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, UPSERT_TAX_ESTIMATES, {
+                "tax_year": tax_year, "filing_status": filing_status, "client_ids": client_ids,
+                "liabilities": liabilities, "marginal_rates": marginal_rates, "effective_rates": effective_rates})
+            return cursor.rowcount
+
+
+def get_staff_dashboard(connection, tax_year):
+    """
+    Returns:
+        list of tuple: (role, staff_id, name, clients, materials_submitted, returns, filed, filed_by_cpa,
+        filed_by_assistant) per CPA and assistant, counting the tax returns of `tax_year`. The rows with staff_id 0
+        (and no name) count the clients without a CPA / assistant.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_STAFF_DASHBOARD, (tax_year, ))
+            return cursor.fetchall()
+
+
+def rebuild_staff_summaries(connection, tax_year=None):
+    """
+    Recounts the dashboard summaries from the clients and tax returns, e.g. after they were changed with the
+    triggers disabled. Writes to both tables wait until the rebuild is committed.
+
+    Args:
+        tax_year (int): Only recount the tax returns of this year. None recounts everything.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, REBUILD_STAFF_SUMMARIES, (tax_year, ))
+
+
+def claim_tax_returns(connection, assistant_id, tax_year, limit, lease_seconds):
+    """
+    Leases up to `limit` unfiled tax returns of `tax_year` whose materials are submitted to an assistant.
+    Returns that another transaction is claiming at the same moment are skipped, not waited for.
+    Returns:
+        list of tuple: (tax_return_id, client_id, client_name, tax_year, lease_expires_at) of the claimed returns.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, CLAIM_TAX_RETURNS, {"assistant_id": assistant_id, "tax_year": tax_year, "limit": limit,
+                                                 "lease_seconds": lease_seconds})
+            return sorted(cursor.fetchall())
+
+
+def complete_tax_return_leases(connection, assistant_id, tax_year, client_ids, checked_by, filed_at):
+    """
+    Marks the leased tax returns of the given clients as filed and ends their leases, in one statement.
+    Returns:
+        list of int: The IDs of the clients whose return was completed; returns not leased by the assistant are
+        left untouched.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, COMPLETE_TAX_RETURN_LEASES, {
+                "assistant_id": assistant_id, "tax_year": tax_year, "client_ids": list(client_ids),
+                "checked_by": checked_by, "filed_at": filed_at})
+            return [row[0] for row in cursor.fetchall()]
+
+
+def release_tax_return_leases(connection, assistant_id, tax_year, client_ids=None):
+    """
+    Ends the assistant's leases of the given clients' tax returns (all of its leases when `client_ids` is None)
+    without filing them, so they can be claimed again.
+    Returns:
+        list of int: The IDs of the clients whose return was released.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, RELEASE_TAX_RETURN_LEASES, {
+                "assistant_id": assistant_id, "tax_year": tax_year,
+                "client_ids": None if client_ids is None else list(client_ids)})
+            return [row[0] for row in cursor.fetchall()]
+
+
+def get_work_queue_counts(connection, tax_year):
+    """
+    Returns:
+        tuple: (waiting, leased) numbers of unfiled tax returns of `tax_year` whose materials are submitted.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            _execute(cursor, SELECT_WORK_QUEUE_COUNTS, (tax_year, ))
+            return cursor.fetchone()
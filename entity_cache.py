@@ -0,0 +1,156 @@
+# in-process read-through cache for the model lookups (Client, CPA, TaxFilingAssistant, TaxReturn).
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+MISSING = object()
+INVALIDATION_STRIPES = 1024
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache whose entries also expire after `ttl` seconds.
+
+    Every invalidation advances a generation. A reader takes the `generation()` before it reads the database and
+    passes it to `put`, which drops the value if one of its keys was invalidated (or the cache cleared) since, so
+    a row read before a concurrent write cannot be cached after that write invalidated it. Invalidations are
+    tracked per stripe of keys (by hash) rather than per key, which keeps the bookkeeping bounded at the cost of
+    now and then skipping a store that was fine.
+    """
+    def __init__(self, maxsize=4096, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._invalidated_at = [0] * INVALIDATION_STRIPES  # generation of the last invalidation per stripe
+        self._cleared_at = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def peek(self, key, default=None):
+        # like get, but without touching the counters or the LRU order
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry else default
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def _invalidated_since(self, key, generation):
+        return max(self._cleared_at, self._invalidated_at[hash(key) % INVALIDATION_STRIPES]) > generation
+
+    def put(self, key, value, generation=None):
+        return self.put_all((key, ), value, generation)
+
+    def put_all(self, keys, value, generation=None):
+        # stores the value under every key; returns False, storing nothing, if a key was invalidated after
+        # `generation`
+        with self._lock:
+            if generation is not None and any(self._invalidated_since(key, generation) for key in keys):
+                return False
+            for key in keys:
+                self._entries[key] = (value, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            return True
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._invalidated_at[hash(key) % INVALIDATION_STRIPES] = self._generation
+                if self._entries.pop(key, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cleared_at = self._generation
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), maxsize=self.maxsize, ttl=self.ttl)
+
+
+load_dotenv()
+_enabled = os.environ.get("ENTITY_CACHE", "on").lower() not in ("0", "off", "false", "no")
+entities = LRUCache(maxsize=int(os.environ.get("ENTITY_CACHE_SIZE", 4096)),
+                    ttl=float(os.environ.get("ENTITY_CACHE_TTL", 300)))
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(enabled):
+    """
+    Turns the entity cache on or off for the whole process. Turning it off also empties it.
+    Other processes writing to the same database are only picked up once their entries expire,
+    so callers that need strictly current data should turn it off (or pass `use_cache=False`).
+    """
+    global _enabled
+    _enabled = enabled
+    entities.clear()
+
+
+def lookup(key, use_cache=True):
+    """
+    Returns:
+        tuple: (the cached entity or MISSING, the generation to pass to `store` along with the entity read from the
+        database on a miss).
+    """
+    generation = entities.generation()
+    if not (_enabled and use_cache):
+        return MISSING, generation
+    return entities.get(key), generation
+
+
+def store(entity, *keys, generation=None):
+    """
+    Caches the entity under every key, unless one of them was invalidated after `generation` (see `lookup`), i.e.
+    the entity may have been read before a write that changed it. Either way the entity is returned.
+    """
+    if _enabled:
+        entities.put_all(keys, entity, generation)
+    return entity
+
+
+def invalidate(*keys):
+    entities.invalidate(*keys)
+
+
+def clear():
+    # for bulk writes that touch more entries than are worth invalidating one by one
+    entities.clear()
+
+
+def stats():
+    """
+    Returns:
+        dict: The `hits`, `misses`, `evictions`, `expirations` and `invalidations` counters,
+        the current `size` and the `maxsize`/`ttl` settings.
+    """
+    return dict(entities.stats(), enabled=_enabled)
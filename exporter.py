@@ -0,0 +1,85 @@
+# streaming bulk export of the client roster (CPA, assistant and filing status) to CSV / JSONL files,
+# e.g. for the billing system. The rows come straight from COPY ... TO STDOUT into the (optionally gzipped) file.
+import gzip
+import os
+import sys
+import time
+from collections import namedtuple
+
+import database
+import tax_years
+from connection_pool import get_connection
+
+FORMATS = tuple(database.EXPORT_FORMATS)
+
+
+class ExportResult(namedtuple("ExportResult", ["rows", "seconds"])):
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def export_format(path):
+    """
+    Returns:
+        str: The export format of a path by its extension ("clients.csv", "clients.jsonl.gz", ...),
+        or None if the extension is not one of FORMATS.
+    """
+    name = path[:-3] if path.endswith(".gz") else path
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    extension = "jsonl" if extension == "ndjson" else extension
+    return extension if extension in FORMATS else None
+
+
+def export_clients_to(file, file_format="csv", tax_year=None, filed=None, cpa_name=None):
+    """
+    Writes the client roster to an open binary file. See `export_clients`.
+
+    Returns:
+        int: The number of exported clients.
+    """
+    year = tax_year or tax_years.default_tax_year()
+    with get_connection(read_only=True) as connection:
+        return database.export_client_rows(connection, file, file_format, year, filed, cpa_name)
+
+
+def export_clients(path, file_format=None, tax_year=None, filed=None, cpa_name=None, compress=None):
+    """
+    Exports every client with its CPA, assistant and the filing status of one tax year to a CSV (with header)
+    or JSONL file. The rows are streamed in chunks, so memory use stays the same for any number of clients.
+    Runs on the read replica when one is configured.
+
+    Args:
+        path (str): The file to write, or "-" for standard output.
+        file_format (str): "csv" or "jsonl". Defaults to the file's extension, then "csv".
+        tax_year (int): The tax year of the exported filing status. Defaults to the current season.
+        filed (bool): Only export clients whose return is filed (True) or not filed (False). None exports all.
+        cpa_name (str): Only export the clients of this CPA.
+        compress (bool): Write gzip-compressed output. Defaults to True when the path ends with ".gz".
+    Returns:
+        ExportResult: The number of exported clients and the time it took.
+    Raises:
+        ValueError: If the format is not one of FORMATS.
+    """
+    file_format = file_format or export_format(path) or "csv"
+    if file_format not in FORMATS:
+        raise ValueError(f"Unsupported export format '{file_format}'. Use one of: {', '.join(FORMATS)}.")
+    if compress is None:
+        compress = path.endswith(".gz")
+    started = time.perf_counter()
+    if path == "-":
+        file = sys.stdout.buffer
+    else:
+        file = open(path, "wb")
+    try:
+        if compress:
+            with gzip.GzipFile(fileobj=file, mode="wb") as gzip_file:
+                rows = export_clients_to(gzip_file, file_format, tax_year, filed, cpa_name)
+        else:
+            rows = export_clients_to(file, file_format, tax_year, filed, cpa_name)
+    finally:
+        if file is sys.stdout.buffer:
+            file.flush()
+        else:
+            file.close()
+    return ExportResult(rows, time.perf_counter() - started)
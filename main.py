@@ -1,14 +1,29 @@
 # main function that prompts user for an action they would like to execute.
+import argparse
 import datetime
+import os
+import sys
+import time
 
 import pytz
 
+import assignment
+import batch_runner
+import bulk_import
+import change_feed
+import exporter
+import dashboard
 import database
+import metrics
+import migrations
+import tax_engine
+import tax_years
+import work_queue
 from classes.Client import Client
 from classes.CPA import CPA
 from classes.TaxFilingAssistant import TaxFilingAssistant
 from classes.TaxReturn import TaxReturn
-from connection_pool import get_connection
+from connection_pool import configure, get_connection
 
 DATABASE_PROMPT = "Enter the DATABASE_URL value or leave empty to load from .env file: "
 MENU_PROMPT = """-- Menu --
@@ -26,10 +41,20 @@ MENU_PROMPT = """-- Menu --
 11) Assign an assistant to a client
 12) Display all assistant-client relationships
 13) Get client details
-14) Exit
+14) Mark materials as submitted for many clients
+15) Mark many clients' tax returns as filed
+16) Automatically assign CPAs and assistants to unassigned clients
+17) Search clients by name or address
+18) View the workload and progress dashboard
+19) Work the queue of unfiled tax returns
+20) Exit
 
 Enter your choice: """
 NEW_OPTION_PROMPT = "Enter new option text (or leave empty to stop adding options): "
+CLIENT_NAMES_PROMPT = "Enter client names separated by commas, or @path to a file with one name per line: "
+EXIT_OPTION = "20"
+SEARCH_PAGE_SIZE = 10
+DISPLAY_TIME_ZONE = "US/Eastern"
 
 
 def prompt_add_client():
@@ -85,14 +110,14 @@ def prompt_add_tax_return():
     add a tax return file for a client so that it can be marked as filed by another function below.
     """
     client_name = input("Enter the name of the client to create a tax return for: ")
-    client = Client.get(client_name)
-    if not client:
+    tax_year = tax_years.default_tax_year()
+    result = TaxReturn.create_if_absent(client_name, tax_year)
+    if not result:
         print("There is no client with that name in the database.")
         return
-    if TaxReturn.get(client._id):
-        print("A tax return already exists for that client.")
-        return
-    TaxReturn.create(client)
+    _, created = result
+    if not created:
+        print(f"A {tax_year} tax return already exists for that client.")
 
 
 def prompt_check_materials():
@@ -115,29 +140,25 @@ def prompt_mark_tax_return():
     Prints messages if the client or tax return does not exist or if the input is invalid.
     """
     client_name = input("What is the client's name? ")
-    client = Client.get(client_name)
-    if not client:
-        print("There is no client with that name in the database.")
-        return
-
-    tax_return = TaxReturn.get(client._id)
-    if not tax_return:
-        print("There is no tax return file for this client. Please create one first")
-        return
 
     print("Who is filing the return?")
     print("1) CPA")
     print("2) Tax Filing Assistant")
     choice = input("choice: ")
-
-    if choice == "1":
-        tax_return.mark_filed("CPA")
-    elif choice == "2":
-        tax_return.mark_filed("Assistant")
-    else:
+    if choice not in FILERS:
         print("Invalid. Please enter 1 or 2.")
         return
 
+    # the client lookup and the update are a single statement, so the checks happen afterwards
+    tax_year = tax_years.default_tax_year()
+    result = TaxReturn.mark_filed_by_client_name(client_name, FILERS[choice], tax_year)
+    if not result:
+        print("There is no client with that name in the database.")
+        return
+    _, has_tax_return = result
+    if not has_tax_return:
+        print(f"There is no {tax_year} tax return file for this client. Please create one first")
+
 
 def prompt_assign_cpa():
     # assign cpa to a client
@@ -177,26 +198,26 @@ def prompt_check_tax_return_status():
     from the database, and displays whether it has been filed, by whom, and when.
     """
     client_name = input("What is the client's name? ")
-    client = Client.get(client_name)
-    if not client:
+    tax_year = tax_years.default_tax_year()
+    result = Client.get_with_tax_return(client_name, tax_year)
+    if not result:
         print("There is no client with that name in the database.")
         return
-    status = TaxReturn.is_filed(client._id)
-    if not status:
-        print("There is no tax return file for this client. Please create one first")
+    _, tax_return = result
+    if not tax_return:
+        print(f"There is no {tax_year} tax return file for this client. Please create one first")
         return
 
-    if status["filed"]:
-        if status["checked_by"] == "yes":
+    if tax_return.filed_or_not:
+        if tax_return.checked_by == "yes":
             filed_by = "a CPA"
         else:
             filed_by = "a tax filing assistant"
-        time_filed_utc = datetime.datetime.fromtimestamp(status["tax_return_timestamp"], tz=pytz.utc)
-        time_filed_eastern_us = time_filed_utc.astimezone(pytz.timezone("US/Eastern"))
+        time_filed_eastern_us = tax_return.tax_return_timestamp.astimezone(pytz.timezone(DISPLAY_TIME_ZONE))
         filed_time_str = time_filed_eastern_us.strftime("%Y-%m-%d %I:%M:%S %p %Z")
-        print(f"{client_name.title()}'s tax return was filed by {filed_by} on {filed_time_str}.")
+        print(f"{client_name.title()}'s {tax_year} tax return was filed by {filed_by} on {filed_time_str}.")
     else:
-        print(f"{client_name.title()}'s tax return has not been filed.")
+        print(f"{client_name.title()}'s {tax_year} tax return has not been filed.")
 
 
 def prompt_get_client_details():
@@ -210,22 +231,172 @@ def prompt_get_client_details():
     print(client)
 
 
+def prompt_search_clients():
+    """
+    Lists the clients whose name or address best matches a partial or misspelled text, one page at a time.
+    """
+    text = get_name("Search for (part of) a client's name or address: ")
+    page = 0
+    while True:
+        results = Client.search(text, SEARCH_PAGE_SIZE + 1, page * SEARCH_PAGE_SIZE)
+        if not results and page == 0:
+            print("No matching clients found.")
+            return
+        for client, score in results[:SEARCH_PAGE_SIZE]:
+            print(f"{client.name} | {client.address} | Client ID: {client._id} | Match: {score:.0%}")
+        if len(results) <= SEARCH_PAGE_SIZE or input("Show more results? (y/n) ").strip().lower() != "y":
+            return
+        page += 1
+
+
+def prompt_mark_many_materials_submitted():
+    """
+    Marks the materials of a list of clients as submitted in one batch.
+    """
+    client_names = read_client_names(input(CLIENT_NAMES_PROMPT))
+    changed = Client.mark_materials_submitted_many(client_names)
+    print(f"Marked materials as submitted for {len(changed)} of {len(client_names)} clients.")
+
+
+def prompt_mark_many_tax_returns():
+    """
+    Marks the tax returns of a list of clients as filed in one batch.
+    Clients without a tax return file, or whose return is already filed, are listed as skipped.
+    """
+    client_names = read_client_names(input(CLIENT_NAMES_PROMPT))
+    print("Who is filing the returns?")
+    print("1) CPA")
+    print("2) Tax Filing Assistant")
+    choice = input("choice: ")
+    if choice not in ("1", "2"):
+        print("Invalid. Please enter 1 or 2.")
+        return
+    print_mark_filed_result(client_names, TaxReturn.mark_filed_many_by_name(client_names, FILERS[choice]))
+
+
+def print_mark_filed_result(client_names, changed):
+    print(f"Marked {len(changed)} of {len(client_names)} tax returns as filed.")
+    changed_names = {name.lower() for _, name in changed}
+    skipped = [name for name in client_names if name.lower() not in changed_names]
+    if skipped:
+        print(f"Skipped (no such client, no tax return file or already filed): {', '.join(skipped)}")
+
+
+def prompt_auto_assign():
+    """
+    Previews a balanced assignment of all unassigned clients and applies it after confirmation.
+    """
+    weighted = input("Balance by summed client income instead of client count? (y/n) ").strip().lower() == "y"
+    max_cpa_clients = read_optional_int("Maximum clients per CPA (leave empty for no limit): ")
+    max_assistant_clients = read_optional_int("Maximum clients per assistant (leave empty for no limit): ")
+    plan = assignment.auto_assign(weighted, max_cpa_clients, max_assistant_clients, dry_run=True)
+    print_assignment_plan(plan)
+    if plan.assignments and input("Apply these assignments? (y/n) ").strip().lower() == "y":
+        plan = assignment.auto_assign(weighted, max_cpa_clients, max_assistant_clients)
+        print(f"Assigned staff to {plan.updated} clients.")
+
+
+def print_assignment_plan(plan):
+    print(f"--- {len(plan.assignments)} clients without a CPA or assistant ---")
+    for role, title in (("cpa", "CPA"), ("assistant", "Assistant")):
+        for load in sorted(plan.loads[role].values(), key=lambda load: load.name.lower()):
+            print(f"{title}: {load.name} | Clients: {load.clients} | Income: {load.income}")
+    for role, title in (("cpa", "a CPA"), ("assistant", "an assistant")):
+        if plan.unassigned[role]:
+            print(f"{plan.unassigned[role]} clients stay without {title} because all are at capacity.")
+
+
+def read_optional_int(prompt):
+    while True:
+        value = input(prompt).strip()
+        if not value:
+            return None
+        if value.isdigit():
+            return int(value)
+        print("Please enter a whole number or leave empty.")
+
+
 def print_cpa_client_relations():
-    relations = CPA.get_client_relations()
-    relations = sorted(relations, key=lambda x: x["cpa_name"].lower())
+    # relations arrive sorted from the database and are printed as they are streamed in
+    cpa_name = input("Only show the clients of CPA (leave empty for all): ").strip() or None
     print("--- CPA-Client Relations ---")
-    for relation in relations:
+    for relation in CPA.iter_client_relations(cpa_name):
         print(f"CPA: {relation['cpa_name']} | Client: {relation['client_name']}")
 
 
 def print_assistant_client_relations():
-    relations = TaxFilingAssistant.get_client_relations()
-    relations = sorted(relations, key=lambda x: x["assistant_name"].lower())
+    assistant_name = input("Only show the clients of assistant (leave empty for all): ").strip() or None
     print("--- Assistant-Client Relations ---")
-    for relation in relations:
+    for relation in TaxFilingAssistant.iter_client_relations(assistant_name):
         print(f"Assistant: {relation['assistant_name']} | Client: {relation['client_name']}")
 
 
+def print_dashboard(tax_year=None):
+    """
+    Prints the clients, materials and filing progress of every CPA and assistant, and the totals.
+    """
+    board = dashboard.get_dashboard(tax_year)
+    print(f"--- Dashboard {board.tax_year} ---")
+    for title, rows in (("CPAs", board.cpas), ("Assistants", board.assistants)):
+        print(f"{title}:")
+        for row in rows:
+            print(f"  {row.name or '(unassigned)'} | Clients: {row.clients} | "
+                  f"Materials in: {row.materials_submitted} ({row.materials_percent:.0f}%) | "
+                  f"Filed: {row.filed} | Unfiled: {row.unfiled}")
+    totals = board.totals
+    print(f"Total: {totals.clients} clients | Materials in: {totals.materials_percent:.1f}% | "
+          f"Filed: {totals.filed} (by CPA: {totals.filed_by_cpa}, by assistant: {totals.filed_by_assistant}) | "
+          f"Unfiled: {totals.unfiled}")
+
+
+def prompt_work_queue():
+    """
+    Claims the next unfiled tax returns (materials submitted) for an assistant and asks, return by return,
+    whether it was filed, goes back to the queue or stays claimed. Other assistants working the queue at the same
+    time get different returns.
+    """
+    assistant = TaxFilingAssistant.get(get_name("Enter the assistant's name: "))
+    if not assistant:
+        print("There is no assistant with that name in the database.")
+        return
+    waiting, leased = work_queue.counts()
+    print(f"{waiting} tax returns are waiting, {leased} are being worked on.")
+    claimed = work_queue.claim_next(read_optional_int("How many returns to claim (default 5)? ") or 5, assistant._id)
+    if not claimed:
+        print("There are no tax returns waiting.")
+        return
+    filed, released = [], []
+    for item in claimed:
+        lease_end = item.lease_expires_at.astimezone(pytz.timezone(DISPLAY_TIME_ZONE))
+        answer = input(f"{item.client_name} ({item.tax_year}): 1) filed 2) back to the queue "
+                       f"3) keep claimed until {lease_end:%H:%M} ")
+        if answer.strip() == "1":
+            filed.append(item.client_id)
+        elif answer.strip() == "2":
+            released.append(item.client_id)
+    if filed:
+        filed = work_queue.complete(assistant._id, filed)
+    if released:
+        released = work_queue.release(assistant._id, released)
+    print(f"Filed {len(filed)}, returned {len(released)} and kept {len(claimed) - len(filed) - len(released)} "
+          f"tax returns.")
+
+
+def read_client_names(text):
+    """
+    Parses a comma separated list of client names, or reads one name per line from a file when
+    the text is `@path`.
+
+    Returns:
+        list of str: The non-empty client names.
+    """
+    text = text.strip()
+    if text.startswith("@"):
+        with open(text[1:], encoding="utf-8") as file:
+            return [line.strip() for line in file if line.strip()]
+    return [name.strip() for name in text.split(",") if name.strip()]
+
+
 def get_name(prompt):
     """
     Prompts the user for a non-empty string input.
@@ -244,6 +415,8 @@ def get_name(prompt):
             return name
 
 
+FILERS = {"1": "CPA", "2": "Assistant"}
+
 MENU_OPTIONS = {
     "1": prompt_add_client,
     "2": prompt_add_cpa,
@@ -258,22 +431,314 @@ MENU_OPTIONS = {
     "11": prompt_assign_assistant,
     "12": print_assistant_client_relations,
     "13": prompt_get_client_details,
+    "14": prompt_mark_many_materials_submitted,
+    "15": prompt_mark_many_tax_returns,
+    "16": prompt_auto_assign,
+    "17": prompt_search_clients,
+    "18": print_dashboard,
+    "19": prompt_work_queue,
 }
 
 
+def setup_database():
+    """
+    Creates the tables if they do not exist yet and applies any pending schema migrations.
+    """
+    with get_connection() as connection:
+        database.create_tables(connection)
+        return migrations.migrate(connection)
+
+
 def menu():
     """
     Initializes the database connection, creates necessary tables, and
     processes user inputs to execute the corresponding actions.
     """
-    with get_connection() as connection:
-        database.create_tables(connection)
-    while (selection := input(MENU_PROMPT)) != "14":
+    db_url = input(DATABASE_PROMPT).strip()
+    if db_url:
+        configure(dsn=db_url)
+    setup_database()
+    while (selection := input(MENU_PROMPT)) != EXIT_OPTION:
+        queries_before, seconds_before = metrics.query_totals()
         try:
             MENU_OPTIONS[selection]()
         except KeyError:
             print("Invalid input selected. Please try again.")
+        if metrics.enabled:
+            queries, seconds = metrics.query_totals()
+            print(f"({queries - queries_before} queries, {(seconds - seconds_before) * 1000:.1f} ms in the database)")
+
+
+def run_import_clients(args):
+    """
+    Non-interactive bulk import of a CSV/JSONL client export, e.g.
+    `python main.py import-clients clients.csv --with-tax-returns --ids-out ids.txt`.
+    Prints the number of imported clients and the throughput in rows per second.
+    """
+    setup_database()
+    rows = 0
+    started = time.perf_counter()
+    with open(args.ids_out or os.devnull, "w") as ids_file:
+        records = bulk_import.read_client_rows(args.path)
+        for client_ids in bulk_import.iter_import_clients(records, args.batch_size, args.with_tax_returns,
+                                                          args.tax_year):
+            rows += len(client_ids)
+            ids_file.writelines(f"{client_id}\n" for client_id in client_ids)
+            print(f"{rows} clients imported...", end="\r")
+    elapsed = time.perf_counter() - started
+    print(f"Imported {rows} clients in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:,.0f} rows/s).")
+
+
+def run_export_clients(args):
+    """
+    Exports the client roster with CPA, assistant and filing status, e.g.
+    `python main.py export-clients roster.csv.gz --unfiled --cpa "Jane Doe"`.
+    """
+    try:
+        result = exporter.export_clients(args.path, args.format, args.year, args.filed, args.cpa, args.gzip or None)
+    except ValueError as error:
+        print(error)
+        return
+    if args.path != "-":
+        print(f"Exported {result.rows} clients in {result.seconds:.2f}s ({result.rows_per_second:,.0f} rows/s).")
+
+
+def run_migrate(args):
+    # `python main.py migrate` upgrades an existing database without starting the menu
+    applied = setup_database()
+    for migration in applied:
+        print(f"Applied migration {migration.version}: {migration.description}")
+    print(f"{len(applied)} migration(s) applied.")
+
+
+def command_client_names(args):
+    client_names = list(args.names)
+    if args.file:
+        client_names += read_client_names(f"@{args.file}")
+    return client_names
+
+
+def run_mark_filed(args):
+    # `python main.py mark-filed --by CPA "Jane Doe" "John Roe"` or `--file names.txt`
+    client_names = command_client_names(args)
+    print_mark_filed_result(client_names, TaxReturn.mark_filed_many_by_name(client_names, args.by, args.year))
+
+
+def run_mark_materials_submitted(args):
+    # `python main.py mark-materials-submitted "Jane Doe" "John Roe"` or `--file names.txt`
+    client_names = command_client_names(args)
+    changed = Client.mark_materials_submitted_many(client_names)
+    print(f"Marked materials as submitted for {len(changed)} of {len(client_names)} clients.")
+
+
+def run_auto_assign(args):
+    # `python main.py auto-assign --weighted --max-cpa-clients 200 --dry-run`
+    plan = assignment.auto_assign(args.weighted, args.max_cpa_clients, args.max_assistant_clients, args.dry_run)
+    print_assignment_plan(plan)
+    if not args.dry_run:
+        print(f"Assigned staff to {plan.updated} clients.")
+
+
+def run_batch(args):
+    """
+    Runs a JSONL operation file, e.g. `python main.py run-batch ops.jsonl --results results.jsonl`.
+    Prints the number of succeeded and failed operations and the throughput in operations per second.
+    """
+    setup_database()
+    result = batch_runner.run_batch(args.path, args.results, args.chunk_size)
+    summary = (f"Ran {result.operations} operations in {result.seconds:.2f}s "
+               f"({result.operations_per_second:,.0f} ops/s): {result.succeeded} succeeded, {result.failed} failed.")
+    print(summary, file=sys.stderr if args.results is None else sys.stdout)
+
+
+def parse_date(value):
+    # dates on the command line are calendar days in the display time zone
+    return pytz.timezone(DISPLAY_TIME_ZONE).localize(datetime.datetime.strptime(value, "%Y-%m-%d"))
+
+
+def run_filing_report(args):
+    """
+    Prints the filings of a time window per period, e.g.
+    `python main.py filing-report --from 2025-01-27 --to 2025-04-16 --per week`.
+    """
+    report = TaxReturn.filing_report(args.start, args.end, args.per, DISPLAY_TIME_ZONE)
+    print(f"--- Filings per {args.per} ({DISPLAY_TIME_ZONE}) ---")
+    for row in report:
+        period_start = row["period_start"].astimezone(pytz.timezone(DISPLAY_TIME_ZONE))
+        print(f"{period_start:%Y-%m-%d %H:%M} | Filed: {row['filed']} | By CPA: {row['filed_by_cpa']} | "
+              f"By assistant: {row['filed_by_assistant']}")
+    print(f"{sum(row['filed'] for row in report)} returns filed in total.")
+
+
+def run_tax_years(args):
+    """
+    Lists, creates, archives or restores tax years, e.g. `python main.py tax-years archive 2019`.
+    Archiving detaches a past year from tax_returns without blocking the current season.
+    """
+    setup_database()
+    if args.action != "list":
+        if args.year is None:
+            print(f"Enter the tax year to {args.action}.")
+            return
+        try:
+            {"create": tax_years.create_tax_year, "archive": tax_years.archive_tax_year,
+             "restore": tax_years.restore_tax_year}[args.action](args.year)
+        except ValueError as error:
+            print(error)
+            return
+    print(f"--- Tax years (current season: {tax_years.default_tax_year()}) ---")
+    for table in tax_years.list_tax_years():
+        print(f"{table.tax_year} | {table.status} | ~{table.estimated_rows:,} returns | "
+              f"{table.bytes / 1024 / 1024:,.1f} MB")
+
+
+def run_dashboard(args):
+    """
+    Prints the dashboard, e.g. `python main.py dashboard --year 2025`. With `--rebuild`, the summaries behind it
+    are recounted from the clients and tax returns first.
+    """
+    setup_database()
+    if args.rebuild:
+        dashboard.rebuild(args.year)
+        print("Dashboard summaries rebuilt.")
+    print_dashboard(args.year)
+
+
+def run_estimate_taxes(args):
+    """
+    Estimates the tax liability of every client, e.g. `python main.py estimate-taxes --year 2025 --write`,
+    and prints the totals per marginal rate.
+    """
+    setup_database()
+    try:
+        estimates = tax_engine.estimate_taxes(args.year, args.filing_status, args.write)
+    except ValueError as error:
+        print(error)
+        return
+    print(f"--- Estimated taxes {estimates.tax_year} ({estimates.filing_status}) ---")
+    totals = tax_engine.totals_by_rate(estimates)
+    for rate, clients, liability in totals:
+        print(f"{rate:5.0%} bracket | Clients: {clients:,} | Liability: ${liability:,.2f}")
+    total = sum(liability for _, _, liability in totals)
+    print(f"{len(estimates.client_ids):,} clients, ${total:,.2f} in total, computed in "
+          f"{estimates.seconds * 1000:.1f} ms{' and saved' if args.write else ''}.")
+
+
+def run_watch(args):
+    """
+    Prints status changes as they are committed, until interrupted (or `--timeout` seconds pass without one).
+    """
+    setup_database()
+    print("Watching status changes (Ctrl+C to stop)...")
+    try:
+        for change in change_feed.iter_changes(timeout=args.timeout):
+            year = f" ({change.tax_year})" if change.tax_year is not None else ""
+            print(f"Client {change.client_id}{year}: {change.field} = {change.value}")
+    except KeyboardInterrupt:
+        pass
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Tax filing project. Runs the interactive menu when no command is given.")
+    commands = parser.add_subparsers(dest="command")
+
+    migrate_parser = commands.add_parser("migrate", help="create the tables and apply pending schema migrations")
+    migrate_parser.set_defaults(handler=run_migrate)
+
+    import_parser = commands.add_parser("import-clients", help="bulk import clients from a CSV or JSONL file")
+    import_parser.add_argument("path", help="path to a .csv (with header) or .jsonl file")
+    import_parser.add_argument("--batch-size", type=int, default=bulk_import.DEFAULT_BATCH_SIZE,
+                               help="clients written per statement")
+    import_parser.add_argument("--with-tax-returns", action="store_true",
+                               help="also create an empty tax return for every imported client")
+    import_parser.add_argument("--ids-out", help="file to write the generated client IDs to, one per line")
+    import_parser.add_argument("--tax-year", type=int,
+                               help="tax year of the created tax returns (default: TAX_YEAR or last year)")
+    import_parser.set_defaults(handler=run_import_clients)
+
+    export_parser = commands.add_parser("export-clients",
+                                        help="export the clients with CPA, assistant and filing status")
+    export_parser.add_argument("path", help="file to write (.csv or .jsonl, .gz to compress), or - for stdout")
+    export_parser.add_argument("--format", choices=exporter.FORMATS, help="output format (default: by extension)")
+    export_parser.add_argument("--gzip", action="store_true", help="compress the output with gzip")
+    status_group = export_parser.add_mutually_exclusive_group()
+    status_group.add_argument("--filed", dest="filed", action="store_const", const=True,
+                              help="only clients whose tax return is filed")
+    status_group.add_argument("--unfiled", dest="filed", action="store_const", const=False,
+                              help="only clients whose tax return is not filed")
+    export_parser.add_argument("--cpa", help="only the clients of this CPA")
+    export_parser.add_argument("--year", type=int,
+                               help="tax year of the filing status (default: TAX_YEAR or last year)")
+    export_parser.set_defaults(handler=run_export_clients)
+
+    filed_parser = commands.add_parser("mark-filed", help="mark the tax returns of many clients as filed")
+    filed_parser.add_argument("names", nargs="*", help="client names")
+    filed_parser.add_argument("--file", help="file with one client name per line")
+    filed_parser.add_argument("--by", choices=["CPA", "Assistant"], required=True, help="who filed the returns")
+    filed_parser.add_argument("--year", type=int, help="tax year of the returns (default: TAX_YEAR or last year)")
+    filed_parser.set_defaults(handler=run_mark_filed)
+
+    materials_parser = commands.add_parser("mark-materials-submitted",
+                                           help="mark the materials of many clients as submitted")
+    materials_parser.add_argument("names", nargs="*", help="client names")
+    materials_parser.add_argument("--file", help="file with one client name per line")
+    materials_parser.set_defaults(handler=run_mark_materials_submitted)
+
+    assign_parser = commands.add_parser("auto-assign",
+                                        help="assign CPAs and assistants to unassigned clients, balancing workloads")
+    assign_parser.add_argument("--weighted", action="store_true",
+                               help="balance the summed client income instead of the number of clients")
+    assign_parser.add_argument("--max-cpa-clients", type=int, help="maximum number of clients per CPA")
+    assign_parser.add_argument("--max-assistant-clients", type=int, help="maximum number of clients per assistant")
+    assign_parser.add_argument("--dry-run", action="store_true", help="only show the planned workloads")
+    assign_parser.set_defaults(handler=run_auto_assign)
+
+    batch_parser = commands.add_parser("run-batch", help="run the operations of a JSONL file without the menu")
+    batch_parser.add_argument("path", help="JSONL file with one operation per line")
+    batch_parser.add_argument("--results", help="file to write one JSON result per line to (default: stdout)")
+    batch_parser.add_argument("--chunk-size", type=int, default=batch_runner.DEFAULT_CHUNK_SIZE,
+                              help="operations committed per transaction")
+    batch_parser.set_defaults(handler=run_batch)
+
+    report_parser = commands.add_parser("filing-report", help="count the returns filed per hour, day, week or month")
+    report_parser.add_argument("--from", dest="start", type=parse_date, required=True,
+                               help="first day of the report (YYYY-MM-DD)")
+    report_parser.add_argument("--to", dest="end", type=parse_date, required=True,
+                               help="day after the last day of the report (YYYY-MM-DD)")
+    report_parser.add_argument("--per", choices=database.REPORT_PERIODS, default="day", help="report period")
+    report_parser.set_defaults(handler=run_filing_report)
+
+    years_parser = commands.add_parser("tax-years", help="list, create, archive or restore tax year partitions")
+    years_parser.add_argument("action", nargs="?", choices=["list", "create", "archive", "restore"], default="list")
+    years_parser.add_argument("year", nargs="?", type=int, help="the tax year to create, archive or restore")
+    years_parser.set_defaults(handler=run_tax_years)
+
+    dashboard_parser = commands.add_parser("dashboard", help="show the workload and filing progress of all staff")
+    dashboard_parser.add_argument("--year", type=int, help="tax year of the returns (default: TAX_YEAR or last year)")
+    dashboard_parser.add_argument("--rebuild", action="store_true",
+                                  help="recount the dashboard summaries first (with --year: only that year's returns)")
+    dashboard_parser.set_defaults(handler=run_dashboard)
+
+    estimate_parser = commands.add_parser("estimate-taxes", help="estimate the tax liability of every client")
+    estimate_parser.add_argument("--year", type=int, help="tax year of the brackets (default: TAX_YEAR or last year)")
+    estimate_parser.add_argument("--filing-status", choices=tax_engine.FILING_STATUSES,
+                                 default=tax_engine.DEFAULT_FILING_STATUS, help="filing status of the brackets")
+    estimate_parser.add_argument("--write", action="store_true", help="store the estimates in tax_estimates")
+    estimate_parser.set_defaults(handler=run_estimate_taxes)
+
+    watch_parser = commands.add_parser("watch", help="print materials and filing status changes as they happen")
+    watch_parser.add_argument("--timeout", type=float, help="stop after this many seconds without a change")
+    watch_parser.set_defaults(handler=run_watch)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        menu()
+    else:
+        args.handler(args)
 
 
 if __name__ == "__main__":
-    menu()
\ No newline at end of file
+    main()
\ No newline at end of file
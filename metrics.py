@@ -0,0 +1,131 @@
+# in-process query metrics for the database layer: per-statement counts, latency and rows, slow query samples
+# and connection pool checkout waits. Off by default; turn on with DB_METRICS=on or `set_enabled(True)`.
+import atexit
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+enabled = os.environ.get("DB_METRICS", "off").lower() in ("1", "on", "true", "yes")
+slow_query_seconds = float(os.environ.get("DB_SLOW_QUERY_MS", 100)) / 1000
+SLOW_QUERY_SAMPLES = 100
+PROMETHEUS_PREFIX = "tax_filing_db"
+
+_lock = threading.Lock()
+_queries = {}
+_pool = {"checkouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+_slow_queries = deque(maxlen=SLOW_QUERY_SAMPLES)
+
+
+def set_enabled(value):
+    global enabled
+    enabled = value
+
+
+def record_query(statement, seconds, rows, failed=False):
+    """
+    Records one execution of the statement constant named `statement` (e.g. "SELECT_CLIENT_DETAILS").
+    Called by `database._execute`; only called while metrics are enabled.
+    """
+    with _lock:
+        stats = _queries.get(statement)
+        if stats is None:
+            stats = _queries[statement] = {"count": 0, "errors": 0, "seconds_total": 0.0, "seconds_max": 0.0,
+                                           "rows": 0}
+        stats["count"] += 1
+        stats["errors"] += failed
+        stats["seconds_total"] += seconds
+        stats["seconds_max"] = max(stats["seconds_max"], seconds)
+        stats["rows"] += max(rows, 0)
+        if seconds >= slow_query_seconds:
+            _slow_queries.append({"statement": statement, "seconds": seconds, "rows": max(rows, 0),
+                                  "failed": failed, "at": time.time()})
+
+
+def record_pool_checkout(seconds):
+    with _lock:
+        _pool["checkouts"] += 1
+        _pool["wait_seconds_total"] += seconds
+        _pool["wait_seconds_max"] = max(_pool["wait_seconds_max"], seconds)
+
+
+def snapshot():
+    """
+    Returns:
+        dict: `queries` (statement name -> count, errors, seconds_total, seconds_mean, seconds_max, rows),
+        `pool` (checkouts, wait_seconds_total, wait_seconds_mean, wait_seconds_max) and the most recent
+        `slow_queries` that took at least `slow_query_seconds`.
+    """
+    with _lock:
+        queries = {statement: dict(stats, seconds_mean=stats["seconds_total"] / stats["count"])
+                   for statement, stats in _queries.items()}
+        checkouts = _pool["checkouts"]
+        pool = dict(_pool, wait_seconds_mean=_pool["wait_seconds_total"] / checkouts if checkouts else 0.0)
+        return {"enabled": enabled, "slow_query_seconds": slow_query_seconds, "queries": queries, "pool": pool,
+                "slow_queries": list(_slow_queries)}
+
+
+def query_totals():
+    # (statements run, seconds spent in them) so far, e.g. to report the round trips of one menu action
+    with _lock:
+        return (sum(stats["count"] for stats in _queries.values()),
+                sum(stats["seconds_total"] for stats in _queries.values()))
+
+
+def reset():
+    with _lock:
+        _queries.clear()
+        _slow_queries.clear()
+        _pool.update(checkouts=0, wait_seconds_total=0.0, wait_seconds_max=0.0)
+
+
+def prometheus_text():
+    """
+    Returns:
+        str: The metrics in the Prometheus text exposition format.
+    """
+    data = snapshot()
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}{labels} {value}")
+
+    queries = sorted(data["queries"].items())
+    for name, key, kind, help_text in (
+        ("queries_total", "count", "counter", "Statements executed."),
+        ("query_errors_total", "errors", "counter", "Statements that raised an error."),
+        ("query_seconds_total", "seconds_total", "counter", "Time spent executing statements."),
+        ("query_seconds_max", "seconds_max", "gauge", "Slowest execution of a statement."),
+        ("query_rows_total", "rows", "counter", "Rows returned or affected by statements."),
+    ):
+        metric(name, kind, help_text, [(f'{{statement="{statement}"}}', stats[key]) for statement, stats in queries])
+    metric("pool_checkouts_total", "counter", "Connections checked out of the pool.",
+           [("", data["pool"]["checkouts"])])
+    metric("pool_wait_seconds_total", "counter", "Time spent waiting for a pooled connection.",
+           [("", data["pool"]["wait_seconds_total"])])
+    metric("pool_wait_seconds_max", "gauge", "Longest wait for a pooled connection.",
+           [("", data["pool"]["wait_seconds_max"])])
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path):
+    """
+    Writes the metrics to `path`: Prometheus text format for a `.prom` file, JSON otherwise.
+    """
+    with open(path, "w", encoding="utf-8") as file:
+        if path.endswith(".prom"):
+            file.write(prometheus_text())
+        else:
+            json.dump(snapshot(), file, indent=2)
+
+
+if os.environ.get("DB_METRICS_FILE"):
+    # e.g. DB_METRICS=on DB_METRICS_FILE=metrics.json python main.py run-batch ops.jsonl
+    atexit.register(write_file, os.environ["DB_METRICS_FILE"])
@@ -0,0 +1,427 @@
+# versioned schema migrations applied on top of the tables created by database.create_tables.
+from collections import namedtuple
+from contextlib import contextmanager
+
+import psycopg2
+
+import tax_years
+
+MIGRATION_LOCK_KEY = 73_002_001  # arbitrary pg_advisory_lock key so only one process migrates at a time
+
+CREATE_SCHEMA_MIGRATIONS = """CREATE TABLE IF NOT EXISTS schema_migrations
+(version INTEGER PRIMARY KEY, description TEXT, applied_at TIMESTAMPTZ DEFAULT NOW());"""
+
+SELECT_APPLIED_VERSIONS = "SELECT version FROM schema_migrations;"
+
+INSERT_MIGRATION_VERSION = "INSERT INTO schema_migrations (version, description) VALUES (%s, %s);"
+
+LOCK_MIGRATIONS = "SELECT pg_advisory_lock(%s);"
+
+UNLOCK_MIGRATIONS = "SELECT pg_advisory_unlock(%s);"
+
+# `statements` is a tuple of SQL statements, or a function returning them that is called when the migration runs.
+# `concurrent` migrations cannot run inside a transaction block (CREATE INDEX CONCURRENTLY), so they are
+# executed in autocommit mode and recorded once all of their statements succeeded.
+# `optional` migrations depend on something the server may not offer (e.g. an extension that is not installed);
+# if they fail they are skipped without being recorded, so they are tried again on the next run.
+Migration = namedtuple("Migration", ["version", "description", "statements", "concurrent", "optional"],
+                       defaults=(False, ))
+
+
+def statement_triggers(table, name, function):
+    """
+    Builds the statements that (re)create AFTER INSERT, UPDATE and DELETE statement-level triggers on `table`
+    which run `function` with the statement's transition tables, `new_rows` and/or `old_rows`.
+    """
+    statements = ()
+    for event, transition_tables in (("INSERT", "NEW TABLE AS new_rows"),
+                                     ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                                     ("DELETE", "OLD TABLE AS old_rows")):
+        trigger = f"{name}_{event.lower()}"
+        statements += (
+            f"DROP TRIGGER IF EXISTS {trigger} ON {table};",
+            f"""CREATE TRIGGER {trigger} AFTER {event} ON {table} REFERENCING {transition_tables}
+            FOR EACH STATEMENT EXECUTE FUNCTION {function}();""",
+        )
+    return statements
+
+
+def concurrent_index(version, description, index_name, definition):
+    """
+    Builds a migration that creates an index without blocking writes.
+    A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind, so the index is dropped first;
+    the migration is only recorded after the index was built, which makes re-running it safe.
+    """
+    return Migration(version, description, (
+        f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};",
+        f"CREATE {definition.format(name=index_name)};",
+    ), True)
+
+
+def partition_tax_returns_statements():
+    """
+    Builds the statements of migration 12, which swaps in a copy of tax_returns that is list-partitioned by tax
+    year (one table per year, see database.CREATE_TAX_YEAR_PARTITION). Primary and unique keys of a partitioned
+    table must include the partition key, so the key becomes (client_id, tax_year) and replaces the index of
+    migration 4. Runs in one transaction and locks tax_returns while the rows are copied.
+
+    The table held a single season so far, and only the operator knows which one, so the existing returns are
+    copied into TAX_YEAR. Without TAX_YEAR the migration fails unless there are no returns yet, instead of
+    guessing a season from the date it happens to run on.
+    """
+    statements = ()
+    tax_year = tax_years.configured_tax_year()
+    if tax_year is None:
+        statements += ("""DO $$ BEGIN
+            IF EXISTS (SELECT 1 FROM tax_returns) THEN
+                RAISE EXCEPTION 'Set TAX_YEAR to the tax year of the existing tax returns to partition them by year';
+            END IF;
+        END $$;""", )
+        tax_year = tax_years.default_tax_year()
+    return statements + (
+        "ALTER TABLE tax_returns RENAME TO tax_returns_unpartitioned;",
+        "ALTER TABLE tax_returns_unpartitioned RENAME CONSTRAINT tax_returns_pkey TO tax_returns_unpartitioned_pkey;",
+        """ALTER TABLE tax_returns_unpartitioned RENAME CONSTRAINT tax_returns_client_id_fkey
+        TO tax_returns_unpartitioned_client_id_fkey;""",
+        "ALTER INDEX IF EXISTS tax_returns_filed_at_idx RENAME TO tax_returns_unpartitioned_filed_at_idx;",
+        """CREATE TABLE tax_returns
+        (id INTEGER NOT NULL DEFAULT nextval('tax_returns_id_seq'), client_id INTEGER REFERENCES clients(id),
+        filed_or_not BOOLEAN DEFAULT FALSE, checked_by TEXT, tax_return_timestamp TIMESTAMPTZ,
+        tax_year SMALLINT NOT NULL, PRIMARY KEY (id, tax_year), UNIQUE (client_id, tax_year))
+        PARTITION BY LIST (tax_year);""",
+        "ALTER SEQUENCE tax_returns_id_seq OWNED BY tax_returns.id;",
+        """CREATE INDEX tax_returns_filed_at_idx ON tax_returns (tax_return_timestamp)
+        WHERE tax_return_timestamp IS NOT NULL;""",
+        f"""CREATE TABLE tax_returns_{tax_year} PARTITION OF tax_returns
+        FOR VALUES IN ({tax_year});""",
+        f"""INSERT INTO tax_returns (id, client_id, filed_or_not, checked_by, tax_return_timestamp, tax_year)
+        SELECT id, client_id, filed_or_not, checked_by, tax_return_timestamp, {tax_year}
+        FROM tax_returns_unpartitioned;""",
+        "DROP TABLE tax_returns_unpartitioned;",
+        "ANALYZE tax_returns;",
+    )
+
+
+# dashboard summary triggers (migrations 15 and 17). The changed rows count +1 (inserted, updated to) or -1
+# (deleted, updated from) in the summaries. A group is written when any of its counts changed: a statement that
+# swaps two clients between CPAs leaves their return counts as they are but may still move filed returns.
+REFRESH_STAFF_CLIENT_SUMMARY = """CREATE OR REPLACE FUNCTION refresh_staff_client_summary() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    changes TEXT := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT *, 1 AS sign FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT *, -1 AS sign FROM old_rows'
+        ELSE 'SELECT *, 1 AS sign FROM new_rows UNION ALL SELECT *, -1 AS sign FROM old_rows' END;
+BEGIN
+    EXECUTE format($sql$
+        WITH changes AS (%s)
+        INSERT INTO staff_client_summary AS summary (role, staff_id, clients, materials_submitted)
+        SELECT staff.role, staff.staff_id, SUM(changes.sign),
+               SUM(changes.sign * (changes.materials_submitted IS TRUE)::integer)
+        FROM changes
+        CROSS JOIN LATERAL (VALUES ('cpa', COALESCE(changes.cpa_id, 0)),
+                                   ('assistant', COALESCE(changes.assistant_id, 0))) AS staff(role, staff_id)
+        GROUP BY staff.role, staff.staff_id
+        HAVING SUM(changes.sign) <> 0
+            OR SUM(changes.sign * (changes.materials_submitted IS TRUE)::integer) <> 0
+        ORDER BY staff.role, staff.staff_id
+        ON CONFLICT (role, staff_id) DO UPDATE
+        SET clients = summary.clients + EXCLUDED.clients,
+            materials_submitted = summary.materials_submitted + EXCLUDED.materials_submitted$sql$, changes);
+    IF TG_OP = 'UPDATE' THEN
+        -- the tax returns of reassigned clients move to their new CPA / assistant
+        INSERT INTO staff_return_summary AS summary
+        (role, staff_id, tax_year, returns, filed, filed_by_cpa, filed_by_assistant)
+        SELECT staff.role, staff.staff_id, tax_returns.tax_year, SUM(staff.sign),
+               SUM(staff.sign * (tax_returns.filed_or_not IS TRUE)::integer),
+               SUM(staff.sign * (tax_returns.filed_or_not IS TRUE AND tax_returns.checked_by = 'yes')::integer),
+               SUM(staff.sign * (tax_returns.filed_or_not IS TRUE AND tax_returns.checked_by = 'no')::integer)
+        FROM new_rows
+        JOIN old_rows ON old_rows.id = new_rows.id
+        JOIN tax_returns ON tax_returns.client_id = new_rows.id
+        CROSS JOIN LATERAL (VALUES ('cpa', COALESCE(new_rows.cpa_id, 0), 1),
+                                   ('cpa', COALESCE(old_rows.cpa_id, 0), -1),
+                                   ('assistant', COALESCE(new_rows.assistant_id, 0), 1),
+                                   ('assistant', COALESCE(old_rows.assistant_id, 0), -1))
+            AS staff(role, staff_id, sign)
+        WHERE new_rows.cpa_id IS DISTINCT FROM old_rows.cpa_id
+           OR new_rows.assistant_id IS DISTINCT FROM old_rows.assistant_id
+        GROUP BY staff.role, staff.staff_id, tax_returns.tax_year
+        HAVING SUM(staff.sign) <> 0
+            OR SUM(staff.sign * (tax_returns.filed_or_not IS TRUE)::integer) <> 0
+            OR SUM(staff.sign * (tax_returns.filed_or_not IS TRUE AND tax_returns.checked_by = 'yes')::integer) <> 0
+            OR SUM(staff.sign * (tax_returns.filed_or_not IS TRUE AND tax_returns.checked_by = 'no')::integer) <> 0
+        ORDER BY staff.role, staff.staff_id, tax_returns.tax_year
+        ON CONFLICT (role, staff_id, tax_year) DO UPDATE
+        SET returns = summary.returns + EXCLUDED.returns, filed = summary.filed + EXCLUDED.filed,
+            filed_by_cpa = summary.filed_by_cpa + EXCLUDED.filed_by_cpa,
+            filed_by_assistant = summary.filed_by_assistant + EXCLUDED.filed_by_assistant;
+    END IF;
+    RETURN NULL;
+END $$;"""
+
+# the clients of the changed returns are locked FOR SHARE and read in their latest version, so a reassignment of
+# one of them in a concurrent transaction either moves the changed return along or waits until it was counted
+REFRESH_STAFF_RETURN_SUMMARY = """CREATE OR REPLACE FUNCTION refresh_staff_return_summary() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    changes TEXT := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT *, 1 AS sign FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT *, -1 AS sign FROM old_rows'
+        ELSE 'SELECT *, 1 AS sign FROM new_rows UNION ALL SELECT *, -1 AS sign FROM old_rows' END;
+BEGIN
+    EXECUTE format($sql$
+        WITH changes AS (%s),
+        staff_of_clients AS (
+            SELECT id, cpa_id, assistant_id FROM clients
+            WHERE id IN (SELECT client_id FROM changes)
+            ORDER BY id FOR SHARE),
+        counts AS (
+            SELECT staff.role, staff.staff_id, changes.tax_year, SUM(changes.sign) AS returns,
+                   SUM(changes.sign * (changes.filed_or_not IS TRUE)::integer) AS filed,
+                   SUM(changes.sign * (changes.filed_or_not IS TRUE AND changes.checked_by = 'yes')::integer)
+                       AS filed_by_cpa,
+                   SUM(changes.sign * (changes.filed_or_not IS TRUE AND changes.checked_by = 'no')::integer)
+                       AS filed_by_assistant
+            FROM changes
+            JOIN staff_of_clients clients ON clients.id = changes.client_id
+            CROSS JOIN LATERAL (VALUES ('cpa', COALESCE(clients.cpa_id, 0)),
+                                       ('assistant', COALESCE(clients.assistant_id, 0)))
+                AS staff(role, staff_id)
+            GROUP BY staff.role, staff.staff_id, changes.tax_year)
+        INSERT INTO staff_return_summary AS summary
+        (role, staff_id, tax_year, returns, filed, filed_by_cpa, filed_by_assistant)
+        SELECT * FROM counts
+        WHERE returns <> 0 OR filed <> 0 OR filed_by_cpa <> 0 OR filed_by_assistant <> 0
+        ORDER BY role, staff_id, tax_year
+        ON CONFLICT (role, staff_id, tax_year) DO UPDATE
+        SET returns = summary.returns + EXCLUDED.returns, filed = summary.filed + EXCLUDED.filed,
+            filed_by_cpa = summary.filed_by_cpa + EXCLUDED.filed_by_cpa,
+            filed_by_assistant = summary.filed_by_assistant + EXCLUDED.filed_by_assistant$sql$, changes);
+    RETURN NULL;
+END $$;"""
+
+
+MIGRATIONS = [
+    concurrent_index(1, "Index clients by case-insensitive name", "clients_lower_name_idx",
+                     "INDEX CONCURRENTLY {name} ON clients (LOWER(name))"),
+    concurrent_index(2, "Index cpas by case-insensitive name", "cpas_lower_name_idx",
+                     "INDEX CONCURRENTLY {name} ON cpas (LOWER(name))"),
+    concurrent_index(3, "Index tax filing assistants by case-insensitive name", "tax_filing_assistants_lower_name_idx",
+                     "INDEX CONCURRENTLY {name} ON tax_filing_assistants (LOWER(name))"),
+    # fails if a client already has duplicate tax returns; those have to be merged by hand first
+    concurrent_index(4, "One tax return per client", "tax_returns_client_id_key",
+                     "UNIQUE INDEX CONCURRENTLY {name} ON tax_returns (client_id)"),
+    concurrent_index(5, "Index clients by CPA", "clients_cpa_id_idx",
+                     "INDEX CONCURRENTLY {name} ON clients (cpa_id)"),
+    concurrent_index(6, "Index clients by tax filing assistant", "clients_assistant_id_idx",
+                     "INDEX CONCURRENTLY {name} ON clients (assistant_id)"),
+    # fuzzy client search (see database.SEARCH_CLIENTS_TRIGRAM); needs the pg_trgm contrib extension
+    Migration(7, "Trigram indexes for fuzzy client search", (
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+        "DROP INDEX CONCURRENTLY IF EXISTS clients_name_trgm_idx;",
+        "CREATE INDEX CONCURRENTLY clients_name_trgm_idx ON clients USING GIN (LOWER(name) gin_trgm_ops);",
+        "DROP INDEX CONCURRENTLY IF EXISTS clients_address_trgm_idx;",
+        "CREATE INDEX CONCURRENTLY clients_address_trgm_idx ON clients USING GIN (LOWER(address) gin_trgm_ops);",
+    ), True, optional=True),
+    # prefix search without pg_trgm (see database.SEARCH_CLIENTS_PREFIX); text_pattern_ops serves LIKE 'abc%'
+    # in any collation
+    concurrent_index(8, "Prefix index on client names", "clients_lower_name_prefix_idx",
+                     "INDEX CONCURRENTLY {name} ON clients (LOWER(name) text_pattern_ops)"),
+    concurrent_index(9, "Prefix index on client addresses", "clients_lower_address_prefix_idx",
+                     "INDEX CONCURRENTLY {name} ON clients (LOWER(address) text_pattern_ops)"),
+    # the column held whole epoch seconds; the USING clause converts (backfills) every existing value while the
+    # table is rewritten, so the step is atomic but locks tax_returns for the duration of the rewrite
+    Migration(10, "Store filing times as TIMESTAMPTZ", (
+        """ALTER TABLE tax_returns ALTER COLUMN tax_return_timestamp TYPE TIMESTAMPTZ
+        USING to_timestamp(tax_return_timestamp);""",
+    ), False),
+    # a B-tree rather than BRIN: filing updates land anywhere in the table, so block ranges do not follow time
+    concurrent_index(11, "Index tax returns by filing time", "tax_returns_filed_at_idx",
+                     "INDEX CONCURRENTLY {name} ON tax_returns (tax_return_timestamp) "
+                     "WHERE tax_return_timestamp IS NOT NULL"),
+    Migration(12, "Partition tax returns by tax year", partition_tax_returns_statements, False),
+    # status change feed (see change_feed.py): row triggers send a JSON payload on the `status_changes` channel for
+    # every changed status column. NOTIFY is only delivered when the transaction commits, and identical payloads
+    # within one transaction are delivered once. The tax_returns trigger is cloned onto every partition.
+    Migration(13, "Notify status changes of clients and tax returns", (
+        """CREATE OR REPLACE FUNCTION notify_client_status_change() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM pg_notify('status_changes', json_build_object(
+                'client_id', NEW.id, 'field', 'materials_submitted', 'value', NEW.materials_submitted)::text);
+            RETURN NULL;
+        END $$;""",
+        """CREATE OR REPLACE FUNCTION notify_tax_return_status_change() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF OLD.filed_or_not IS DISTINCT FROM NEW.filed_or_not THEN
+                PERFORM pg_notify('status_changes', json_build_object(
+                    'client_id', NEW.client_id, 'tax_year', NEW.tax_year, 'field', 'filed_or_not',
+                    'value', NEW.filed_or_not)::text);
+            END IF;
+            IF OLD.checked_by IS DISTINCT FROM NEW.checked_by THEN
+                PERFORM pg_notify('status_changes', json_build_object(
+                    'client_id', NEW.client_id, 'tax_year', NEW.tax_year, 'field', 'checked_by',
+                    'value', NEW.checked_by)::text);
+            END IF;
+            RETURN NULL;
+        END $$;""",
+        "DROP TRIGGER IF EXISTS clients_status_notify ON clients;",
+        """CREATE TRIGGER clients_status_notify AFTER UPDATE OF materials_submitted ON clients FOR EACH ROW
+        WHEN (OLD.materials_submitted IS DISTINCT FROM NEW.materials_submitted)
+        EXECUTE FUNCTION notify_client_status_change();""",
+        "DROP TRIGGER IF EXISTS tax_returns_status_notify ON tax_returns;",
+        """CREATE TRIGGER tax_returns_status_notify AFTER UPDATE OF filed_or_not, checked_by ON tax_returns
+        FOR EACH ROW WHEN (OLD.filed_or_not IS DISTINCT FROM NEW.filed_or_not
+                           OR OLD.checked_by IS DISTINCT FROM NEW.checked_by)
+        EXECUTE FUNCTION notify_tax_return_status_change();""",
+    ), False),
+    # estimated liabilities written back by tax_engine.estimate_taxes, one row per client and tax year
+    Migration(14, "Add the tax_estimates table", (
+        """CREATE TABLE IF NOT EXISTS tax_estimates
+        (client_id INTEGER NOT NULL REFERENCES clients(id) ON DELETE CASCADE, tax_year SMALLINT NOT NULL,
+         filing_status TEXT NOT NULL, liability NUMERIC(14, 2) NOT NULL, marginal_rate NUMERIC(5, 4) NOT NULL,
+         effective_rate NUMERIC(5, 4) NOT NULL, estimated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+         PRIMARY KEY (client_id, tax_year));""",
+    ), False),
+    # dashboard summaries (dashboard.py): client and tax return counts per CPA / assistant (staff_id 0 stands for
+    # unassigned), kept current by statement-level triggers that add up the changed rows of each statement from its
+    # transition tables. A transition table trigger handles one event, so every table has one per event;
+    # `rebuild_staff_summaries` recounts everything (or one tax year) for repair and fills the tables initially.
+    Migration(15, "Add dashboard summaries maintained by triggers", (
+        """CREATE TABLE IF NOT EXISTS staff_client_summary
+        (role TEXT NOT NULL, staff_id INTEGER NOT NULL, clients INTEGER NOT NULL DEFAULT 0,
+         materials_submitted INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (role, staff_id));""",
+        """CREATE TABLE IF NOT EXISTS staff_return_summary
+        (role TEXT NOT NULL, staff_id INTEGER NOT NULL, tax_year SMALLINT NOT NULL, returns INTEGER NOT NULL DEFAULT 0,
+         filed INTEGER NOT NULL DEFAULT 0, filed_by_cpa INTEGER NOT NULL DEFAULT 0,
+         filed_by_assistant INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (role, staff_id, tax_year));""",
+        REFRESH_STAFF_CLIENT_SUMMARY,
+        REFRESH_STAFF_RETURN_SUMMARY,
+        # locks out writers while recounting, so no change is counted twice or missed
+        """CREATE OR REPLACE FUNCTION rebuild_staff_summaries(only_tax_year SMALLINT DEFAULT NULL) RETURNS void
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            LOCK TABLE clients, tax_returns IN SHARE ROW EXCLUSIVE MODE;
+            IF only_tax_year IS NULL THEN
+                DELETE FROM staff_client_summary;
+                INSERT INTO staff_client_summary (role, staff_id, clients, materials_submitted)
+                SELECT staff.role, staff.staff_id, COUNT(*), COUNT(*) FILTER (WHERE clients.materials_submitted)
+                FROM clients
+                CROSS JOIN LATERAL (VALUES ('cpa', COALESCE(clients.cpa_id, 0)),
+                                           ('assistant', COALESCE(clients.assistant_id, 0))) AS staff(role, staff_id)
+                GROUP BY staff.role, staff.staff_id;
+            END IF;
+            DELETE FROM staff_return_summary WHERE only_tax_year IS NULL OR tax_year = only_tax_year;
+            INSERT INTO staff_return_summary
+            (role, staff_id, tax_year, returns, filed, filed_by_cpa, filed_by_assistant)
+            SELECT staff.role, staff.staff_id, tax_returns.tax_year, COUNT(*),
+                   COUNT(*) FILTER (WHERE tax_returns.filed_or_not),
+                   COUNT(*) FILTER (WHERE tax_returns.filed_or_not AND tax_returns.checked_by = 'yes'),
+                   COUNT(*) FILTER (WHERE tax_returns.filed_or_not AND tax_returns.checked_by = 'no')
+            FROM tax_returns
+            JOIN clients ON clients.id = tax_returns.client_id
+            CROSS JOIN LATERAL (VALUES ('cpa', COALESCE(clients.cpa_id, 0)),
+                                       ('assistant', COALESCE(clients.assistant_id, 0))) AS staff(role, staff_id)
+            WHERE only_tax_year IS NULL OR tax_returns.tax_year = only_tax_year
+            GROUP BY staff.role, staff.staff_id, tax_returns.tax_year;
+        END $$;""",
+    ) + statement_triggers("clients", "clients_summary", "refresh_staff_client_summary")
+    + statement_triggers("tax_returns", "tax_returns_summary", "refresh_staff_return_summary") + (
+        "SELECT rebuild_staff_summaries();",
+    ), False),
+    # work queue leases (work_queue.py). Detached and archived tax years get the columns too, so they can still be
+    # attached again. The queue index only covers unfiled returns; like every index on the partitioned table it
+    # cannot be built CONCURRENTLY.
+    Migration(16, "Add work queue leases to tax returns", (
+        """ALTER TABLE tax_returns ADD COLUMN IF NOT EXISTS leased_by INTEGER REFERENCES tax_filing_assistants(id),
+        ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;""",
+        """DO $$
+        DECLARE
+            detached_table REGCLASS;
+        BEGIN
+            FOR detached_table IN
+                SELECT class.oid FROM pg_class class
+                JOIN pg_namespace namespace ON namespace.oid = class.relnamespace
+                WHERE class.relkind = 'r' AND NOT class.relispartition AND class.relname ~ '^tax_returns_[0-9]+$'
+                AND namespace.nspname IN ('public', 'tax_returns_archive')
+            LOOP
+                EXECUTE format('ALTER TABLE %s ADD COLUMN IF NOT EXISTS leased_by INTEGER,
+                                ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ', detached_table);
+            END LOOP;
+        END $$;""",
+        """CREATE INDEX IF NOT EXISTS tax_returns_queue_idx ON tax_returns (tax_year, id)
+        WHERE filed_or_not IS NOT TRUE;""",
+        """CREATE INDEX IF NOT EXISTS tax_returns_leased_by_idx ON tax_returns (leased_by)
+        WHERE leased_by IS NOT NULL;""",
+    ), False),
+    # the summary triggers of migration 15 dropped the filed counts moved by a statement that swapped clients
+    # between CPAs / assistants, and could count a return under the old CPA of a client reassigned concurrently;
+    # replaces them and recounts the summaries once
+    Migration(17, "Fix dashboard summary counting of reassigned clients", (
+        REFRESH_STAFF_CLIENT_SUMMARY,
+        REFRESH_STAFF_RETURN_SUMMARY,
+        "SELECT rebuild_staff_summaries();",
+    ), False),
+]
+
+
+@contextmanager
+def autocommit(connection):
+    """
+    Runs the block in autocommit mode, e.g. for statements that cannot run inside a transaction block.
+    """
+    connection.autocommit = True
+    try:
+        yield connection
+    finally:
+        connection.autocommit = False
+
+
+def _apply(connection, migration):
+    statements = migration.statements() if callable(migration.statements) else migration.statements
+    if migration.concurrent:
+        with autocommit(connection), connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(INSERT_MIGRATION_VERSION, (migration.version, migration.description))
+    else:
+        with connection:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(INSERT_MIGRATION_VERSION, (migration.version, migration.description))
+
+
+def migrate(connection, migrations=MIGRATIONS):
+    """
+    Applies every migration that has not been recorded in `schema_migrations` yet, in version order.
+    Holds an advisory lock while migrating so concurrent startups do not apply the same step twice.
+    Optional migrations that fail are skipped and not recorded.
+
+    Args:
+        connection (psycopg2.connection): The database connection object.
+        migrations (list of Migration): The migrations to apply. Defaults to `MIGRATIONS`.
+    Returns:
+        list of Migration: The migrations that were applied.
+    """
+    with autocommit(connection), connection.cursor() as cursor:
+        cursor.execute(CREATE_SCHEMA_MIGRATIONS)
+        cursor.execute(LOCK_MIGRATIONS, (MIGRATION_LOCK_KEY, ))
+    try:
+        with autocommit(connection), connection.cursor() as cursor:
+            cursor.execute(SELECT_APPLIED_VERSIONS)
+            applied_versions = {row[0] for row in cursor.fetchall()}
+        pending = sorted((m for m in migrations if m.version not in applied_versions), key=lambda m: m.version)
+        applied = []
+        for migration in pending:
+            try:
+                _apply(connection, migration)
+            except psycopg2.Error:
+                if not migration.optional:
+                    raise
+                continue
+            applied.append(migration)
+        return applied
+    finally:
+        with autocommit(connection), connection.cursor() as cursor:
+            cursor.execute(UNLOCK_MIGRATIONS, (MIGRATION_LOCK_KEY, ))
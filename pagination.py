@@ -0,0 +1,35 @@
+# opaque page tokens for the keyset-paginated listings.
+import base64
+import binascii
+import json
+
+
+def encode_page_token(key):
+    """
+    Encodes the sort key of the last row of a page into a URL-safe token.
+    """
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def decode_page_token(token):
+    """
+    Decodes a token made by `encode_page_token` back into the sort key.
+    Raises:
+        ValueError: If the token is malformed.
+    """
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(token.encode())))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as error:
+        raise ValueError(f"Invalid page token: {token!r}") from error
+
+
+def paginate(rows, page_size, page_key):
+    """
+    Splits the result of a query that asked for `page_size + 1` rows into the page and the token of the next page.
+    Returns:
+        tuple: (rows of this page, token for the next page or None if this is the last page).
+    """
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_page_token(page_key(rows[-1]))
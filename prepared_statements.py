@@ -0,0 +1,62 @@
+# per-connection server-side prepared statements for the fixed query set in database.py.
+import os
+import re
+
+import psycopg2.extensions
+from dotenv import load_dotenv
+
+load_dotenv()
+enabled = os.environ.get("DB_PREPARED_STATEMENTS", "on").lower() not in ("0", "off", "false", "no")
+
+PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s")
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """
+    psycopg2 connection that remembers which statements were prepared on its server session.
+    The pool keeps the connection (and so its prepared statements) across checkouts; a recycled connection
+    starts with an empty set and prepares again on first use.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = {}
+
+
+def to_server_placeholders(query):
+    """
+    Rewrites the `%s` / `%(name)s` placeholders of a query into PostgreSQL's `$1, $2, ...`.
+    Returns:
+        tuple: (rewritten query, list of parameter names in `$n` order, or None for positional parameters).
+    """
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            names.append(None)
+            return f"${len(names)}"
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    rewritten = PLACEHOLDER.sub(replace, query).rstrip().rstrip(";")
+    return rewritten, (names if names and names[0] is not None else None)
+
+
+def execute(cursor, statement_name, query, params=None):
+    """
+    Runs `query` as the prepared statement `statement_name`, preparing it on the cursor's connection first
+    if this connection has not prepared it yet.
+    """
+    prepared = cursor.connection.prepared_statements
+    if statement_name not in prepared:
+        rewritten, names = to_server_placeholders(query)
+        # PREPARE is not transactional, so the statement stays prepared even if the transaction rolls back
+        cursor.execute(f"PREPARE {statement_name} AS {rewritten}")
+        prepared[statement_name] = names
+    names = prepared[statement_name]
+    values = [params[name] for name in names] if names else list(params or ())
+    if values:
+        cursor.execute(f"EXECUTE {statement_name} ({', '.join(['%s'] * len(values))})", values)
+    else:
+        cursor.execute(f"EXECUTE {statement_name}")
@@ -0,0 +1,44 @@
+# shared mapping of database rows to the model classes. Every model declares which result column fills which of
+# its `__init__` arguments (`COLUMNS`); the positions are looked up by column name once per query, not once per row.
+from functools import lru_cache
+from operator import itemgetter
+
+
+def column_names(cursor):
+    """
+    Returns:
+        tuple of str: The names of the result columns of the cursor's last query.
+    """
+    return tuple(column.name for column in cursor.description)
+
+
+@lru_cache(maxsize=256)
+def row_mapper(cls, columns, prefix=""):
+    """
+    Returns a function that builds `cls` objects from rows with the given columns.
+
+    Args:
+        cls (type): A model class with a `COLUMNS` dict of `__init__` argument -> column name, in argument order.
+        columns (tuple of str): The column names of the rows, in order.
+        prefix (str): Prepended to the model's column names, for rows that join several models, e.g. "tax_return_"
+            for `tax_return_id, tax_return_client_id, ...`.
+    Raises:
+        ValueError: If a column the model needs is not among `columns`.
+    """
+    needed = [prefix + column for column in cls.COLUMNS.values()]
+    missing = [column for column in needed if column not in columns]
+    if missing:
+        raise ValueError(f"{cls.__name__} rows need the column(s) {', '.join(missing)}; got {', '.join(columns)}.")
+    positions = [columns.index(column) for column in needed]
+    if len(positions) == 1:
+        return lambda row: cls(row[positions[0]])
+    values = itemgetter(*positions)
+    return lambda row: cls(*values(row))
+
+
+def factory(cls):
+    """
+    Returns a row factory for `cls`, to pass as `row_factory` to the loaders of database.py and async_database.py:
+    called with a query's column names, it returns the `row_mapper` for them.
+    """
+    return lambda columns: row_mapper(cls, tuple(columns))
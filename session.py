@@ -0,0 +1,85 @@
+# unit of work: several model operations on one pooled connection, committed once.
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import entity_cache
+from connection_pool import get_connection
+
+_current_session = ContextVar("current_session", default=None)
+
+
+class Session:
+    """
+    Checks out one connection and runs every model operation given this session (or made while it is the
+    active session, see below) in a single transaction. The transaction is committed when the block ends
+    and rolled back if it raises, so a failing step leaves no partial state behind.
+
+        with Session() as session:
+            client = Client(name, address, income)
+            client.save()                   # uses the active session implicitly
+            TaxReturn.create(client, session=session)
+
+    Reads inside a session bypass the entity cache so they see the session's own uncommitted writes, and the
+    cache entries its writes invalidate are dropped again once it commits (see `invalidate_cached`).
+    """
+    def __init__(self):
+        self.connection = None
+        self._checkout = None
+        self._token = None
+        self._invalidated = set()  # entity cache keys to drop again once the session is committed
+
+    def __enter__(self):
+        self._checkout = get_connection()
+        self.connection = self._checkout.__enter__()
+        self.connection.in_unit_of_work = True
+        self._token = _current_session.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_session.reset(self._token)
+        try:
+            if exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.connection.in_unit_of_work = False
+            self._checkout.__exit__(exc_type, exc_value, traceback)
+            self.connection = None
+        if exc_type is None:
+            entity_cache.invalidate(*self._invalidated)
+        self._invalidated.clear()
+        return False
+
+
+def current_session(session=None):
+    """
+    Returns the given session, or the session active in the current context (thread / task), or None.
+    """
+    return session or _current_session.get()
+
+
+def invalidate_cached(*keys, session=None):
+    """
+    Drops entity cache entries after a write. Inside a session they are dropped again once it commits, since until
+    then other threads still read the rows as they were before the session, and may cache them again.
+    """
+    entity_cache.invalidate(*keys)
+    session = current_session(session)
+    if session is not None:
+        session._invalidated.update(keys)
+
+
+@contextmanager
+def use_connection(session=None, read_only=False):
+    """
+    Yields the connection of the given or active session, or checks out a pooled connection
+    for a single operation when there is no session. `read_only` operations may use the read replica
+    (see `connection_pool.get_connection`); inside a session they always use the session's connection.
+    """
+    session = current_session(session)
+    if session is not None:
+        yield session.connection
+    else:
+        with get_connection(read_only) as connection:
+            yield connection
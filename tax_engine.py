@@ -0,0 +1,200 @@
+# estimated tax liability of the whole client book from `clients.income`, with progressive bracket tables per
+# tax year and filing status. All incomes are computed in one vectorized NumPy pass: the bracket of every income is
+# found with `searchsorted` over the bracket floors, and the tax owed below each floor is precomputed once per table.
+# NumPy is optional (see requirements.txt); without it the same computation runs per client with `bisect`.
+import bisect
+import json
+import os
+import time
+from collections import namedtuple
+
+from dotenv import load_dotenv
+
+import database
+import tax_years
+from connection_pool import get_connection
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+load_dotenv()
+FILING_STATUSES = ("single", "married_joint", "married_separate", "head_of_household")
+DEFAULT_FILING_STATUS = "single"
+
+# US federal brackets: (floor of the bracket, marginal rate) per filing status, plus the standard deduction that
+# is subtracted from the income first. Override or extend them with a TAX_BRACKETS_FILE (see `load_bracket_tables`).
+DEFAULT_BRACKETS = {
+    2024: {
+        "single": (14600, ((0, 0.10), (11600, 0.12), (47150, 0.22), (100525, 0.24), (191950, 0.32),
+                           (243725, 0.35), (609350, 0.37))),
+        "married_joint": (29200, ((0, 0.10), (23200, 0.12), (94300, 0.22), (201050, 0.24), (383900, 0.32),
+                                  (487450, 0.35), (731200, 0.37))),
+        "married_separate": (14600, ((0, 0.10), (11600, 0.12), (47150, 0.22), (100525, 0.24), (191950, 0.32),
+                                     (243725, 0.35), (365600, 0.37))),
+        "head_of_household": (21900, ((0, 0.10), (16550, 0.12), (63100, 0.22), (100500, 0.24), (191950, 0.32),
+                                      (243700, 0.35), (609350, 0.37))),
+    },
+    2025: {
+        "single": (15000, ((0, 0.10), (11925, 0.12), (48475, 0.22), (103350, 0.24), (197300, 0.32),
+                           (250525, 0.35), (626350, 0.37))),
+        "married_joint": (30000, ((0, 0.10), (23850, 0.12), (96950, 0.22), (206700, 0.24), (394600, 0.32),
+                                  (501050, 0.35), (751600, 0.37))),
+        "married_separate": (15000, ((0, 0.10), (11925, 0.12), (48475, 0.22), (103350, 0.24), (197300, 0.32),
+                                     (250525, 0.35), (375800, 0.37))),
+        "head_of_household": (22500, ((0, 0.10), (17000, 0.12), (64850, 0.22), (103350, 0.24), (197300, 0.32),
+                                      (250500, 0.35), (626350, 0.37))),
+    },
+}
+
+TaxEstimates = namedtuple("TaxEstimates", ["tax_year", "filing_status", "client_ids", "incomes", "liabilities",
+                                           "marginal_rates", "effective_rates", "seconds"])
+TaxEstimates.__doc__ = """
+The estimates of `estimate_taxes`: parallel sequences (NumPy arrays, or lists without NumPy) with one entry per
+client, and the seconds the computation itself took.
+"""
+
+
+class BracketTable(namedtuple("BracketTable", ["floors", "rates", "standard_deduction", "base_tax"])):
+    """
+    A progressive bracket table: `rates[i]` is charged on the taxable income between `floors[i]` and
+    `floors[i + 1]`; `base_tax[i]` is the tax owed on an income of exactly `floors[i]`.
+    """
+    @classmethod
+    def from_brackets(cls, brackets, standard_deduction=0):
+        """
+        Args:
+            brackets (iterable of tuple): (floor, rate) pairs; the first floor must be 0.
+            standard_deduction (float): Subtracted from the income before the brackets are applied.
+        Raises:
+            ValueError: If the floors do not start at 0 or are not increasing.
+        """
+        floors, rates = zip(*sorted(brackets))
+        if floors[0] != 0 or len(set(floors)) != len(floors):
+            raise ValueError("Bracket floors must start at 0 and be distinct.")
+        base_tax = [0.0]
+        for index in range(1, len(floors)):
+            base_tax.append(base_tax[-1] + (floors[index] - floors[index - 1]) * rates[index - 1])
+        return cls(tuple(floors), tuple(rates), standard_deduction, tuple(base_tax))
+
+
+def load_bracket_tables(path=None):
+    """
+    Returns the bracket tables: DEFAULT_BRACKETS, updated with the JSON file at `path` (default: TAX_BRACKETS_FILE)
+    if there is one. The file has the same shape as DEFAULT_BRACKETS:
+    `{"2026": {"single": {"standard_deduction": 15750, "brackets": [[0, 0.1], [12400, 0.12], ...]}}}`.
+
+    Returns:
+        dict: {tax_year: {filing_status: BracketTable}}.
+    """
+    tables = {year: {status: BracketTable.from_brackets(brackets, deduction)
+                     for status, (deduction, brackets) in statuses.items()}
+              for year, statuses in DEFAULT_BRACKETS.items()}
+    path = path or os.environ.get("TAX_BRACKETS_FILE")
+    if path:
+        with open(path, encoding="utf-8") as file:
+            for year, statuses in json.load(file).items():
+                for status, table in statuses.items():
+                    tables.setdefault(int(year), {})[status] = BracketTable.from_brackets(
+                        table["brackets"], table.get("standard_deduction", 0))
+    return tables
+
+
+def bracket_table(tax_year, filing_status=DEFAULT_FILING_STATUS, tables=None):
+    """
+    Returns the BracketTable of a tax year and filing status; a year without its own table uses the latest
+    earlier one.
+
+    Raises:
+        ValueError: If there is no table for the filing status in or before the tax year.
+    """
+    tables = tables or load_bracket_tables()
+    years = [year for year in tables if year <= tax_year and filing_status in tables[year]]
+    if not years:
+        raise ValueError(f"No tax brackets for filing status '{filing_status}' in or before {tax_year}.")
+    return tables[max(years)][filing_status]
+
+
+def compute(incomes, table):
+    """
+    Computes the liability, marginal rate and effective rate (liability / income) of many incomes at once.
+    Negative incomes count as 0.
+
+    Args:
+        incomes (sequence of float): The incomes; a NumPy array avoids a conversion.
+        table (BracketTable): The brackets to apply.
+    Returns:
+        tuple: (liabilities, marginal rates, effective rates), NumPy arrays or, without NumPy, lists.
+    """
+    if numpy is None:
+        return _compute_python(incomes, table)
+    incomes = numpy.asarray(incomes, dtype=numpy.float64)
+    floors = numpy.asarray(table.floors, dtype=numpy.float64)
+    rates = numpy.asarray(table.rates, dtype=numpy.float64)
+    taxable = numpy.maximum(incomes - table.standard_deduction, 0.0)
+    brackets = numpy.searchsorted(floors, taxable, side="right") - 1
+    liabilities = numpy.asarray(table.base_tax)[brackets] + (taxable - floors[brackets]) * rates[brackets]
+    # incomes inside the standard deduction owe nothing, so their marginal rate is 0 as well
+    marginal_rates = numpy.where(taxable > 0, rates[brackets], 0.0)
+    effective_rates = numpy.divide(liabilities, incomes, out=numpy.zeros_like(liabilities), where=incomes > 0)
+    return liabilities, marginal_rates, effective_rates
+
+
+def _compute_python(incomes, table):
+    liabilities, marginal_rates, effective_rates = [], [], []
+    for income in incomes:
+        taxable = max(income - table.standard_deduction, 0)
+        bracket = bisect.bisect_right(table.floors, taxable) - 1
+        liability = table.base_tax[bracket] + (taxable - table.floors[bracket]) * table.rates[bracket]
+        liabilities.append(liability)
+        marginal_rates.append(table.rates[bracket] if taxable > 0 else 0.0)
+        effective_rates.append(liability / income if income > 0 else 0.0)
+    return liabilities, marginal_rates, effective_rates
+
+
+def estimate_taxes(tax_year=None, filing_status=DEFAULT_FILING_STATUS, write=False, tables=None):
+    """
+    Estimates the tax liability of every client with an income, loading all incomes in one query.
+    The clients have no filing status of their own, so one `filing_status` applies to the whole book.
+
+    Args:
+        tax_year (int): The tax year of the brackets. Defaults to the current season.
+        filing_status (str): One of FILING_STATUSES.
+        write (bool): Also store the estimates in the `tax_estimates` table, in one statement.
+        tables (dict): Bracket tables as returned by `load_bracket_tables`; loaded when not given.
+    Returns:
+        TaxEstimates: The estimates, in client id order.
+    Raises:
+        ValueError: If there are no brackets for the year and filing status.
+    """
+    tax_year = tax_years.default_tax_year() if tax_year is None else tax_year
+    table = bracket_table(tax_year, filing_status, tables)
+    with get_connection(read_only=not write) as connection:
+        client_ids, incomes = database.get_client_incomes(connection)
+        if numpy is not None:
+            client_ids, incomes = numpy.asarray(client_ids, dtype=numpy.int64), numpy.asarray(incomes, numpy.float64)
+        started = time.perf_counter()
+        liabilities, marginal_rates, effective_rates = compute(incomes, table)
+        seconds = time.perf_counter() - started
+        if write:
+            database.save_tax_estimates(connection, tax_year, filing_status, _list(client_ids),
+                                        _list(liabilities), _list(marginal_rates), _list(effective_rates))
+    return TaxEstimates(tax_year, filing_status, client_ids, incomes, liabilities, marginal_rates, effective_rates,
+                        seconds)
+
+
+def totals_by_rate(estimates):
+    """
+    Returns:
+        list of tuple: (marginal rate, clients, summed liability) per marginal rate of the estimates, lowest first.
+    """
+    totals = {}
+    for rate, liability in zip(_list(estimates.marginal_rates), _list(estimates.liabilities)):
+        clients, total = totals.get(rate, (0, 0.0))
+        totals[rate] = (clients + 1, total + liability)
+    return [(rate, clients, total) for rate, (clients, total) in sorted(totals.items())]
+
+
+def _list(values):
+    return values.tolist() if numpy is not None else list(values)
@@ -0,0 +1,89 @@
+# tax years (filing seasons) and the yearly partitions of the tax_returns table that hold them.
+import datetime
+import os
+from collections import namedtuple
+
+from dotenv import load_dotenv
+
+import database
+from connection_pool import get_connection
+
+load_dotenv()
+TaxYearTable = namedtuple("TaxYearTable", ["tax_year", "status", "estimated_rows", "bytes"])
+
+
+def configured_tax_year():
+    """
+    Returns:
+        int or None: TAX_YEAR from the environment (or .env file), or None if it is not set.
+    """
+    tax_year = os.environ.get("TAX_YEAR", "").strip()
+    return int(tax_year) if tax_year else None
+
+
+def default_tax_year():
+    """
+    Returns:
+        int: The tax year used when none is given: TAX_YEAR from the environment (or .env file), otherwise the
+        previous calendar year, since returns are filed in the year after the one they cover.
+    """
+    tax_year = configured_tax_year()
+    return datetime.date.today().year - 1 if tax_year is None else tax_year
+
+
+def list_tax_years():
+    """
+    Returns:
+        list of TaxYearTable: Every tax year table with its status: "active" (a partition of tax_returns),
+        "detaching" (an interrupted detach, finished by `archive_tax_year`), "detached" or "archived".
+    """
+    with get_connection() as connection:
+        return [TaxYearTable(*row) for row in database.get_tax_year_tables(connection)]
+
+
+def _status(connection, tax_year):
+    return {row[0]: row[1] for row in database.get_tax_year_tables(connection)}.get(tax_year)
+
+
+def create_tax_year(tax_year):
+    """
+    Creates the partition for a tax year ahead of the season. Inserting a return creates it as well.
+    """
+    with get_connection() as connection:
+        database.ensure_tax_year_partition(connection, tax_year)
+
+
+def archive_tax_year(tax_year):
+    """
+    Detaches a past tax year from tax_returns and moves its table to the `tax_returns_archive` schema.
+    The detach runs CONCURRENTLY, so reads and writes of the other years (the current season's hot partition
+    included) go on meanwhile. The returns of an archived year are no longer found through the models.
+
+    Raises:
+        ValueError: If the tax year is the current season or later, or has no table that can be archived.
+    """
+    if tax_year >= default_tax_year():
+        raise ValueError(f"Only past tax years can be archived; {tax_year} is the current season or later.")
+    with get_connection() as connection:
+        status = _status(connection, tax_year)
+        if status is None or status == "archived":
+            raise ValueError(f"There is no tax year {tax_year} to archive.")
+        if status in ("active", "detaching"):
+            database.detach_tax_year_partition(connection, tax_year, finalize=status == "detaching")
+        database.archive_tax_year_table(connection, tax_year)
+        database.rebuild_staff_summaries(connection, tax_year)  # detaching bypasses the dashboard triggers
+
+
+def restore_tax_year(tax_year):
+    """
+    Moves an archived (or detached) tax year back and attaches it to tax_returns again.
+
+    Raises:
+        ValueError: If the tax year has no archived or detached table.
+    """
+    with get_connection() as connection:
+        status = _status(connection, tax_year)
+        if status not in ("archived", "detached"):
+            raise ValueError(f"There is no archived tax year {tax_year} to restore.")
+        database.attach_tax_year_table(connection, tax_year, from_archive=status == "archived")
+        database.rebuild_staff_summaries(connection, tax_year)
@@ -0,0 +1,89 @@
+# work queue of the unfiled tax returns whose materials are submitted. Assistants claim returns for a limited time
+# (a lease) instead of picking clients by name, so any number of workers can drain the queue at once without
+# waiting on each other or filing the same return twice.
+import datetime
+import os
+from collections import namedtuple
+
+import psycopg2
+import pytz
+from dotenv import load_dotenv
+
+import database
+import entity_cache
+import tax_years
+from connection_pool import get_connection
+
+load_dotenv()
+DEFAULT_LEASE_SECONDS = float(os.environ.get("WORK_QUEUE_LEASE_SECONDS", 15 * 60))
+
+ClaimedReturn = namedtuple("ClaimedReturn", ["tax_return_id", "client_id", "client_name", "tax_year",
+                                             "lease_expires_at"])
+QueueCounts = namedtuple("QueueCounts", ["waiting", "leased"])
+
+
+def _tax_year(year):
+    return tax_years.default_tax_year() if year is None else year
+
+
+def claim_next(n, assistant_id, year=None, lease_seconds=None):
+    """
+    Leases the next `n` unfiled tax returns whose materials are submitted (oldest return first) to an assistant.
+    Returns leased by someone else are skipped until their lease expires, so concurrent callers always get
+    different returns and never block each other.
+
+    Args:
+        n (int): The maximum number of returns to claim.
+        assistant_id (int): The claiming tax filing assistant.
+        year (int): The tax year of the returns. Defaults to the current season.
+        lease_seconds (float): How long the returns stay leased (default: WORK_QUEUE_LEASE_SECONDS or 15 minutes).
+    Returns:
+        list of ClaimedReturn: The claimed returns; fewer than `n` (or none) when the queue runs dry.
+    Raises:
+        ValueError: If there is no assistant with that ID.
+    """
+    lease_seconds = DEFAULT_LEASE_SECONDS if lease_seconds is None else lease_seconds
+    try:
+        with get_connection() as connection:
+            rows = database.claim_tax_returns(connection, assistant_id, _tax_year(year), n, lease_seconds)
+    except psycopg2.errors.ForeignKeyViolation:
+        raise ValueError(f"There is no tax filing assistant with ID {assistant_id}.") from None
+    return [ClaimedReturn(*row) for row in rows]
+
+
+def complete(assistant_id, client_ids, year=None):
+    """
+    Marks the claimed tax returns of the given clients as filed by the assistant and ends their leases.
+    A return whose lease expired is still completed unless another assistant has claimed it since.
+
+    Returns:
+        list of int: The IDs of the clients whose return was filed.
+    """
+    year = _tax_year(year)
+    with get_connection() as connection:
+        completed = database.complete_tax_return_leases(connection, assistant_id, year, client_ids, "no",
+                                                        datetime.datetime.now(tz=pytz.utc))
+    entity_cache.invalidate(*[("tax_return", client_id, year) for client_id in completed])
+    return completed
+
+
+def release(assistant_id, client_ids=None, year=None):
+    """
+    Gives claimed tax returns back to the queue unfiled, e.g. when their materials turn out to be incomplete.
+
+    Args:
+        client_ids (list of int): The clients whose returns to release. None releases all of the assistant's.
+    Returns:
+        list of int: The IDs of the clients whose return was released.
+    """
+    with get_connection() as connection:
+        return database.release_tax_return_leases(connection, assistant_id, _tax_year(year), client_ids)
+
+
+def counts(year=None):
+    """
+    Returns:
+        QueueCounts: The number of returns waiting to be claimed and currently leased.
+    """
+    with get_connection(read_only=True) as connection:
+        return QueueCounts(*database.get_work_queue_counts(connection, _tax_year(year)))
@@ -0,0 +1,282 @@
+# optional write-behind mode for the small status writes (materials submitted, tax return filed) of interactive
+# sessions and intake scanners. Writes go into an in-process buffer that keeps only the latest status per client /
+# tax return, and a background thread writes the buffer in one transaction, with one multi-row UPDATE per table,
+# every `flush_interval` seconds or as soon as `max_items` statuses are waiting.
+# The point reads of the models (`Client.get`, `TaxReturn.get`, `TaxReturn.is_filed`, ...) see the buffered
+# statuses right away; listings and reports see them once they are flushed.
+# Buffered writes are lost if the process dies before they are flushed; pass `sync=True` (or call `flush`) for
+# the writes that must be committed before going on. Off by default; turn on with WRITE_BEHIND=on.
+import atexit
+import os
+import sys
+import threading
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.pool import PoolError
+
+import database
+import entity_cache
+from session import Session
+
+load_dotenv()
+enabled = os.environ.get("WRITE_BEHIND", "off").lower() in ("1", "on", "true", "yes")
+DEFAULT_FLUSH_INTERVAL = float(os.environ.get("WRITE_BEHIND_INTERVAL_MS", 200)) / 1000
+DEFAULT_MAX_ITEMS = int(os.environ.get("WRITE_BEHIND_MAX_ITEMS", 500))
+
+# errors of the connection rather than of the statuses; the statuses stay buffered and are retried
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError)
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+class WriteBehindBuffer:
+    """
+    Buffers status writes and flushes them in batches from a background thread, started with the first write.
+    A later write to the same client's materials or the same tax return replaces the buffered one (it is
+    coalesced), so only the last status is written. Flushes write the statuses the way
+    `database.change_materials_status` and `database.change_tax_return_status` do.
+
+    When a flush fails on a status itself (e.g. a tax year out of range), the statuses are written one by one and
+    those that still fail are dropped from the buffer and kept in `failed()`, so they do not hold up the others.
+    """
+    def __init__(self, flush_interval=None, max_items=None):
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.max_items = DEFAULT_MAX_ITEMS if max_items is None else max_items
+        self.last_error = None
+        # ("materials", client name) -> materials_submitted
+        # ("tax_return", client_id, tax_year) -> (filed_or_not, checked_by, tax_return_timestamp)
+        self._pending = {}
+        self._flushing = {}  # the statuses of the running flush, until it is committed
+        self._failed = {}    # key -> (status, error) of the statuses that could not be written
+        self._stats = {"enqueued": 0, "coalesced": 0, "flushed": 0, "flushes": 0, "failed_flushes": 0}
+        self._lock = threading.Lock()        # guards the statuses and the counters
+        self._flush_lock = threading.Lock()  # one flush at a time, so flushes commit in order
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def change_materials_status(self, client_name, materials_submitted, sync=False):
+        """
+        Buffers `database.change_materials_status`.
+
+        Args:
+            sync (bool): Return only once the status (and everything buffered before it) is committed.
+        Raises:
+            psycopg2.Error: With `sync`, if the status could not be written.
+        """
+        entity_cache.invalidate(("client_name", client_name.lower()))
+        self._add(("materials", client_name), materials_submitted, sync)
+
+    def change_tax_return_status(self, client_id, tax_year, filed_or_not, checked_by, tax_return_timestamp,
+                                 sync=False):
+        """
+        Buffers `database.change_tax_return_status`.
+
+        Args:
+            sync (bool): Return only once the status (and everything buffered before it) is committed.
+        Raises:
+            psycopg2.Error: With `sync`, if the status could not be written.
+        """
+        entity_cache.invalidate(("tax_return", client_id, tax_year))
+        self._add(("tax_return", client_id, tax_year), (filed_or_not, checked_by, tax_return_timestamp), sync)
+
+    def _add(self, key, status, sync):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The write-behind buffer is closed.")
+            self._stats["enqueued"] += 1
+            self._stats["coalesced"] += key in self._pending
+            self._pending[key] = status
+            self._failed.pop(key, None)
+            full = len(self._pending) >= self.max_items
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+        if sync:
+            self.flush()
+            with self._lock:
+                failed_status, error = self._failed.get(key, (None, None))
+            if error is not None and failed_status == status:
+                raise error
+        elif full:
+            self._wake.set()
+
+    def pending_status(self, key):
+        """
+        Returns:
+            The buffered status of a key (see `__init__`) that is not committed yet, or None.
+        """
+        with self._lock:
+            return self._pending.get(key, self._flushing.get(key))
+
+    def flush(self):
+        """
+        Writes every buffered status in one transaction and returns once it is committed.
+        If the database cannot be reached, the statuses go back into the buffer (behind any newer ones) and the
+        error is raised.
+
+        Returns:
+            int: The number of statuses written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                statuses, self._pending = self._pending, {}
+                self._flushing = dict(statuses)
+            if not statuses:
+                return 0
+            try:
+                try:
+                    written = self._write(statuses)
+                except TRANSIENT_ERRORS:
+                    raise
+                except Exception as error:
+                    # the batch failed on one of its statuses: write them one by one to find it
+                    self._failure(error)
+                    written = self._write_each(statuses)
+            except Exception as error:
+                with self._lock:
+                    self._pending = {**statuses, **self._pending}
+                self._failure(error)
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            with self._lock:
+                self._stats["flushed"] += len(written)
+                self._stats["flushes"] += 1
+            return len(written)
+
+    def _write_each(self, statuses):
+        # takes every status out of `statuses` once it is written or dropped, so that on a connection error only
+        # the remaining ones go back into the buffer
+        written = {}
+        for key, status in list(statuses.items()):
+            try:
+                written.update(self._write({key: status}))
+            except TRANSIENT_ERRORS:
+                raise
+            except Exception as error:
+                with self._lock:
+                    if key not in self._pending:  # unless a newer status replaces it anyway
+                        self._failed[key] = (status, error)
+            del statuses[key]
+        return written
+
+    @staticmethod
+    def _write(statuses):
+        # rows are written in key order, so concurrent flushes of several processes lock them in the same order
+        materials, tax_returns = [], []
+        for key in sorted(statuses):
+            if key[0] == "materials":
+                materials.append((key[1], statuses[key]))
+            else:
+                tax_returns.append(key[1:] + statuses[key])
+        with Session() as session:
+            changed_clients = database.set_materials_status_many(session.connection, materials)
+            changed_returns = database.set_tax_return_status_many(session.connection, tax_returns)
+        entity_cache.invalidate(*[key for client_id, name in changed_clients
+                                  for key in (("client_id", client_id), ("client_name", name.lower()))])
+        entity_cache.invalidate(*[("tax_return", client_id, tax_year) for client_id, tax_year in changed_returns])
+        return statuses
+
+    def _failure(self, error):
+        with self._lock:
+            self._stats["failed_flushes"] += 1
+            self.last_error = error
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass  # counted in `stats`; the statuses are retried with the next flush
+
+    def stats(self):
+        """
+        Returns:
+            dict: `enqueued` writes, `coalesced` writes (replaced by a later write before being flushed), `flushed`
+            statuses, `flushes`, `failed_flushes`, the `pending` statuses, the `failed` statuses that were dropped
+            (see `failed`) and the `last_error` message (or None).
+        """
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending), failed=len(self._failed),
+                        last_error=str(self.last_error).strip() if self.last_error else None)
+
+    def failed(self):
+        """
+        Returns:
+            list of tuple: (key, status, error) of the statuses that were dropped because they could not be written,
+            e.g. `(("tax_return", 12, 99999), (True, "yes", ...), NumericValueOutOfRange(...))`. A later write of
+            the same client / tax return clears its entry.
+        """
+        with self._lock:
+            return [(key, status, error) for key, (status, error) in self._failed.items()]
+
+    def close(self):
+        """
+        Stops the background thread and flushes what is left. Later writes raise RuntimeError.
+        """
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._wake.set()
+            thread.join()
+        self.flush()
+
+
+def _close_at_exit(buffer):
+    try:
+        buffer.close()
+    except Exception as error:
+        print(f"Write-behind: {buffer.stats()['pending']} buffered status(es) were not written: {error}",
+              file=sys.stderr)
+    failed = buffer.failed()
+    if failed:
+        print(f"Write-behind: {len(failed)} status(es) could not be written, e.g. {failed[-1][0]}: "
+              f"{str(failed[-1][2]).strip()}", file=sys.stderr)
+
+
+def get_buffer():
+    """
+    Returns the process-wide buffer used by the models in write-behind mode, creating it on first use.
+    It is flushed when the process exits.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = WriteBehindBuffer()
+                atexit.register(_close_at_exit, _buffer)
+    return _buffer
+
+
+def flush():
+    """
+    Flushes the process-wide buffer, if there is one.
+
+    Returns:
+        int: The number of statuses written.
+    """
+    return _buffer.flush() if _buffer is not None else 0
+
+
+def pending_materials_status(client_name):
+    """
+    Returns:
+        bool or None: The materials status of the client (by exact name) that is buffered but not committed yet.
+    """
+    return _buffer.pending_status(("materials", client_name)) if _buffer is not None else None
+
+
+def pending_tax_return_status(client_id, tax_year):
+    """
+    Returns:
+        tuple or None: (filed_or_not, checked_by, tax_return_timestamp) of the tax return that is buffered but not
+        committed yet.
+    """
+    return _buffer.pending_status(("tax_return", client_id, tax_year)) if _buffer is not None else None